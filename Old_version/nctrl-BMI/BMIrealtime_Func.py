@@ -14,6 +14,7 @@ import spiketag
 from spiketag.realtime import BMI, Binner
 from spiketag.analysis import decoder
 from spiketag.base import probe
+from nctrl.store import SpikeStore, CountPyramid
 
 import serial
 from scipy.ndimage import gaussian_filter1d
@@ -121,23 +122,13 @@ class BMIRealtime:
 
 class GUIView:
     def load_spike(self, spike_file):
-        df = pd.read_pickle(spike_file)
-        n_unit = int(df['spike_id'].max())
-        spike_time = np.zeros(n_unit, dtype=object)
-        spike_fr = np.zeros(n_unit)
-        spike_group = np.zeros(n_unit, dtype=int)
+        store = SpikeStore(spike_file)
+        self.counts = CountPyramid(store)
+        spike_time = np.zeros(store.n_unit, dtype=object)
+        for i_unit in range(store.n_unit):
+            spike_time[i_unit] = store.unit(i_unit) / 25000
 
-        duration = (df['frame_id'].iloc[-1] - df['frame_id'].iloc[0]) / 25000
-
-        for i_unit in range(n_unit):
-            in_unit = df['spike_id'] == (i_unit + 1)
-            if sum(in_unit) == 0:
-                continue
-            spike_group[i_unit] = np.unique(df['group_id'][in_unit])[0]
-            spike_time[i_unit] = df['frame_id'][in_unit].to_numpy() / 25000
-            spike_fr[i_unit] = sum(in_unit) / duration
-
-        return spike_group, spike_time, spike_fr
+        return store.spike_group, spike_time, store.spike_fr
 
     def plot_spike_firing_rate_and_isi(self, spike_file, bin_size=1.0):
         _, spike_times, spike_fr = self.load_spike(spike_file)
@@ -164,7 +155,7 @@ class GUIView:
             axes[i_unit, 1].set_ylabel("Count")
             
             # Calculate and plot Firing Rate distribution in 1-second windows
-            bin_count, bins = np.histogram(spike_time, np.arange(0, spike_time[-1] + bin_size, bin_size))
+            bin_count = self.counts.counts(bin_size, [i_unit])[0]
             
             # Plot FR distribution
             spike_count, spike_bins = np.histogram(bin_count, 50)
@@ -1,2 +1,21 @@
-from .core import *
-from .unit import *
\ No newline at end of file
+# the public classes are imported on first use, so `import nctrl` (and the
+# headless CLI) does not pull in PyQt5, vispy, matplotlib or ipywidgets
+_LAZY = {
+    'NCtrl': 'nctrl.core',
+    'Unit': 'nctrl.unit',
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        import importlib
+        value = getattr(importlib.import_module(_LAZY[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,228 @@
+'''
+Benchmarks of the decode path and the offline loaders on synthetic sessions.
+
+    python -m nctrl.bench --n-unit 50 --duration 600 --out bench.json
+
+Every result is written to one JSON file (with the git commit, library versions
+and parameters) so runs of different commits can be compared.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import numpy as np
+import pandas as pd
+
+from nctrl.utils import tprint
+
+
+FS = 25000
+
+
+def generate(path='./bench_data', n_unit=20, duration=300, rate=5.0, burst_fraction=0.3, burst_size=4,
+             burst_isi=0.004, unsorted_fraction=0.2, n_group=4, n_samples=20, n_ch=4, seed=0):
+    '''
+    Write a synthetic session into path: spktag/model.pd, fet.bin and spk_wav.bin.
+
+    Each unit fires at `rate` Hz, a burst_fraction of its spikes in bursts of
+    about burst_size spikes burst_isi apart (the rest Poisson); unsorted spikes
+    (spike_id 0) add unsorted_fraction on top. Returns the model.pd path.
+    '''
+    rng = np.random.default_rng(seed)
+    frames, spike_ids = [], []
+    for unit_id in range(1, n_unit + 1):
+        unit_rate = rate * rng.lognormal(0, 0.5)
+        n_single = rng.poisson(unit_rate * (1 - burst_fraction) * duration)
+        n_burst = rng.poisson(unit_rate * burst_fraction * duration / burst_size)
+        onset = rng.uniform(0, duration, n_burst)
+        size = rng.geometric(1 / burst_size, n_burst)
+        burst = np.repeat(onset, size) + burst_isi * (np.arange(size.sum()) - np.repeat(np.cumsum(size) - size, size))
+        t = np.r_[rng.uniform(0, duration, n_single), burst]
+        frames.append((t * FS).astype(np.int64))
+        spike_ids.append(np.full(len(t), unit_id))
+    n_unsorted = rng.poisson(unsorted_fraction * sum(len(f) for f in frames))
+    frames.append(rng.integers(0, duration * FS, n_unsorted))
+    spike_ids.append(np.zeros(n_unsorted, dtype=np.int64))
+
+    frame_id = np.concatenate(frames)
+    spike_id = np.concatenate(spike_ids)
+    keep = frame_id < duration * FS
+    order = np.argsort(frame_id[keep], kind='stable')
+    frame_id, spike_id = frame_id[keep][order], spike_id[keep][order]
+    group_id = np.where(spike_id > 0, (spike_id - 1) % n_group, rng.integers(0, n_group, len(spike_id)))
+    n = len(frame_id)
+
+    os.makedirs(os.path.join(path, 'spktag'), exist_ok=True)
+    model_file = os.path.join(path, 'spktag', 'model.pd')
+    pd.DataFrame({'frame_id': frame_id, 'group_id': group_id, 'spike_id': spike_id}).to_pickle(model_file)
+
+    # fet.bin: frame_id, group_id, fet0-3, spike_id, energy
+    fet = np.zeros((n, 8), dtype=np.int32)
+    fet[:, 0], fet[:, 1], fet[:, 6] = frame_id, group_id, spike_id
+    fet[:, 2:6] = rng.integers(-2000, 2000, (n, 4))
+    fet[:, 7] = rng.integers(0, 10000, n)
+    fet.tofile(os.path.join(path, 'fet.bin'))
+
+    # spk_wav.bin: row 0 is the header (peak channel, frame_id, group), rows 1: the waveform
+    spk = rng.integers(-1000, 1000, (n, n_samples, n_ch), dtype=np.int32)
+    spk[:, 0, 1] = rng.integers(0, n_ch, n)
+    spk[:, 0, 2] = frame_id
+    spk[:, 0, 3] = group_id
+    spk.tofile(os.path.join(path, 'spk_wav.bin'))
+
+    tprint(f'nctrl.bench.generate: {n} spikes of {n_unit} units over {duration} s in {path}')
+    return model_file
+
+
+def _stats(dt_ns):
+    dt = np.asarray(dt_ns, dtype=np.float64) / 1e3
+    return {'n': len(dt), 'mean_us': float(dt.mean()), 'p50_us': float(np.percentile(dt, 50)),
+            'p99_us': float(np.percentile(dt, 99)), 'max_us': float(dt.max())}
+
+
+def time_calls(fn, args, warmup=100):
+    # per-call latency of fn(*a) for every a in args
+    for a in args[:warmup]:
+        fn(*a)
+    dt = np.empty(len(args), dtype=np.int64)
+    clock = time.perf_counter_ns
+    for i, a in enumerate(args):
+        t0 = clock()
+        fn(*a)
+        dt[i] = clock() - t0
+    return _stats(dt)
+
+
+def time_once(fn, repeat=3, setup=None):
+    # wall time in s of fn(), best and all of repeat runs
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return {'best_s': min(times), 'runs_s': times}
+
+
+def bench_decoders(model_file, bin_size=0.001, B=10, n_bins=20000):
+    '''
+    predict() of every decoder on consecutive bins of the session; the binner
+    window X is updated outside the timed call, like Binner does before emit
+    '''
+    from nctrl.decoder import FrThreshold, AdaptiveThreshold, FrRules, Spikes, Population
+    from nctrl.store import SpikeStore, CountPyramid
+
+    store = SpikeStore(model_file)
+    counts = CountPyramid(store, levels=()).counts(bin_size, stop=n_bins + B).T.astype(np.float64)
+    n_col = store.n_unit + 1
+    unit_ids = list(range(1, min(n_col, 17)))
+
+    decoders = {
+        'FrThreshold': (FrThreshold(), dict(unit_id=1, nspike=3)),
+        'AdaptiveThreshold': (AdaptiveThreshold(), dict(unit_id=1, nspike=3, target_rate=1.0, bin_size=bin_size)),
+        'FrRules': (FrRules(B=B), dict(rules=[dict(unit_ids=unit_ids, nspike=3, k='any')])),
+        'Spikes': (Spikes(), dict(unit_ids=unit_ids)),
+        'Population': (Population(B=B), dict(W=np.ones((1, n_col)), threshold=B * n_col)),
+    }
+    results = {}
+    for name, (dec, kwargs) in decoders.items():
+        dec.fit(**kwargs)
+        X = np.zeros((B, n_col))
+        dt = np.empty(n_bins, dtype=np.int64)
+        clock = time.perf_counter_ns
+        for i in range(n_bins):
+            X[:-1] = X[1:]
+            X[-1, 1:] = counts[i]
+            t0 = clock()
+            dec.predict(X)
+            dt[i] = clock() - t0
+        results[name] = _stats(dt[100:])
+    return results
+
+
+def bench_output(n_calls=5000):
+    # Laser.__call__ against the Teensy emulator on a pseudo-terminal
+    from nctrl.emulator import TeensyEmulator
+    from nctrl.output import Laser
+
+    results = {}
+    y_spikes = np.zeros(16, dtype=bool)
+    y_spikes[[0, 3]] = True
+    for threaded in (True, False):
+        emulator = TeensyEmulator()
+        emulator.start()
+        laser = Laser(emulator.port, threaded=threaded, maxlen=n_calls)
+        mode = 'threaded' if threaded else 'direct'
+        results[f'laser_{mode}'] = time_calls(laser, [(i & 1,) for i in range(n_calls)])
+        results[f'spikes_{mode}'] = time_calls(laser, [(y_spikes,)] * n_calls)
+        laser.close()
+        emulator.stop()
+    return results
+
+
+def bench_unit(model_file, repeat=3):
+    from nctrl.unit import Unit
+
+    base = os.path.splitext(model_file)[0]
+    def clear_cache():
+        for name in os.listdir(os.path.dirname(model_file)):
+            if name.startswith(os.path.basename(base) + '_'):
+                os.remove(os.path.join(os.path.dirname(model_file), name))
+
+    unit = Unit()
+    spkwav_file = os.path.join(os.path.dirname(os.path.dirname(model_file)), 'spk_wav.bin')
+    results = {
+        'load_cold': time_once(lambda: unit.load(model_file), repeat, setup=clear_cache),
+        'load_warm': time_once(lambda: unit.load(model_file), repeat),
+        'load_spkwav': time_once(lambda: unit.load_spkwav(spkwav_file), repeat),
+        'autocorrelograms': time_once(lambda: unit.ccg.compute(), 1, setup=unit.ccg.clear),
+        # the threshold simulation behind Unit.simulate, over its full slider grid
+        'sweep': time_once(lambda: unit.sweep(), 1),
+        'window_counts_0.001': time_once(lambda: unit.counts.window(0.001, 10), repeat),
+        'window_counts_0.1': time_once(lambda: unit.counts.window(0.1, 10), repeat),
+    }
+    return results
+
+
+def _meta(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+            'numpy': np.__version__, 'pandas': pd.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(), 'params': vars(args)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m nctrl.bench', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--n-unit', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=300)
+    parser.add_argument('--rate', type=float, default=5.0)
+    parser.add_argument('--dir', default='./bench_data')
+    parser.add_argument('--out', default='./bench.json')
+    parser.add_argument('--only', nargs='*', choices=['decoders', 'output', 'unit'], default=['decoders', 'output', 'unit'])
+    args = parser.parse_args(argv)
+
+    model_file = generate(args.dir, n_unit=args.n_unit, duration=args.duration, rate=args.rate)
+    results = {}
+    if 'decoders' in args.only:
+        results['decoders'] = bench_decoders(model_file)
+    if 'output' in args.only:
+        results['output'] = bench_output()
+    if 'unit' in args.only:
+        results['unit'] = bench_unit(model_file)
+
+    with open(args.out, 'w') as f:
+        json.dump({'meta': _meta(args), 'results': results}, f, indent=2)
+    tprint(f'nctrl.bench.main: results written to {args.out}')
+    return results
+
+
+if __name__ == '__main__':
+    main()
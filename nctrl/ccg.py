@@ -0,0 +1,103 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from nctrl.utils import tprint
+
+
+def correlogram(a, b, bin_frames=25, n_half=25, auto=False, chunk=1 << 16):
+    '''
+    Counts of lags b - a (frames) in the 2*n_half bins [-n_half, n_half) * bin_frames.
+
+    a and b are sorted spike frames. Each spike of a is merged only with the
+    spikes of b inside the window (found by searchsorted), so the cost grows with
+    the number of spike pairs within the window, not len(a) * len(b). With auto
+    the zero-lag pairing of every spike with itself is removed.
+    '''
+    window = n_half * bin_frames
+    counts = np.zeros(2 * n_half, dtype=np.int64)
+    for start in range(0, len(a), chunk):
+        t = a[start:start + chunk]
+        lo = np.searchsorted(b, t - window, 'left')
+        hi = np.searchsorted(b, t + window, 'left')
+        n = hi - lo
+        if n.sum() == 0:
+            continue
+        # index into b of every pair: lo repeated, plus its rank within the window
+        first = np.cumsum(n) - n
+        j = np.repeat(lo - first, n) + np.arange(n.sum())
+        lag = b[j] - np.repeat(t, n)
+        counts += np.bincount(lag // bin_frames + n_half, minlength=2 * n_half)
+    if auto:
+        counts[n_half] -= len(a)
+    return counts
+
+
+def _correlograms(jobs, bin_frames, n_half):
+    return [correlogram(a, b, bin_frames, n_half, auto) for a, b, auto in jobs]
+
+
+class Correlograms():
+    '''
+    Lazy cross-correlograms of the units of a SpikeStore.
+
+    ccg[i, j] (0-based units) is computed on first access with the default
+    bin_size and window (s, one-sided) and cached per (pair, bin, window);
+    compute() fills many pairs at once across processes (default: every
+    autocorrelogram). Lags are spike times of j minus those of i.
+    '''
+    def __init__(self, store, bin_size=0.001, window=0.025, n_workers=None):
+        self.store = store
+        self.bin_size = bin_size
+        self.window = window
+        self.n_workers = n_workers if n_workers is not None else os.cpu_count()
+        self._cache = {}
+
+    def _key(self, i, j, bin_size, window):
+        bin_frames = max(int(round(bin_size * self.store.fs)), 1)
+        return (i, j, bin_frames, int(round(window / bin_size)))
+
+    def compute(self, pairs=None, bin_size=None, window=None):
+        bin_size = self.bin_size if bin_size is None else bin_size
+        window = self.window if window is None else window
+        if pairs is None:
+            pairs = [(i, i) for i in range(self.store.n_unit)]
+
+        todo = [(i, j) for i, j in pairs if self._key(i, j, bin_size, window) not in self._cache]
+        if todo:
+            _, _, bin_frames, n_half = self._key(0, 0, bin_size, window)
+            jobs = [(self.store.unit(i), self.store.unit(j), i == j) for i, j in todo]
+            n_workers = min(self.n_workers, len(jobs))
+            if n_workers > 1:
+                batches = [jobs[k::n_workers] for k in range(n_workers)]
+                with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                    results = list(pool.map(_correlograms, batches, [bin_frames] * n_workers, [n_half] * n_workers))
+                counts = [None] * len(jobs)
+                for k, result in enumerate(results):
+                    counts[k::n_workers] = result
+            else:
+                counts = _correlograms(jobs, bin_frames, n_half)
+            for (i, j), c in zip(todo, counts):
+                self._cache[self._key(i, j, bin_size, window)] = c
+            tprint(f'nctrl.ccg.Correlograms: computed {len(todo)} correlograms')
+        return np.array([self._cache[self._key(i, j, bin_size, window)] for i, j in pairs])
+
+    def get(self, i, j, bin_size=None, window=None):
+        return self.compute([(i, j)], bin_size, window)[0]
+
+    def __getitem__(self, pair):
+        i, j = pair
+        return self.get(i, j)
+
+    def lags(self, bin_size=None, window=None):
+        # left edge of every bin in bin units, e.g. np.arange(-25, 25)
+        bin_size = self.bin_size if bin_size is None else bin_size
+        window = self.window if window is None else window
+        n_half = int(round(window / bin_size))
+        return np.arange(-n_half, n_half)
+
+    def clear(self):
+        self._cache.clear()
+
+    def __repr__(self):
+        return f'Correlograms(n_unit={self.store.n_unit}, bin_size={self.bin_size}, window={self.window}, cached={len(self._cache)})'
@@ -0,0 +1,139 @@
+'''
+Headless entry point.
+
+    nctrl run --prb ./probe.prb --decoder fr --unit-id 3 --nspike 5 --bin-size 0.01 --B 10
+    nctrl run --fet ./fet.bin --replay --decoder rules --set "rules=[{'unit_ids': [1, 2], 'nspike': 3}]"
+    nctrl imports
+
+Only the modules a run needs are imported (no PyQt5, vispy or matplotlib unless
+--gui), and the import time of each is reported.
+'''
+import ast
+import time
+import argparse
+import importlib
+
+from nctrl.utils import tprint
+
+
+# imported by `nctrl run`, heaviest dependencies first
+RUN_MODULES = ('numpy', 'pandas', 'serial', 'spiketag.realtime', 'spiketag.base', 'nctrl.core')
+GUI_MODULES = ('PyQt5.QtWidgets', 'nctrl.gui')
+
+
+def import_times(modules):
+    '''
+    Import modules in order and return {module: seconds}; a module imported
+    earlier (directly or as a dependency) costs nothing when it comes up again
+    '''
+    times = {}
+    for name in modules:
+        t0 = time.perf_counter()
+        importlib.import_module(name)
+        times[name] = time.perf_counter() - t0
+    return times
+
+
+def report_import_times(times):
+    total = sum(times.values())
+    lines = [f'{"module":<20} {"ms":>8}'] + [f'{name:<20} {dt * 1e3:8.1f}' for name, dt in times.items()]
+    lines.append(f'{"total":<20} {total * 1e3:8.1f}')
+    tprint('nctrl.cli: import times\n' + '\n'.join(lines))
+
+
+def _decoder_kwargs(args):
+    kwargs = {}
+    if args.unit_id is not None:
+        kwargs['unit_id'] = args.unit_id
+    if args.unit_ids is not None:
+        kwargs['unit_ids'] = args.unit_ids
+    if args.nspike is not None:
+        kwargs['nspike'] = args.nspike
+    if args.target_rate is not None:
+        kwargs['target_rate'] = args.target_rate
+    for item in args.set:
+        key, _, value = item.partition('=')
+        try:
+            kwargs[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            kwargs[key] = value # a plain string
+    return kwargs
+
+
+def run(args):
+    report_import_times(import_times(RUN_MODULES + (GUI_MODULES if args.gui else ())))
+    from nctrl.core import NCtrl
+
+    nctrl = NCtrl(prbfile=args.prb, fetfile=args.fet, output_type=args.output, output_port=args.port, replay=args.replay)
+    try:
+        nctrl.bmi.set_binner(bin_size=args.bin_size, B_bins=args.B)
+        nctrl.set_decoder(decoder=args.decoder, **_decoder_kwargs(args))
+        if args.trigger:
+            nctrl.set_trigger(unit_ids=args.trigger)
+        if args.realtime:
+            nctrl.set_realtime(cpu=args.cpu, priority=args.priority)
+        if args.log is not None:
+            nctrl.set_log(args.log or None)
+
+        if args.enable:
+            nctrl.output.on()
+        try:
+            if args.gui:
+                nctrl.show()
+            elif args.replay:
+                tprint(f'nctrl.cli.run: {nctrl.replay(speed=args.speed)}')
+            else:
+                nctrl.start()
+                tprint('nctrl.cli.run: running, Ctrl-C to stop')
+                try:
+                    while True:
+                        time.sleep(1)
+                except KeyboardInterrupt:
+                    pass
+                nctrl.stop()
+                tprint(f'nctrl.cli.run: {nctrl.latency}')
+        finally:
+            if args.enable:
+                nctrl.output.off()
+    finally:
+        nctrl.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='nctrl', description='realtime BMI with spiketag')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('run', help='run the decode loop')
+    p.add_argument('--prb', default=None, help='probe file (default: search . and ~/Work/probe-files)')
+    p.add_argument('--fet', default='./fet.bin')
+    p.add_argument('--replay', action='store_true', help='replay --fet instead of reading the FPGA')
+    p.add_argument('--speed', type=float, default=None, help='replay speed (default: as fast as possible)')
+    p.add_argument('--output', default='laser', help='laser, null, file or sim')
+    p.add_argument('--port', default='/dev/ttyACM0')
+    p.add_argument('--enable', action='store_true', help='enable the laser while running')
+    p.add_argument('--decoder', default='fr', help='fr, adaptive, rules, spikes or population')
+    p.add_argument('--bin-size', type=float, default=0.1)
+    p.add_argument('--B', type=int, default=10, help='bins per window')
+    p.add_argument('--unit-id', type=int, default=None)
+    p.add_argument('--unit-ids', type=int, nargs='+', default=None)
+    p.add_argument('--nspike', type=int, default=None)
+    p.add_argument('--target-rate', type=float, default=None, help='Hz, for --decoder adaptive')
+    p.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='any other decoder.fit argument')
+    p.add_argument('--trigger', type=int, nargs='+', default=None, metavar='UNIT_ID', help='per-spike pin pulses for these units')
+    p.add_argument('--realtime', action='store_true', help='freeze gc while streaming')
+    p.add_argument('--cpu', type=int, default=None, help='with --realtime, pin the decode thread to this core')
+    p.add_argument('--priority', type=int, default=None, help='with --realtime, SCHED_FIFO priority of the decode thread')
+    p.add_argument('--log', nargs='?', const='', default=None, metavar='FILE', help='record every bin (default file: ./session_<time>.nclog)')
+    p.add_argument('--gui', action='store_true')
+    p.set_defaults(func=run)
+
+    p = commands.add_parser('imports', help='report the import time of every module')
+    p.add_argument('--gui', action='store_true')
+    p.set_defaults(func=lambda args: report_import_times(import_times(RUN_MODULES + (GUI_MODULES if args.gui else ()))))
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,75 +1,304 @@
 import os
 import sys
-from PyQt5.QtWidgets import QApplication
+import json
+from time import perf_counter_ns
 
 from spiketag.base import probe
 from spiketag.realtime import BMI
 
-from nctrl.decoder import FrThreshold, Spikes
-from nctrl.output import Laser
-from nctrl.gui import nctrl_gui
+from nctrl.decoder import FrThreshold, AdaptiveThreshold, FrRules, Spikes, Population
+from nctrl.output import OUTPUTS
+from nctrl.replay import Replay
+from nctrl.events import SpikeTrigger
+from nctrl.latency import Latency
+from nctrl.log import SessionLog
+from nctrl.rt import RealtimeMode
+from nctrl.router import Router
+from nctrl.shm import SpikeRing
 from nctrl.utils import tprint
 
 
+DECODERS = {
+    'fr': FrThreshold,
+    'adaptive': AdaptiveThreshold, # fr with nspike tracking target_rate (Hz)
+    'rules': FrRules,
+    'spikes': Spikes,
+    'population': Population,
+}
+
+PROBE_CACHE = os.path.expanduser('~/.cache/nctrl/probe.json')
+
+
+def _load_probe_cache():
+    try:
+        with open(PROBE_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_probe_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(PROBE_CACHE), exist_ok=True)
+        with open(PROBE_CACHE, 'w') as f:
+            json.dump(cache, f, indent=1)
+    except OSError as e:
+        tprint(f'nctrl.NCtrl: could not write probe cache {PROBE_CACHE} ({e})')
+
+
 class NCtrl():
     def __init__(self,
                  prbfile=None,
                  fetfile='./fet.bin',
                  output_type='laser',
                  output_port='/dev/ttyACM0',
+                 replay=False,
                  ):
 
-        self.prbfile = self.find_probe_file(prbfile)
-        if self.prbfile:
-            tprint(f'Loading probe file {self.prbfile}')
-            self.prb = probe()
-            self.prb.load(self.prbfile)
+        if replay:
+            # set input from a recorded session instead of the FPGA
+            tprint(f'Loading replay of {fetfile}')
+            self.bmi = Replay(fetfile=fetfile)
         else:
-            raise FileNotFoundError('nctrl.NCtrl: No probe file found. Please provide a probe file.')
+            self.prbfile = self.find_probe_file(prbfile)
+            if self.prbfile:
+                tprint(f'Loading probe file {self.prbfile}')
+                self.prb = probe()
+                self.prb.load(self.prbfile)
+            else:
+                raise FileNotFoundError('nctrl.NCtrl: No probe file found. Please provide a probe file.')
+
+            # set input
+            tprint(f'Loading BMI')
+            self.bmi = BMI(prb=self.prb, fetfile=fetfile)
 
-        # set input
-        tprint(f'Loading BMI')
-        self.bmi = BMI(prb=self.prb, fetfile=fetfile)
+        # decoders -> outputs, all fed by one binner handler (see set_decoder, set_output)
+        self.router = Router()
+        self.dec = None
+        self.output = None
+
+        # per-spike pin pulses, bypassing the binner, and the output they go to (see set_trigger)
+        self.trigger = None
+        self.trigger_output = None
+
+        # hot-path timestamps of every decoded bin
+        self.latency = Latency()
 
         # set output
         self.set_output(output_type, output_port)
+
+        # recent spikes for the GUI, shared across processes
+        self.spike_ring = SpikeRing()
+
+        # gc / cpu isolation of the decode path while streaming (see set_realtime)
+        self.rt = None
+
+        # binary record of every decoded bin (see set_log)
+        self.log = None
     
     def find_probe_file(self, prbfile):
         if prbfile and os.path.isfile(prbfile):
             return prbfile
 
-        prb_files = [f for f in os.listdir('.') if f.endswith('.prb')]
-        if prb_files:
-            return prb_files[0]
+        # the probe found for this directory last time, if it still exists
+        cwd = os.getcwd()
+        cache = _load_probe_cache()
+        if os.path.isfile(cache.get(cwd, '')):
+            return cache[cwd]
 
-        prb_folder = os.path.expanduser('~/Work/probe-files')
-        prb_files = [f for f in os.listdir(prb_folder) if f.endswith('.prb')]
+        found = None
+        prb_files = sorted(f for f in os.listdir('.') if f.endswith('.prb'))
         if prb_files:
-            return os.path.join(prb_folder, prb_files[0])
-        return None
-
-    def set_decoder(self, decoder='fr', **kwargs):
-        if decoder == 'fr':
-            self.dec = FrThreshold()
-            self.dec.fit(**kwargs)
-            self.bmi.set_decoder(dec=self.dec)
-        elif decoder == 'spikes':
-            self.dec = Spikes()
-            self.dec.fit(**kwargs)
-            self.bmi.set_decoder(dec=self.dec)
-        
-        # bmi.binner is an eventemitter that will run this function when a new bin is ready
-        @self.bmi.binner.connect
+            found = os.path.abspath(prb_files[0])
+        else:
+            prb_folder = os.path.expanduser('~/Work/probe-files')
+            prb_files = sorted(f for f in os.listdir(prb_folder) if f.endswith('.prb')) if os.path.isdir(prb_folder) else []
+            if prb_files:
+                found = os.path.join(prb_folder, prb_files[0])
+
+        if found:
+            cache[cwd] = found
+            _save_probe_cache(cache)
+        return found
+
+    def set_decoder(self, decoder='fr', name='main', outputs=('main',), **kwargs):
+        '''
+        decoder: a key of DECODERS, fitted with kwargs. It replaces the decoder
+        `name` and sends its y to the named outputs (see set_output); 'main' is
+        self.dec. Every decoder runs on the same binned window X.
+        '''
+        if decoder not in DECODERS:
+            raise ValueError(f'nctrl.NCtrl.set_decoder: unknown decoder {decoder}, choose from {list(DECODERS)}')
+        dec = DECODERS[decoder]()
+        if decoder == 'adaptive':
+            kwargs.setdefault('bin_size', getattr(self.bmi.binner, 'bin_size', None))
+            # the binner's frame clock, it skips bins without spikes
+            if self.bmi.binner is not None:
+                kwargs.setdefault('clock', lambda: self.bmi.binner.current_time)
+        dec.fit(**kwargs)
+        if name == 'main' or getattr(self.bmi, 'binner', None) is None:
+            self.bmi.set_decoder(dec=dec)
+        if name == 'main':
+            self.dec = dec
+        self.router.attach(name, dec, outputs)
+
+        self.publish_spikes(self.bmi.binner)
+        self.connect(self.bmi.binner)
+
+    def remove_decoder(self, name):
+        self.router.detach(name)
+        if name == 'main':
+            self.dec = None
+        tprint(f'Removing decoder {name}: {self.router}')
+
+    def connect(self, binner):
+        # bmi.binner is an eventemitter that will run on_decode when a new bin is ready;
+        # connected once per binner, every decoder and output is reached through the router
+        if getattr(binner, '_nctrl', None) is self:
+            return
+        router, latency = self.router, self.latency
+        @binner.connect
         def on_decode(X):
-            y = self.dec.predict(X)
-            self.output(y)
-    
-    def set_output(self, output_type='laser', output_port='/dev/ttyACM0'):
-        if output_type == 'laser':
-            tprint(f'Setting output to {output_type} on port {output_port}')
-            self.output = Laser(output_port)
+            t_emit = perf_counter_ns()
+            rt = self.rt
+            if rt is not None and rt.pending:
+                rt.pin() # first bin on the decode thread
+            routed = router.predict(X)
+            t_predict = perf_counter_ns()
+            latency.open()
+            router.send(routed)
+            t_output = perf_counter_ns()
+            frame = getattr(binner, 'current_time', 0)
+            latency.record(frame, t_emit, t_predict, t_output)
+            log = self.log
+            if log is not None:
+                log.record(frame, t_emit, t_output, X, self.dec, self.output.command)
+        binner._nctrl = self
+
+    def publish_spikes(self, binner):
+        # copy every spike fed to the binner into the shared spike ring (once per binner)
+        if getattr(binner, '_spike_ring', None) is self.spike_ring:
+            return
+        binner_input, push = binner.input, self.spike_ring.push
+        def input(bmi_output, *args, **kwargs):
+            push(bmi_output.timestamp, bmi_output.spk_id)
+            trigger = self.trigger
+            if trigger is not None:
+                trigger(bmi_output.timestamp, bmi_output.spk_id)
+            binner_input(bmi_output, *args, **kwargs)
+        binner.input = input
+        binner._spike_ring = self.spike_ring
+
+    def set_trigger(self, unit_ids=None, pins=None, window=0.0005, output='main'):
+        '''
+        Pulse the spike pins of output on every spike of unit_ids (unit_ids[i] -> pin i)
+        or of the units in pins ({unit_id: pin or pins}), coalescing spikes within
+        window seconds; set_trigger() with neither turns it off
+        '''
+        if unit_ids is None and pins is None:
+            self.trigger = None
+            self.trigger_output = None
+            tprint('Spike trigger off')
+            return
+        binner = getattr(self.bmi, 'binner', None)
+        if binner is None:
+            raise ValueError('nctrl.NCtrl.set_trigger: no binner to take spikes from, call bmi.set_binner first')
+        if output not in self.router.outputs:
+            raise ValueError(f'nctrl.NCtrl.set_trigger: unknown output {output}, choose from {list(self.router.outputs)}')
+        self.publish_spikes(binner)
+        # bound to the output object, set_output and remove_output rebind or stop it
+        self.trigger = SpikeTrigger(self.router.outputs[output].write, unit_ids=unit_ids, pins=pins, window=window)
+        self.trigger_output = output
+        tprint(f'Setting spike trigger: {self.trigger} -> {output}')
+
+    def set_log(self, filename=None, enable=True):
+        '''
+        Record every decoded bin (counts, decoder state, command, timestamps) to
+        filename (default ./session_<time>.nclog); read it with nctrl.log.load_log
+        '''
+        if self.log is not None:
+            self.log.close()
+        self.log = SessionLog(filename) if enable else None
+        tprint(f'Setting session log: {self.log}')
+
+    def set_realtime(self, enable=True, cpu=None, priority=None):
+        '''
+        Real-time mode for the next start(): gc frozen and disabled while
+        streaming, the decode thread optionally pinned to cpu and raised to
+        SCHED_FIFO priority (best effort); jitter is in self.latency.jitter()
+        '''
+        if self.rt is not None:
+            self.rt.exit()
+        self.rt = RealtimeMode(cpu=cpu, priority=priority) if enable else None
+        tprint(f'Setting real-time mode: {self.rt}')
+
+    def start(self):
+        # start streaming (the decode loop), in real-time mode if set
+        if self.rt is not None:
+            self.rt.enter()
+        self.bmi.start(gui_queue=False)
+
+    def stop(self):
+        self.bmi.stop()
+        if self.rt is not None:
+            self.rt.exit()
+
+    def set_output(self, output_type='laser', output_port='/dev/ttyACM0', name='main', **kwargs):
+        '''
+        output_type: a key of nctrl.output.OUTPUTS ('laser', 'null', 'file', 'sim');
+        output_port is the serial port of 'laser' and the file of 'file' and 'sim'.
+        It replaces (and closes) the output `name`; 'main' is self.output.
+        '''
+        if output_type is None:
+            output_type = 'null'
+        if output_type not in OUTPUTS:
+            raise ValueError(f'nctrl.NCtrl.set_output: unknown output {output_type}, choose from {list(OUTPUTS)}')
+        if output_type == 'sim' and isinstance(self.bmi, Replay):
+            # simulate pulses on the replayed session clock, not the wall clock
+            kwargs.setdefault('clock', self.bmi.clock)
+        tprint(f'Setting output {name} to {output_type} on port {output_port}')
+        output = OUTPUTS[output_type](output_port, **kwargs)
+        if getattr(output, 'writer', None) is not None:
+            # stamp the serial write of each bin's command (latency 'write' stage)
+            output.writer.latency = self.latency
+        self.router.add_output(name, output)
+        if name == 'main':
+            self.output = output
+        if self.trigger is not None and self.trigger_output == name:
+            self.trigger.write = output.write
+
+    def remove_output(self, name):
+        if name == 'main':
+            raise ValueError("nctrl.NCtrl.remove_output: the main output can only be replaced, e.g. set_output('null')")
+        if self.trigger is not None and self.trigger_output == name:
+            self.set_trigger()
+        self.router.remove_output(name)
+        tprint(f'Removing output {name}: {self.router}')
     
+    def replay(self, speed=None):
+        '''
+        Run a recorded session through the decode loop (NCtrl(replay=True) only)
+        and return throughput statistics
+        '''
+        if not isinstance(self.bmi, Replay):
+            raise TypeError('nctrl.NCtrl.replay: NCtrl was not constructed with replay=True')
+        if self.rt is None:
+            return self.bmi.run(speed=speed)
+        with self.rt:
+            return self.bmi.run(speed=speed)
+
+    def close(self):
+        if self.rt is not None:
+            self.rt.exit()
+        if self.log is not None:
+            self.log.close()
+        self.router.close()
+        self.spike_ring.close()
+
     def show(self):
+        from PyQt5.QtWidgets import QApplication
+        from nctrl.gui import nctrl_gui
+
         app = QApplication(sys.argv)
         self.gui = nctrl_gui(nctrl=self)
         self.gui.show()
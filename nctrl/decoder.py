@@ -1,3 +1,5 @@
+import numpy as np
+from collections import deque
 from spiketag.analysis import Decoder
 from nctrl.utils import tprint
 
@@ -8,6 +10,14 @@ class FrThreshold(Decoder):
         self.nspike = nspike
         self.is_active = False
 
+    def _window_count(self, X):
+        # sum of the unit's column of X through a preallocated buffer
+        col = getattr(self, '_col', None)
+        if col is None or len(col) != len(X) or col.dtype != X.dtype:
+            col = self._col = np.empty(len(X), dtype=X.dtype)
+        X.take(self.unit_id, axis=1, out=col)
+        return col.sum()
+
     def fit(self, unit_id=None, nspike=None):
         if unit_id is not None:
             tprint(f'Setting unit_id to {unit_id}')
@@ -19,7 +29,9 @@ class FrThreshold(Decoder):
     def predict(self, X):
         # X is output from Binner
         # X.shape = [B, N] # B bins, N units
-        unit_spike_count = X[:, self.unit_id].sum()
+        return self._threshold(self._window_count(X))
+
+    def _threshold(self, unit_spike_count):
         if self.is_active:
             if unit_spike_count < self.nspike:
                 self.is_active = False
@@ -34,14 +46,345 @@ class FrThreshold(Decoder):
                 return 0
     
 
+class CountSketch():
+    '''
+    Constant-memory sketch of a stream of window spike counts.
+
+    hist[c] counts the bins whose window count was c and onsets[n] the bins
+    where the count rose through n, i.e. the laser onsets FrThreshold would have
+    made with nspike=n. Counts above max_count land in the last slot. t is the
+    stream time (s) the bins cover, which is more than n * bin_size when bins
+    without spikes are never emitted. decay() down-weights the past so the
+    sketch follows slow changes in firing rate.
+    '''
+    def __init__(self, max_count=1024):
+        self.max_count = max_count
+        self.hist = np.zeros(max_count + 1)
+        self.onsets = np.zeros(max_count + 2)
+        self.n = 0.0
+        self.t = 0.0
+        self._prev = 0
+
+    def add(self, count, dt):
+        # count of a bin dt seconds after the previous one
+        count = min(int(count), self.max_count)
+        self.hist[count] += 1
+        if count > self._prev:
+            self.onsets[self._prev + 1:count + 1] += 1
+        self._prev = count
+        self.n += 1
+        self.t += dt
+
+    def decay(self, factor):
+        self.hist *= factor
+        self.onsets *= factor
+        self.n *= factor
+        self.t *= factor
+
+    def quantile(self, q):
+        # count at quantile q (scalar or array)
+        return np.searchsorted(np.cumsum(self.hist), np.asarray(q) * self.n)
+
+    def onset_rate(self):
+        # onsets per second of every threshold nspike = 0 .. max_count + 1
+        return self.onsets / max(self.t, 1e-12)
+
+
+class AdaptiveThreshold(FrThreshold):
+    '''
+    FrThreshold whose nspike follows a target laser rate.
+
+    The window count of unit_id is fed to a CountSketch every bin; every
+    update_interval seconds (after warmup) the most permissive nspike whose
+    sketched onset rate is at most target_rate is computed and nspike moves
+    towards it by at most max_step. The sketch decays with half_life seconds.
+    Each adjustment is appended to self.trace as (t in s, nspike, estimated
+    rate in Hz).
+
+    Time is read from clock(), the frame of the current bin (the binner's
+    current_time, fs frames per second), because the binner only emits bins
+    that hold spikes; without a clock every bin is taken to be bin_size long.
+    '''
+    def __init__(self, t_window=0.1, unit_id=0, nspike=1, target_rate=1.0, bin_size=0.1,
+                 update_interval=1.0, warmup=10.0, max_step=1, half_life=60.0, max_count=1024,
+                 clock=None, fs=25000):
+        super(AdaptiveThreshold, self).__init__(t_window, unit_id, nspike)
+        self.target_rate = target_rate
+        self.bin_size = bin_size
+        self.update_interval = update_interval
+        self.warmup = warmup
+        self.max_step = max_step
+        self.half_life = half_life
+        self.clock = clock
+        self.fs = fs
+        self.sketch = CountSketch(max_count)
+        self.trace = deque(maxlen=10000)
+        self.n_bin = 0
+        self.t = 0.0
+        self._t_prev = None
+        self._t_adapt = 0.0
+        self._schedule()
+
+    def fit(self, unit_id=None, nspike=None, target_rate=None, bin_size=None, **kwargs):
+        super(AdaptiveThreshold, self).fit(unit_id, nspike)
+        if target_rate is not None:
+            tprint(f'Setting target laser rate to {target_rate} Hz')
+            self.target_rate = target_rate
+        if bin_size is not None:
+            self.bin_size = bin_size
+        for key, value in kwargs.items():
+            if key not in ('update_interval', 'warmup', 'max_step', 'half_life', 'clock', 'fs'):
+                raise TypeError(f'nctrl.decoder.AdaptiveThreshold.fit: unexpected argument {key}')
+            setattr(self, key, value)
+        self._schedule()
+
+    def _schedule(self):
+        # next adaptation (s of stream time), not before warmup
+        self._t_next = max(self._t_adapt + self.update_interval, self.warmup)
+
+    def _now(self):
+        # stream time (s) of the current bin
+        if self.clock is not None:
+            return self.clock() / self.fs
+        return self.n_bin * self.bin_size
+
+    def predict(self, X):
+        unit_spike_count = self._window_count(X)
+        self.n_bin += 1
+        now = self._now()
+        # the first bin counts as one bin_size, later ones as the time since the previous bin
+        dt = self.bin_size if self._t_prev is None else max(now - self._t_prev, 0.0)
+        self._t_prev = now
+        self.t += dt
+        self.sketch.add(unit_spike_count, dt)
+        if self.t >= self._t_next:
+            self.adapt()
+        return self._threshold(unit_spike_count)
+
+    def adapt(self):
+        # onset rate rises then falls with nspike (a low nspike is rarely left);
+        # take the first nspike past the peak at or below the target
+        rate = self.sketch.onset_rate()
+        peak = int(np.argmax(rate[1:])) + 1
+        below = np.flatnonzero(rate[peak:] <= self.target_rate)
+        target = peak + below[0] if len(below) else len(rate) - 1
+        step = int(np.clip(target - self.nspike, -self.max_step, self.max_step))
+        self.nspike = max(self.nspike + step, 1)
+        self.trace.append((self.t, self.nspike, rate[min(int(self.nspike), len(rate) - 1)]))
+        if self.half_life:
+            self.sketch.decay(0.5 ** ((self.t - self._t_adapt) / self.half_life))
+        self._t_adapt = self.t
+        self._schedule()
+
+
 class Spikes(Decoder):
     def __init__(self, t_window=0.001, unit_ids=None):
         super().__init__(t_window)
-        self.unit_ids = unit_ids if unit_ids is not None else []
+        self.fit(unit_ids if unit_ids is not None else [])
 
     def fit(self, unit_ids):
         # output up to 16 channels
         self.unit_ids = unit_ids[:16] if len(unit_ids) > 16 else unit_ids
+        self._ids = np.asarray(self.unit_ids, dtype=np.intp)
+        self._x = None
     
     def predict(self, X):
-        return X[-1, self.unit_ids] > 0 if self.unit_ids else 0
\ No newline at end of file
+        if not len(self.unit_ids):
+            return 0
+        # preallocated: the same output array is returned every bin
+        if self._x is None or self._x.dtype != X.dtype:
+            self._x = np.empty(len(self._ids), dtype=X.dtype)
+            self._y = np.empty(len(self._ids), dtype=bool)
+        X[-1].take(self._ids, out=self._x)
+        return np.greater(self._x, 0, out=self._y)
+
+class RingDecoder(Decoder):
+    '''
+    Base of the decoders that keep their own window counts.
+
+    Running counts of the last B bins are kept in a preallocated ring buffer,
+    so every bin costs one add and one subtract no matter how large B is; the
+    ring is allocated on the first bin in the dtype of the counts pushed (and
+    again if it changes). Each row (rule) of the decoder is active while it
+    fires, and like FrThreshold the decoder returns 1 only on the bin a row
+    becomes active.
+    '''
+    def __init__(self, t_window=0.1, B=None):
+        super(RingDecoder, self).__init__(t_window)
+        self.B = B
+        self._ring = None
+
+    def _allocate_ring(self, B, n_col, n_row, dtype):
+        self._ring = np.zeros((B, n_col), dtype=dtype)
+        self._pos = 0
+        self.counts = np.zeros(n_col, dtype=dtype)
+        self._fire = np.zeros(n_row, dtype=bool)
+        self.onset = np.zeros(n_row, dtype=bool)
+        self.is_active = np.zeros(n_row, dtype=bool)
+
+    def reset(self):
+        if self._ring is not None:
+            self._ring[:] = 0
+            self.counts[:] = 0
+            self.is_active[:] = False
+            self._pos = 0
+
+    def _push(self, x):
+        # counts += newest bin - bin leaving the window
+        self.counts += x
+        self.counts -= self._ring[self._pos]
+        self._ring[self._pos] = x
+        self._pos = (self._pos + 1) % len(self._ring)
+
+    def _onset(self):
+        # rows in self._fire that were not active on the previous bin
+        np.greater(self._fire, self.is_active, out=self.onset)
+        self.is_active[:] = self._fire
+        return 1 if self.onset.any() else 0
+
+
+class FrRules(RingDecoder):
+    '''
+    Streaming firing-rate threshold over many units and rules.
+
+    Each rule fires when at least k of its units reach their own nspike in the
+    window counts of the last B bins ('any' is k=1, 'all' is k=len(unit_ids)).
+    '''
+    def __init__(self, t_window=0.1, B=None):
+        super(FrRules, self).__init__(t_window, B)
+        self.rules = []
+        self.unit_ids = np.zeros(0, dtype=int)
+
+    def fit(self, rules=None, unit_ids=None, nspike=None, k='any', B=None):
+        '''
+        rules: list of dict(unit_ids=[...], nspike=scalar or per-unit list, k='any'|'all'|int)
+        or a single rule given by unit_ids, nspike and k
+        '''
+        if rules is None:
+            rules = [dict(unit_ids=unit_ids, nspike=nspike, k=k)]
+        if B is not None:
+            self.B = B
+
+        self.rules = rules
+        self.unit_ids = np.unique(np.concatenate([np.atleast_1d(rule['unit_ids']) for rule in rules])).astype(int)
+        col = {unit_id: i for i, unit_id in enumerate(self.unit_ids)}
+
+        # per (rule, unit) threshold; units outside a rule never count as above
+        self.nspike = np.full((len(rules), len(self.unit_ids)), np.inf)
+        self.k = np.zeros(len(rules))
+        for i_rule, rule in enumerate(rules):
+            rule_units = np.atleast_1d(rule['unit_ids'])
+            cols = [col[unit_id] for unit_id in rule_units]
+            self.nspike[i_rule, cols] = rule['nspike']
+            k = rule.get('k', 'any')
+            self.k[i_rule] = 1 if k == 'any' else len(rule_units) if k == 'all' else k
+            tprint(f'Setting rule {i_rule}: {self.k[i_rule]:.0f} of units {rule_units.tolist()} >= {rule["nspike"]} spikes')
+        self._ring = None
+
+    def _allocate(self, X):
+        bad = self.unit_ids[(self.unit_ids < 0) | (self.unit_ids >= X.shape[1])]
+        if len(bad):
+            raise ValueError(f'nctrl.decoder.FrRules: unit_ids {bad.tolist()} out of range for {X.shape[1]} columns of X')
+        n_rule, n_unit = self.nspike.shape
+        self._allocate_ring(self.B or X.shape[0], n_unit, n_rule, X.dtype)
+        self._x = np.zeros(n_unit, dtype=X.dtype)
+        self._above = np.zeros((n_rule, n_unit), dtype=bool)
+        self._n_above = np.zeros(n_rule)
+
+    def predict(self, X):
+        # X is output from Binner
+        # X.shape = [B, N] # B bins, N units; only the newest bin X[-1] is read
+        if self._ring is None or self._ring.dtype != X.dtype:
+            self._allocate(X)
+
+        X[-1].take(self.unit_ids, out=self._x)
+        self._push(self._x)
+
+        np.greater_equal(self.counts, self.nspike, out=self._above)
+        self._above.sum(axis=1, out=self._n_above)
+        np.greater_equal(self._n_above, self.k, out=self._fire)
+        return self._onset()
+
+
+class Population(RingDecoder):
+    '''
+    Linear readout of the whole population.
+
+    Each bin the rows of the weight matrix W are applied to the window counts
+    of every unit over the last B bins in one matmul, score = W @ counts + bias,
+    and a row fires when its score reaches its threshold. Rows can be fit from
+    a Unit (standardized population activity) or stacked threshold rules.
+    Column j of W is unit_id j, i.e. column j of X.
+    '''
+    def __init__(self, t_window=0.1, B=None):
+        super(Population, self).__init__(t_window, B)
+        self.W = np.zeros((0, 0))
+        self.bias = np.zeros(0)
+        self.threshold = np.zeros(0)
+
+    def fit(self, W=None, bias=0, threshold=1, rules=None, unit=None, unit_ids=None, bin_size=0.1, B=None, max_bins=1 << 20):
+        '''
+        W: (n_row, n_col) weights with bias and threshold per row, or
+        rules: list of dict(unit_ids=[...], nspike=n), a row firing when the summed count of its units reaches nspike, or
+        unit: a loaded nctrl.Unit; one row scoring the population z-score of the
+        causal B-bin counts of unit_ids (default: all units), threshold in standard deviations
+        '''
+        if B is not None:
+            self.B = B
+        if rules is not None:
+            n_col = max(max(np.atleast_1d(rule['unit_ids'])) for rule in rules) + 1
+            W = np.zeros((len(rules), n_col))
+            for i_rule, rule in enumerate(rules):
+                W[i_rule, np.atleast_1d(rule['unit_ids'])] = 1
+            bias, threshold = 0, [rule['nspike'] for rule in rules]
+        elif unit is not None:
+            if self.B is None:
+                raise ValueError('nctrl.decoder.Population.fit: B (bins per window) is needed to fit from a Unit')
+            W, bias = self._fit_unit(unit, unit_ids, bin_size, self.B, max_bins)
+        elif W is None:
+            raise ValueError('nctrl.decoder.Population.fit: give W, rules or unit')
+
+        W = np.atleast_2d(np.asarray(W, dtype=np.float64))
+        if W.ndim != 2 or not W.size or not np.isfinite(W).all():
+            raise ValueError(f'nctrl.decoder.Population.fit: W must be a finite (n_row, n_col) matrix, got shape {W.shape}')
+        self.W = W
+        self.bias = np.broadcast_to(np.asarray(bias, dtype=np.float64), len(self.W)).copy()
+        self.threshold = np.broadcast_to(np.asarray(threshold, dtype=np.float64), len(self.W)).copy()
+        tprint(f'Setting population readout: {self.W.shape[0]} rows x {self.W.shape[1]} units')
+        self._ring = None
+
+    def _fit_unit(self, unit, unit_ids, bin_size, B, max_bins):
+        unit_ids = np.arange(1, unit.n_unit + 1) if unit_ids is None else np.atleast_1d(unit_ids)
+        stop = min(unit.counts.n_bin(max(int(round(bin_size * unit.store.fs)), 1)), max_bins)
+        counts = unit.counts.window(bin_size, B, unit_ids - 1, stop=stop).astype(np.float64)
+        mean, std = counts.mean(axis=1), counts.std(axis=1)
+        std[std == 0] = np.inf # silent units get no weight
+        # z-score of every unit, summed and rescaled to unit variance
+        z_sum_std = ((counts - mean[:, None]) / std[:, None]).sum(axis=0).std() or 1
+        W = np.zeros((1, unit_ids.max() + 1))
+        W[0, unit_ids] = 1 / std / z_sum_std
+        return W, -(mean / std).sum() / z_sum_std
+
+    def _allocate(self, X):
+        n_row, n_col = len(self.W), X.shape[1]
+        if self.W[:, n_col:].any():
+            bad = np.flatnonzero(self.W[:, n_col:].any(axis=0)) + n_col
+            raise ValueError(f'nctrl.decoder.Population: weights on unit_ids {bad.tolist()} out of range for {n_col} columns of X')
+        W = np.zeros((n_row, n_col))
+        n = min(n_col, self.W.shape[1])
+        W[:, :n] = self.W[:, :n]
+        self._W = np.ascontiguousarray(W, dtype=X.dtype if X.dtype.kind == 'f' else np.float64)
+        self._allocate_ring(self.B or X.shape[0], n_col, n_row, self._W.dtype)
+        self.score = np.zeros(n_row, dtype=self._W.dtype)
+
+    def predict(self, X):
+        # X is output from Binner
+        # X.shape = [B, N] # B bins, N units; only the newest bin X[-1] is read
+        if self._ring is None or X.shape[1] != len(self.counts):
+            self._allocate(X)
+
+        self._push(X[-1])
+        np.dot(self._W, self.counts, out=self.score)
+        self.score += self.bias
+        np.greater_equal(self.score, self.threshold, out=self._fire)
+        return self._onset()
@@ -0,0 +1,183 @@
+import os
+import tty
+import time
+import select
+import threading
+import numpy as np
+
+from nctrl import protocol
+
+
+class Firmware():
+    '''
+    State machine of teensy/teensy.ino, driven by an external clock in us.
+
+    Pin edges are appended to self.edges as (time_us, line, value), where line
+    LASER is the laser pins (3, 4) and line SPIKES the 16 spike pins.
+    '''
+    LASER_DURATION = 5000      # 5 ms
+    INTERVAL_DURATION = 20000  # 20 ms
+    SPIKE_DURATION = 500
+
+    STANDBY, LASERON, LASEROFF, DONE = range(4)
+    LASER, SPIKES = 0, 1
+
+    def __init__(self):
+        self.finish_duration = 500000 # 0.5 seconds
+        self.state = self.STANDBY
+        self.enable = 0
+        self.start_time = 0
+        self.interval_time = 0
+        self.spike_timer = 0
+        self.spike_state = 0
+        self.laser = 0
+        self.pins = 0
+        self.edges = []
+
+    def _laser(self, now, value):
+        if value != self.laser:
+            self.laser = value
+            self.edges.append((now, self.LASER, value))
+
+    def _pins(self, now, value):
+        if value != self.pins:
+            self.pins = value
+            self.edges.append((now, self.SPIKES, value))
+
+    def handle(self, cmd, arg, now):
+        # returns the value sent back in the ack
+        cmd &= ~protocol.ACK_REQ
+        if cmd == protocol.LASER_START:
+            if self.enable == 1:
+                if self.state == self.STANDBY:
+                    self.state = self.LASERON
+                    self.start_time = now
+                    self.interval_time = now
+                    self._laser(now, 1)
+                else:
+                    self.start_time = now # just make it longer
+        elif cmd == protocol.LASER_ABORT:
+            self.state = self.STANDBY
+            self._laser(now, 0)
+        elif cmd == protocol.ENABLE:
+            self.enable = 1
+        elif cmd == protocol.DISABLE:
+            self.enable = 0
+        elif cmd == protocol.CONST_ON:
+            self._laser(now, 1)
+        elif cmd == protocol.CONST_OFF:
+            self._laser(now, 0)
+        elif cmd == protocol.SET_DURATION:
+            self.finish_duration = arg * 1000
+            return arg
+        elif cmd == protocol.SPIKES:
+            self._pins(now, arg & 0xffff)
+            self.spike_timer = now
+            self.spike_state = 1
+        elif cmd == protocol.PING:
+            return protocol.VERSION
+        else:
+            raise ValueError(f'nctrl.emulator.Firmware: unknown command {cmd:#x}')
+        return 0
+
+    def update(self, now):
+        if self.state == self.LASERON:
+            if now - self.start_time >= self.finish_duration:
+                self.state = self.DONE
+                self._laser(now, 0)
+            elif now - self.interval_time >= self.LASER_DURATION:
+                self.state = self.LASEROFF
+                self.interval_time = now
+                self._laser(now, 0)
+        elif self.state == self.LASEROFF:
+            if now - self.interval_time >= self.INTERVAL_DURATION:
+                self.state = self.LASERON
+                self.interval_time = now
+                self._laser(now, 1)
+        if self.spike_state == 1 and now - self.spike_timer >= self.SPIKE_DURATION:
+            self.spike_state = 0
+            self._pins(now, 0)
+
+    def next_event(self):
+        # time (us) of the next timer transition, None if the firmware is idle
+        t = []
+        if self.state == self.LASERON:
+            t += [self.start_time + self.finish_duration, self.interval_time + self.LASER_DURATION]
+        elif self.state == self.LASEROFF:
+            t.append(self.interval_time + self.INTERVAL_DURATION)
+        if self.spike_state == 1:
+            t.append(self.spike_timer + self.SPIKE_DURATION)
+        return min(t) if t else None
+
+
+class TeensyEmulator(threading.Thread):
+    '''
+    Runs Firmware behind a pseudo-terminal so Laser (or any serial client) can
+    talk to it at self.port as if it were the Teensy.
+
+    Every received frame is logged in self.rx as (perf_counter_ns, cmd, seq, arg);
+    when the client stamps its writes with the same clock in the same process,
+    host -> device latency is rx time minus write time, matched by seq.
+    '''
+    def __init__(self, firmware=None, poll_interval=50e-6):
+        super().__init__(name='nctrl-teensy-emulator', daemon=True)
+        self.firmware = firmware if firmware is not None else Firmware()
+        self.poll_interval = poll_interval
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        # frames are read and rejected like teensy.ino does, NAKing bad checksums and versions
+        self.parser = protocol.Parser(errors=True)
+        self.rx = []
+        self.n_bytes = 0
+        self.n_lost = 0
+        self._last_seq = None
+        self._keep_running = True
+
+    def run(self):
+        t0 = time.perf_counter_ns()
+        firmware, parser = self.firmware, self.parser
+        while self._keep_running:
+            readable, _, _ = select.select([self._master], [], [], self.poll_interval)
+            now_ns = time.perf_counter_ns()
+            now = (now_ns - t0) // 1000
+            if readable:
+                data = os.read(self._master, 4096)
+                self.n_bytes += len(data)
+                for frame in parser.feed(data):
+                    if isinstance(frame, protocol.FrameError):
+                        os.write(self._master, protocol.encode(protocol.NAK, frame.code, frame.seq))
+                        continue
+                    cmd, seq, arg = frame
+                    self.rx.append((now_ns, cmd, seq, arg))
+                    if self._last_seq is not None:
+                        self.n_lost += (seq - self._last_seq - 1) & 0xffff
+                    self._last_seq = seq
+                    self._reply(cmd, seq, arg, now)
+            firmware.update(now)
+
+    def _reply(self, cmd, seq, arg, now):
+        try:
+            value = self.firmware.handle(cmd, arg, now)
+        except ValueError:
+            os.write(self._master, protocol.encode(protocol.NAK, protocol.ERR_COMMAND, seq))
+            return
+        if cmd & protocol.ACK_REQ:
+            acked = cmd & ~protocol.ACK_REQ
+            os.write(self._master, protocol.encode(protocol.ACK, (acked << 24) | (value & 0xffffff), seq))
+
+    def stop(self):
+        self._keep_running = False
+        self.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def latency(self, sent):
+        '''
+        sent: {seq: perf_counter_ns at write} from the client
+        returns host write -> emulator receive latency in us, in receive order
+        '''
+        return np.array([(t - sent[seq]) / 1e3 for t, cmd, seq, arg in self.rx if seq in sent])
+
+    def __repr__(self):
+        return f'TeensyEmulator(port={self.port}, frames={len(self.rx)}, bytes={self.n_bytes}, lost={self.n_lost}, errors={self.parser.n_errors})'
@@ -0,0 +1,62 @@
+import numpy as np
+
+from nctrl import protocol
+
+
+class SpikeTrigger():
+    '''
+    Spike-triggered pin pulses straight from the spike stream, without the binner.
+
+    Every spike id is looked up in a table of 16-bit pin masks (unit_ids[i] ->
+    pin i by default, or an explicit {unit_id: pins} map); spikes of units
+    without pins return after one lookup. Pulses are coalesced per window
+    (seconds of spike time): the first spike of a window is sent at once, later
+    spikes of the same window only send a frame when they add pins, carrying the
+    OR of every mask seen in the window, so a burst costs one frame per new pin
+    at most and never waits for the window to close.
+    '''
+    def __init__(self, write, unit_ids=None, pins=None, window=0.0005, fs=25000):
+        self.write = write
+        self.window = max(int(round(window * fs)), 1)
+        if pins is None:
+            unit_ids = [] if unit_ids is None else list(unit_ids)
+            if len(unit_ids) > 16:
+                raise ValueError('nctrl.events.SpikeTrigger: at most 16 units map to the 16 spike pins')
+            pins = {unit_id: i for i, unit_id in enumerate(unit_ids)}
+
+        if any(int(unit_id) < 0 for unit_id in pins):
+            raise ValueError(f'nctrl.events.SpikeTrigger: negative unit ids in {sorted(pins)}')
+        lut = np.zeros(max(pins, default=0) + 1, dtype=np.uint16)
+        for unit_id, unit_pins in pins.items():
+            for pin in np.atleast_1d(unit_pins):
+                if not 0 <= int(pin) < 16:
+                    raise ValueError(f'nctrl.events.SpikeTrigger: pin {pin} of unit {unit_id} is not one of the 16 spike pins (0..15)')
+                lut[unit_id] |= 1 << int(pin)
+        # a list indexes faster than an array for one scalar at a time
+        self.lut = lut.tolist()
+        self._n_id = len(self.lut)
+        self._start = -self.window
+        self._mask = 0
+
+        self.n_spikes = 0
+        self.n_frames = 0
+        self.n_coalesced = 0
+
+    def __call__(self, frame, spk_id):
+        if spk_id >= self._n_id or not self.lut[spk_id]:
+            return
+        self.n_spikes += 1
+        if frame - self._start >= self.window:
+            self._start = frame
+            self._mask = 0
+        mask = self._mask | self.lut[spk_id]
+        if mask == self._mask:
+            self.n_coalesced += 1
+            return
+        self._mask = mask
+        self.write((protocol.SPIKES, mask))
+        self.n_frames += 1
+
+    def __repr__(self):
+        return (f'SpikeTrigger(units={sum(1 for m in self.lut if m)}, window={self.window} frames, '
+                f'spikes={self.n_spikes}, frames={self.n_frames}, coalesced={self.n_coalesced})')
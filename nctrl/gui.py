@@ -1,4 +1,6 @@
 import sys
+import time
+import numpy as np
 
 from spiketag.view import raster_view
 from spiketag.utils import Timer
@@ -7,6 +9,8 @@ from PyQt5 import QtCore
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QWidget, QApplication, QPushButton, QSplitter, QGridLayout, QVBoxLayout, QHBoxLayout, QFormLayout, QSpinBox, QDoubleSpinBox, QRadioButton, QLabel
 
+from nctrl.decoder import AdaptiveThreshold
+
 
 class nctrl_gui(QWidget):
 
@@ -20,6 +24,16 @@ class nctrl_gui(QWidget):
             self.view_timer = QtCore.QTimer(self)
             self.view_timer.timeout.connect(self.view_update)
             self.update_interval = 60
+            self._n_view_update = 0
+
+            # raster window filled incrementally from the shared spike ring
+            self.spike_reader = self.nctrl.spike_ring.reader()
+            self.raster_N = 20000
+            # every record is written twice, at i and i+N, so the newest raster_n
+            # records are always the contiguous slice ending at raster_i+N
+            self.raster = np.zeros((2*self.raster_N, 2), dtype=np.int32)
+            self.raster_i = 0
+            self.raster_n = 0
             
         else:
             self.nctrl = None
@@ -96,10 +110,33 @@ class nctrl_gui(QWidget):
         layout_setting.addRow("Spike count", self.nspike_btn)
         layout_setting.addRow("Fr", self.fr_btn)
 
+        # target laser rate; above 0 nspike is adapted online from a count sketch
+        self.target_btn = QDoubleSpinBox()
+        self.target_btn.setRange(0.0, 100.0)
+        self.target_btn.setValue(0.0)
+        self.target_btn.setSingleStep(0.1)
+        self.target_btn.setSuffix(" Hz")
+        self.target_btn.setSpecialValueText("manual")
+        layout_setting.addRow("Target rate", self.target_btn)
+
+        # latency: p50/p99/max of each decode stage
+        self.latency_label = QLabel()
+        self.latency_label.setStyleSheet("font-family: monospace")
+        self.latency_btn = QPushButton("Save latency")
+        self.latency_btn.clicked.connect(self.latency_dump)
+        self.latency_update_every = 10 # view updates
+
         layout_btn = QGridLayout()
         layout_btn.addWidget(self.stream_btn, 0, 0)
         layout_btn.addWidget(self.bmi_btn, 1, 0)
         layout_btn.addLayout(layout_setting, 2, 0)
+        layout_btn.addWidget(self.latency_label, 3, 0)
+        layout_btn.addWidget(self.latency_btn, 4, 0)
+
+        # count sketch and adaptation trace of the adaptive threshold
+        self.adapt_label = QLabel()
+        self.adapt_label.setStyleSheet("font-family: monospace")
+        layout_btn.addWidget(self.adapt_label, 5, 0)
 
         self.bin_4_btn.setChecked(True)
         self.bin_4_btn.toggled.emit(True)
@@ -153,11 +190,15 @@ class nctrl_gui(QWidget):
             # set decoder
             unit_id = self.unit_btn.value()
             nspike = self.nspike_btn.value()
-            self.nctrl.set_decoder(decoder='fr', unit_id=unit_id, nspike=nspike)
+            target_rate = self.target_btn.value()
+            if target_rate > 0:
+                self.nctrl.set_decoder(decoder='adaptive', unit_id=unit_id, nspike=nspike, target_rate=target_rate, bin_size=bin_size)
+            else:
+                self.nctrl.set_decoder(decoder='fr', unit_id=unit_id, nspike=nspike)
 
             self.stream_btn.setText('Stream On')
             self.stream_btn.setStyleSheet("background-color: green")
-            self.nctrl.bmi.start(gui_queue=False)
+            self.nctrl.start()
             self.view_timer.start(self.update_interval)
         else:
             if self.bmi_btn.isChecked():
@@ -165,7 +206,7 @@ class nctrl_gui(QWidget):
                 self.bmi_toggle(False)
             self.stream_btn.setText('Stream Off')
             self.stream_btn.setStyleSheet("background-color: white")
-            self.nctrl.bmi.stop()
+            self.nctrl.stop()
             self.view_timer.stop()
     
     def bmi_toggle(self, checked):
@@ -189,7 +230,63 @@ class nctrl_gui(QWidget):
     def view_update(self):
         with Timer('update', verbose=False):
             if self.nctrl:
-                self.raster_view.update_fromfile(filename=self.nctrl.bmi.fetfile, n_items=8, last_N=20000)
+                self.raster_update()
+                self._n_view_update += 1
+                if self._n_view_update % self.latency_update_every == 0:
+                    self.latency_update()
+                    self.adapt_update()
+
+    def raster_update(self):
+        '''
+        Append the spikes published since the last refresh to the raster window;
+        the cost scales with the spike rate, not with the window
+        '''
+        new = self.spike_reader.read()
+        if len(new) == 0:
+            return
+        new = new[-self.raster_N:]
+        n_new = len(new)
+        # write only the new records into the circular buffer, nothing is shifted
+        i, N = self.raster_i, self.raster_N
+        head = min(n_new, N - i)
+        self.raster[i:i+head] = self.raster[N+i:N+i+head] = new[:head]
+        self.raster[:n_new-head] = self.raster[N:N+n_new-head] = new[head:]
+        self.raster_i = (i + n_new) % N
+        self.raster_n = min(self.raster_n + n_new, N)
+        end = self.raster_i + N
+        self.raster_view.set_data(self.raster[end-self.raster_n:end])
+
+    def latency_update(self):
+        lines = ['latency (us)      p50     p99     max']
+        for name, (p50, p99, dt_max) in self.nctrl.latency.percentiles().items():
+            lines.append(f'{name:<15} {p50:7.1f} {p99:7.1f} {dt_max:7.1f}')
+        lines.append('jitter (us)       std     p99     max')
+        for name, (std, p99, dt_max) in self.nctrl.latency.jitter().items():
+            lines.append(f'{name:<15} {std:7.1f} {p99:7.1f} {dt_max:7.1f}')
+        if self.nctrl.rt is not None:
+            lines.append(f'gc collections  {self.nctrl.rt.n_gc}')
+        self.latency_label.setText('\n'.join(lines))
+
+    def adapt_update(self):
+        dec = getattr(self.nctrl, 'dec', None)
+        if not isinstance(dec, AdaptiveThreshold):
+            self.adapt_label.setText('')
+            return
+        p50, p80, p90 = dec.sketch.quantile([0.5, 0.8, 0.9])
+        lines = [f'count p50/p80/p90  {p50}/{p80}/{p90} ({dec.sketch.n:.0f} bins)',
+                 f'nspike {dec.nspike:<4.0f} target {dec.target_rate:.2f} Hz']
+        for t, nspike, rate in list(dec.trace)[-5:]:
+            lines.append(f'{t:9.1f} s  nspike {nspike:<4.0f} {rate:6.2f} Hz')
+        self.adapt_label.setText('\n'.join(lines))
+        # show the adapted value without re-fitting the decoder
+        self.nspike_btn.blockSignals(True)
+        self.nspike_btn.setValue(int(dec.nspike))
+        self.nspike_btn.blockSignals(False)
+        self.update_fr()
+
+    def latency_dump(self):
+        if self.nctrl:
+            self.nctrl.latency.dump(f'./latency_{time.strftime("%Y%m%d_%H%M%S")}.npz')
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
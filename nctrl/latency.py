@@ -0,0 +1,124 @@
+import numpy as np
+
+from nctrl.utils import tprint
+
+
+class Latency():
+    '''
+    Hot-path timestamps of the decode loop.
+
+    One row per decoded bin is written into a preallocated ring:
+    frame   FPGA frame_id of the spike that made the binner emit
+    emit    perf_counter_ns() when on_decode was entered
+    predict perf_counter_ns() after dec.predict
+    output  perf_counter_ns() after the outputs returned; a threaded Laser only
+            queues the command here
+    write   perf_counter_ns() after ser.write of the bin's first command
+            returned on the SerialWriter thread (0: nothing written)
+
+    open() starts the row of the bin being decoded so the writer can stamp it
+    from its thread (written()); record() fills the rest.
+
+    The host clock and the FPGA clock share no reference, so frame -> emit is
+    reported relative to the fastest bin in the buffer (the transport latency
+    floor is not observable from here).
+    '''
+    STAGES = ('frame', 'emit', 'predict', 'output', 'write')
+    OPEN = -1 # no bin is being decoded
+
+    def __init__(self, size=2**16, fs=25000):
+        self.size = size
+        self.fs = fs
+        self.t = np.zeros((size, len(self.STAGES)), dtype=np.int64)
+        self.n = 0
+        self.row = self.OPEN
+
+    def open(self):
+        # commands queued from now until record() belong to bin self.n
+        self.t[self.n % self.size, 4] = 0
+        self.row = self.n
+
+    def record(self, frame, t_emit, t_predict, t_output):
+        self.row = self.OPEN
+        self.t[self.n % self.size, :4] = (frame, t_emit, t_predict, t_output)
+        self.n += 1
+
+    def written(self, row, t_write):
+        # called by the writer thread; the first write of a bin counts
+        i = row % self.size
+        if row > self.n - self.size and self.t[i, 4] == 0:
+            self.t[i, 4] = t_write
+
+    def reset(self):
+        self.n = 0
+        self.row = self.OPEN
+
+    @property
+    def data(self):
+        # valid rows, oldest first
+        if self.n <= self.size:
+            return self.t[:self.n]
+        return np.roll(self.t, -(self.n % self.size), axis=0)
+
+    def intervals(self):
+        # stage-to-stage latencies in us
+        t = self.data
+        frame_ns = t[:, 0] * (1e9 / self.fs)
+        frame_to_emit = t[:, 1] - frame_ns
+        if len(t):
+            frame_to_emit -= frame_to_emit.min()
+        w = t[t[:, 4] > 0]
+        return {
+            'frame->emit': frame_to_emit / 1e3,
+            'emit->predict': (t[:, 2] - t[:, 1]) / 1e3,
+            'predict->output': (t[:, 3] - t[:, 2]) / 1e3,
+            'emit->output': (t[:, 3] - t[:, 1]) / 1e3,
+            # bins whose command reached ser.write
+            'output->write': (w[:, 4] - w[:, 3]) / 1e3,
+            'emit->write': (w[:, 4] - w[:, 1]) / 1e3,
+        }
+
+    def percentiles(self):
+        # {interval: (p50, p99, max)} in us
+        stats = {}
+        for name, dt in self.intervals().items():
+            if len(dt):
+                p50, p99 = np.percentile(dt, [50, 99])
+                stats[name] = (p50, p99, dt.max())
+            else:
+                stats[name] = (np.nan, np.nan, np.nan)
+        return stats
+
+    def jitter(self):
+        '''
+        {interval: (std, p99, max)} in us of the deviation from the median of
+        emit->output and of the emit times against the FPGA clock (the host
+        interval between consecutive bins minus their frame interval)
+        '''
+        t = self.data
+        intervals = {
+            'emit->output': (t[:, 3] - t[:, 1]) / 1e3,
+            'emit interval': (np.diff(t[:, 1]) - np.diff(t[:, 0]) * (1e9 / self.fs)) / 1e3,
+        }
+        stats = {}
+        for name, dt in intervals.items():
+            if len(dt):
+                dev = np.abs(dt - np.median(dt))
+                stats[name] = (dt.std(), np.percentile(dev, 99), dev.max())
+            else:
+                stats[name] = (np.nan, np.nan, np.nan)
+        return stats
+
+    def histogram(self, name='emit->output', bins=50):
+        return np.histogram(self.intervals()[name], bins=bins)
+
+    def __repr__(self):
+        lines = [f'Latency(n={min(self.n, self.size)})']
+        for name, (p50, p99, dt_max) in self.percentiles().items():
+            lines.append(f'  {name:>16}: p50={p50:.1f}us p99={p99:.1f}us max={dt_max:.1f}us')
+        return '\n'.join(lines)
+
+    def dump(self, filename='./latency.npz'):
+        t = self.data
+        np.savez(filename, fs=self.fs, **{stage: t[:, i] for i, stage in enumerate(self.STAGES)})
+        tprint(f'nctrl.latency.Latency.dump: {len(t)} bins saved to {filename}')
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+
+from nctrl.utils import tprint
+
+
+MAGIC = b'NCTRLLOG'
+VERSION = 1
+HEADER_ALIGN = 64
+
+
+def record_dtype(n_units):
+    return np.dtype([
+        ('frame', '<i8'),           # binner current_time (FPGA frame)
+        ('t_emit', '<i8'),          # perf_counter_ns entering on_decode
+        ('t_output', '<i8'),        # perf_counter_ns after the output returned
+        ('state', '<u4'),           # decoder is_active (bit i: rule/row i)
+        ('threshold', '<f4'),       # decoder nspike when it is a scalar, else nan
+        ('cmd', 'u1'),              # command sent for the bin (0: none)
+        ('arg', '<u4'),
+        ('counts', '<u2', (n_units,)),  # newest bin X[-1]
+    ])
+
+
+class SessionLog():
+    '''
+    Append-only binary log of every decoded bin.
+
+    record() only fills the next slot of a preallocated column ring (a few
+    scalar stores and one row copy); a background thread packs the slots
+    written since its last pass into fixed-size records and appends them to
+    the file every flush_interval seconds. The file is a small JSON header
+    (dtype, fs, start time) padded to 64 bytes followed by the records, so
+    load_log() maps a whole session without parsing. Slots overwritten before
+    they were flushed are counted in n_lost.
+    '''
+    STATE_WEIGHTS = 1 << np.arange(32, dtype=np.int64)
+
+    def __init__(self, filename=None, size=1 << 16, flush_interval=0.1, fs=25000):
+        self.filename = filename or time.strftime('./session_%Y%m%d_%H%M%S.nclog')
+        self.size = size
+        self.flush_interval = flush_interval
+        self.fs = fs
+        self.n = 0
+        self.n_written = 0
+        self.n_lost = 0
+        self._file = None
+        self._thread = None
+        self._keep_running = True
+        self._ready = threading.Event()
+
+    def _allocate(self, n_units):
+        self.dtype = record_dtype(n_units)
+        self._cols = {name: np.zeros((self.size,) + self.dtype[name].shape, dtype=self.dtype[name].base)
+                      for name in self.dtype.names}
+        self._frame, self._t_emit, self._t_output = self._cols['frame'], self._cols['t_emit'], self._cols['t_output']
+        self._state, self._threshold = self._cols['state'], self._cols['threshold']
+        self._cmd, self._arg, self._counts = self._cols['cmd'], self._cols['arg'], self._cols['counts']
+
+        header = json.dumps({'version': VERSION, 'dtype': self.dtype.descr, 'fs': self.fs,
+                             'start': time.time()}).encode()
+        size = -(-(len(MAGIC) + 4 + len(header)) // HEADER_ALIGN) * HEADER_ALIGN
+        self._file = open(self.filename, 'wb')
+        self._file.write(MAGIC + len(header).to_bytes(4, 'little') + header.ljust(size - len(MAGIC) - 4))
+        self._thread = threading.Thread(target=self._run, name='nctrl-session-log', daemon=True)
+        self._thread.start()
+        tprint(f'nctrl.log.SessionLog: logging {n_units} units per bin to {self.filename}')
+
+    def record(self, frame, t_emit, t_output, X, dec, command):
+        if self._file is None:
+            self._allocate(X.shape[1])
+        i = self.n % self.size
+        self._frame[i] = frame
+        self._t_emit[i] = t_emit
+        self._t_output[i] = t_output
+        self._counts[i] = X[-1]
+
+        active = getattr(dec, 'is_active', False)
+        if isinstance(active, np.ndarray):
+            self._state[i] = np.dot(self.STATE_WEIGHTS[:len(active)], active[:32])
+        else:
+            self._state[i] = active
+        nspike = getattr(dec, 'nspike', np.nan)
+        self._threshold[i] = nspike if np.isscalar(nspike) else np.nan
+        self._cmd[i], self._arg[i] = command if command is not None else (0, 0)
+        self.n += 1
+
+    def _run(self):
+        while self._keep_running:
+            self._ready.wait(self.flush_interval)
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        n = self.n
+        start = self.n_written
+        if n - start > self.size:
+            self.n_lost += n - start - self.size
+            start = n - self.size
+        if n == start:
+            return
+        idx = np.arange(start, n) % self.size
+        records = np.empty(len(idx), dtype=self.dtype)
+        for name, col in self._cols.items():
+            records[name] = col[idx]
+        self._file.write(records.tobytes())
+        self._file.flush()
+        self.n_written = n
+
+    def close(self):
+        if self._file is None:
+            return
+        self._keep_running = False
+        self._ready.set()
+        self._thread.join()
+        self._file.close()
+        tprint(f'nctrl.log.SessionLog.close: {self.n_written} bins written to {self.filename}, {self.n_lost} lost')
+
+    def __repr__(self):
+        return f'SessionLog({self.filename}, bins={self.n}, written={self.n_written}, lost={self.n_lost})'
+
+
+def load_log(filename):
+    '''
+    Returns (meta, records): the header dict and every record of a session log
+    as a read-only structured memmap (records['counts'] is (n_bins, n_units), etc.)
+    '''
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'nctrl.log.load_log: {filename} is not a session log')
+        n = int.from_bytes(f.read(4), 'little')
+        meta = json.loads(f.read(n))
+    offset = -(-(len(MAGIC) + 4 + n) // HEADER_ALIGN) * HEADER_ALIGN
+    dtype = np.dtype([tuple(field) for field in meta['dtype']])
+    n_records = (os.path.getsize(filename) - offset) // dtype.itemsize
+    if n_records == 0:
+        return meta, np.zeros(0, dtype=dtype)
+    return meta, np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(n_records,))
@@ -0,0 +1,124 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from nctrl.utils import tprint
+
+
+def _convert_chunk(src, n_ch, start, stop, dst, offset, dtype):
+    # int32 samples [start, stop) of src -> saturated (n_ch, stop - start) block of dst at byte offset
+    info = np.iinfo(dtype)
+    data = np.memmap(src, dtype=np.int32, mode='r', offset=start * n_ch * 4, shape=(stop - start, n_ch))
+    n_low = np.count_nonzero(data < info.min, axis=0)
+    n_high = np.count_nonzero(data > info.max, axis=0)
+    block = np.memmap(dst, dtype=dtype, mode='r+', offset=offset, shape=(n_ch, stop - start))
+    block[:] = np.clip(data, info.min, info.max).T
+    block.flush()
+    return n_low, n_high
+
+
+def convert_mua(src='./mua.bin', dst=None, n_ch=160, fs=25000, dtype=np.int16, chunk=1 << 16, n_workers=None):
+    '''
+    Convert an int32 mua.bin into a narrower integer type, chunk by chunk across
+    a process pool, so the file is never fully in memory.
+
+    Out-of-range values saturate at the limits of dtype instead of wrapping and
+    are counted per channel. Each chunk is stored channel-major, so reading a
+    few channels of a time range touches only those rows of the chunks it spans.
+    The layout (n_ch, fs, chunk starts and byte offsets) and clipping statistics
+    go to <dst>_index.npz. Returns a MuaFile of the result.
+    '''
+    dtype = np.dtype(dtype)
+    if dst is None:
+        dst = os.path.splitext(src)[0] + f'_{dtype.itemsize * 8}.bin'
+    n_samples = os.path.getsize(src) // (n_ch * 4)
+    starts = np.arange(0, n_samples, chunk, dtype=np.int64)
+    stops = np.minimum(starts + chunk, n_samples)
+    offsets = np.r_[0, np.cumsum((stops - starts) * n_ch * dtype.itemsize)]
+
+    with open(dst, 'wb') as f:
+        f.truncate(int(offsets[-1]))
+
+    args = [(src, n_ch, int(start), int(stop), dst, int(offset), dtype)
+            for start, stop, offset in zip(starts, stops, offsets)]
+    if n_workers == 1:
+        results = [_convert_chunk(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(_convert_chunk, *zip(*args))) if args else []
+
+    n_low = np.sum([r[0] for r in results], axis=0) if results else np.zeros(n_ch, dtype=np.int64)
+    n_high = np.sum([r[1] for r in results], axis=0) if results else np.zeros(n_ch, dtype=np.int64)
+    np.savez(MuaFile.index_file(dst), n_ch=n_ch, fs=fs, dtype=dtype.str, n_samples=n_samples,
+             starts=starts, offsets=offsets, n_low=n_low, n_high=n_high)
+
+    n_clipped = int(n_low.sum() + n_high.sum())
+    tprint(f'nctrl.mua.convert_mua: {n_samples} samples x {n_ch} channels -> {dst} ({dtype}), '
+           f'{n_clipped} values clipped ({n_clipped / max(n_samples * n_ch, 1):.2e})')
+    return MuaFile(dst)
+
+
+class MuaFile():
+    '''
+    Random access to a file written by convert_mua.
+
+    read(start, stop, channels) returns the (stop - start, len(channels)) samples
+    in the orientation of mua.bin, reading only the requested channels of the
+    chunks the range overlaps.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        with np.load(self.index_file(filename)) as f:
+            self.n_ch = int(f['n_ch'])
+            self.fs = float(f['fs'])
+            self.dtype = np.dtype(str(f['dtype']))
+            self.n_samples = int(f['n_samples'])
+            self.starts = f['starts']
+            self.offsets = f['offsets']
+            self.n_low = f['n_low']
+            self.n_high = f['n_high']
+        self._data = np.memmap(filename, dtype=self.dtype, mode='r') if self.n_samples else np.zeros(0, self.dtype)
+
+    @staticmethod
+    def index_file(filename):
+        return os.path.splitext(filename)[0] + '_index.npz'
+
+    def __len__(self):
+        return self.n_samples
+
+    @property
+    def shape(self):
+        return (self.n_samples, self.n_ch)
+
+    @property
+    def n_clipped(self):
+        # clipped values per channel
+        return self.n_low + self.n_high
+
+    def _block(self, i):
+        # (n_ch, chunk length) view of chunk i
+        size = (self.offsets[i + 1] - self.offsets[i]) // self.dtype.itemsize
+        begin = self.offsets[i] // self.dtype.itemsize
+        return self._data[begin:begin + size].reshape(self.n_ch, -1)
+
+    def read(self, start=0, stop=None, channels=None):
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        start = max(start, 0)
+        channels = np.arange(self.n_ch) if channels is None else np.atleast_1d(channels)
+        out = np.empty((len(channels), max(stop - start, 0)), dtype=self.dtype)
+        if stop <= start:
+            return out.T
+        first = np.searchsorted(self.starts, start, 'right') - 1
+        last = np.searchsorted(self.starts, stop, 'left')
+        for i in range(first, last):
+            c0 = self.starts[i]
+            s0, s1 = max(start, c0), min(stop, c0 + self._block(i).shape[1])
+            out[:, s0 - start:s1 - start] = self._block(i)[channels, s0 - c0:s1 - c0]
+        return out.T
+
+    def read_time(self, t0, t1, channels=None):
+        # same as read() with the range in seconds
+        return self.read(int(round(t0 * self.fs)), int(round(t1 * self.fs)), channels)
+
+    def __repr__(self):
+        return f'MuaFile({self.filename}, n_samples={self.n_samples}, n_ch={self.n_ch}, dtype={self.dtype}, clipped={int(self.n_clipped.sum())})'
@@ -1,52 +1,359 @@
 import time
+import threading
 import serial
 import numpy as np
+from collections import deque
 
+from nctrl import protocol
 from nctrl.utils import tprint
 
-class Laser:
-    def __init__(self, port, duration=500):
-        self.ser = serial.Serial(port=port, baudrate=115200, timeout=0)
-        self.ser.flushInput()
-        self.ser.flushOutput()
-        self.duration = duration
-        self.set_duration(duration)
+
+class SerialWriter(threading.Thread):
+    '''
+    Writes commands to a serial port from a dedicated thread.
+
+    write() only appends a (cmd, arg) command to a bounded deque, so the decode
+    thread never waits on USB-serial backpressure; framing (nctrl.protocol) and
+    sequence numbers are done on the writer thread. Commands in `coalesce` are
+    idempotent on the firmware and are dropped when they repeat the previous
+    command. When the queue is full, policy decides: 'drop_oldest', 'drop_newest'
+    or 'block'. With log_sent, self.sent maps seq -> perf_counter_ns at write.
+    With a latency (nctrl.latency.Latency), the write of the first command of
+    each decoded bin is stamped into its row.
+    '''
+    POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+    def __init__(self, ser, maxlen=64, policy='drop_oldest', coalesce=((protocol.LASER_ABORT, 0),), log_sent=False):
+        super().__init__(name='nctrl-serial-writer', daemon=True)
+        if policy not in self.POLICIES:
+            raise ValueError(f'nctrl.output.SerialWriter: policy must be one of {self.POLICIES}')
+        self.ser = ser
+        self.maxlen = maxlen
+        self.policy = policy
+        self.coalesce = frozenset(coalesce)
+        self.encode = protocol.Encoder()
+        self.sent = {} if log_sent else None
+        self.latency = None
+        self._queue = deque(maxlen=maxlen if policy == 'drop_oldest' else None)
+        self._ready = threading.Event()
+        self._space = threading.Event()
+        self._last = None
+        self._keep_running = True
+
+        self.n_written = 0
+        self.n_bytes = 0
+        self.n_coalesced = 0
+        self.n_dropped = 0
+
+    def write(self, cmd):
+        if cmd == self._last and cmd in self.coalesce:
+            self.n_coalesced += 1
+            return
+
+        if len(self._queue) >= self.maxlen:
+            if self.policy == 'drop_newest':
+                self.n_dropped += 1
+                return
+            elif self.policy == 'drop_oldest':
+                self.n_dropped += 1  # the deque discards the oldest itself
+            else:
+                while len(self._queue) >= self.maxlen and self._keep_running:
+                    self._space.clear()
+                    self._space.wait(0.001)
+        latency = self.latency
+        self._queue.append((cmd, latency.row if latency is not None else -1))
+        # only a queued command is coalesced against, a dropped one must go out again
+        self._last = cmd
+        self._ready.set()
+
+    def run(self):
+        queue, write, encode, sent = self._queue, self.ser.write, self.encode, self.sent
+        while self._keep_running or queue:
+            self._ready.wait(0.1)
+            self._ready.clear()
+            while queue:
+                cmd, row = queue.popleft()
+                frame = encode(cmd)
+                self._space.set()
+                if sent is not None:
+                    sent[(encode.seq - 1) & 0xffff] = time.perf_counter_ns()
+                write(frame)
+                if row >= 0:
+                    self.latency.written(row, time.perf_counter_ns())
+                self.n_written += 1
+                self.n_bytes += len(frame)
+
+    def stop(self):
+        self._keep_running = False
+        self._ready.set()
+        self.join()
+
+    def __repr__(self):
+        return (f'SerialWriter(policy={self.policy}, queued={len(self._queue)}, written={self.n_written}, '
+                f'bytes={self.n_bytes}, coalesced={self.n_coalesced}, dropped={self.n_dropped})')
+
+
+class Output:
+    '''
+    Base of the output backends: maps the decoder output y to protocol commands
+    and hands them to self.write((cmd, arg)).
+    '''
+    # commands sent on the decode path, built once
+    START = (protocol.LASER_START, 0)
+    ABORT = (protocol.LASER_ABORT, 0)
+    PIN_WEIGHTS = 1 << np.arange(16, dtype=np.int64)
+
+    # last command sent by __call__, None when y sent nothing
+    command = None
 
     def __call__(self, y):
         if isinstance(y, int):
             if y == 1:
-                print('laser !!')
-                self.ser.write(b'a')
+                self.command = self.START
+                self.write(self.START)
+                tprint(f'nctrl.output.{type(self).__name__}: laser !!')
             else: 
-                self.ser.write(b'A')
-        elif isinstance(y, (list, np.ndarray)) and len(y) > 1:
-            y_uint16 = np.packbits(y[0].astype(np.uint8)).view(np.uint16)
-            self.ser.write(b'p' + y_uint16.tobytes())
+                self.command = self.ABORT
+                self.write(self.ABORT)
+        elif isinstance(y, (list, np.ndarray)) and len(y) > 0:
+            # unit i -> spike pin i, as one dot product with the pin weights
+            mask = int(np.dot(self.PIN_WEIGHTS[:len(y)], y))
+            self.command = (protocol.SPIKES, mask)
+            self.write(self.command)
+        else:
+            self.command = None
+
+    def write(self, command):
+        raise NotImplementedError
+
+    def on(self):
+        self.write((protocol.ENABLE, 0))
+
+    def off(self):
+        self.write((protocol.DISABLE, 0))
+
+    def set_duration(self, duration):
+        if not isinstance(duration, int) or duration < 0:
+            raise ValueError("Duration (ms) must be a non-negative integer")
+        self.duration = duration
+        self.write((protocol.SET_DURATION, duration))
+
+    def close(self):
+        pass
+
+
+class Laser(Output):
+    MESSAGES = {
+        protocol.ENABLE: 'Laser enabled',
+        protocol.DISABLE: 'Laser disabled',
+        protocol.CONST_ON: 'Laser is on',
+        protocol.CONST_OFF: 'Laser is off',
+        protocol.SET_DURATION: 'Laser duration is set to {}',
+        protocol.PING: 'Protocol version {}',
+    }
+
+    def __init__(self, port, duration=500, threaded=True, maxlen=64, policy='drop_oldest'):
+        self.ser = serial.Serial(port=port, baudrate=115200, timeout=0)
+        self.ser.flushInput()
+        self.ser.flushOutput()
+        self.parser = protocol.Parser()
+        if threaded:
+            self.writer = SerialWriter(self.ser, maxlen=maxlen, policy=policy)
+            self.writer.start()
+            self.write = self.writer.write
+        else:
+            self.writer = None
+            encode = protocol.Encoder()
+            self.write = lambda command: self.ser.write(encode(command))
+        self.duration = duration
+        self.set_duration(duration)
 
     def __repr__(self):
         return f'Laser(port={self.ser.port}, duration={self.duration})'
     
     def on(self):
-        self.ser.write(b'e')
+        self.write((protocol.ENABLE | protocol.ACK_REQ, 0))
         tprint('nctrl.output.Laser.on: Laser on')
         self.print_serial()
     
     def off(self):
-        self.ser.write(b'E')
+        self.write((protocol.DISABLE | protocol.ACK_REQ, 0))
         tprint('nctrl.output.Laser.off: Laser off')
         self.print_serial()
     
     def set_duration(self, duration):
         if not isinstance(duration, int) or duration < 0:
             raise ValueError("Duration (ms) must be a non-negative integer")
-        self.ser.write(f'd{duration}'.encode())
+        self.duration = duration
+        self.write((protocol.SET_DURATION | protocol.ACK_REQ, duration))
         tprint(f'nctrl.output.Laser.set_duration: Setting duration to {duration} ms')
         self.print_serial()
+
+    def ping(self):
+        self.write((protocol.PING | protocol.ACK_REQ, 0))
+        return self.print_serial()
     
-    def print_serial(self):
-        while True:
-            output = self.ser.readline().decode().strip()
-            if output:
-                tprint(f'nctrl.output.Laser.from_serial: {output}')
-                break
-            time.sleep(0.1)  # Wait a bit before trying again
\ No newline at end of file
+    def close(self):
+        if self.writer is not None:
+            self.writer.stop()
+        self.ser.close()
+
+    def print_serial(self, timeout=1.0):
+        # wait for the ack (or nak) of the last ACK_REQ command; returns its value
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            for cmd, seq, arg in self.parser.feed(self.ser.read(self.ser.in_waiting or 1)):
+                if cmd == protocol.ACK:
+                    acked, value = arg >> 24, arg & 0xffffff
+                    message = self.MESSAGES.get(acked, protocol.NAMES.get(acked, hex(acked)))
+                    tprint(f'nctrl.output.Laser.from_serial: {message.format(value)}')
+                    return value
+                elif cmd == protocol.NAK:
+                    tprint(f'nctrl.output.Laser.from_serial: command {seq} rejected (error {arg})')
+                    return None
+            time.sleep(0.001)
+        tprint(f'nctrl.output.Laser.from_serial: no ack within {timeout} s')
+        return None
+
+
+class NullOutput(Output):
+    # discards every command (Output.command still tracks it for the session log); used
+    # for replay and benchmarking without a Teensy
+    def __init__(self, port=None, **kwargs):
+        pass
+
+    def write(self, command):
+        pass
+
+    def __repr__(self):
+        return 'NullOutput()'
+
+
+# records of FileOutput (commands) and SimStimulator (pin edges)
+COMMAND_DTYPE = np.dtype([('t', '<i8'), ('cmd', 'u1'), ('arg', '<u4')])
+EDGE_DTYPE = np.dtype([('t', '<i8'), ('line', 'u1'), ('value', '<u2')])
+
+
+class _RecordFile:
+    # fixed-size binary records, buffered in a preallocated array and appended to a file when full
+    def __init__(self, filename, dtype, chunk=4096):
+        self.filename = filename
+        self._file = open(filename, 'wb')
+        self._buf = np.zeros(chunk, dtype=dtype)
+        self._n = 0
+        self.n_records = 0
+
+    def append(self, *record):
+        self._buf[self._n] = record
+        self._n += 1
+        if self._n == len(self._buf):
+            self.flush()
+
+    def flush(self):
+        self._buf[:self._n].tofile(self._file)
+        self._file.flush()
+        self.n_records += self._n
+        self._n = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class FileOutput(Output):
+    '''
+    Records every command as (t [ns, perf_counter_ns], cmd, arg) in a binary file
+    of COMMAND_DTYPE records; read back with load_records(filename, COMMAND_DTYPE).
+    '''
+    def __init__(self, port='./output.bin', duration=500):
+        self.records = _RecordFile(port, COMMAND_DTYPE)
+        self.set_duration(duration)
+
+    def write(self, command):
+        self.records.append(time.perf_counter_ns(), *command)
+
+    def close(self):
+        self.records.close()
+
+    def __repr__(self):
+        return f'FileOutput(port={self.records.filename})'
+
+
+class SimStimulator(Output):
+    '''
+    Simulated Teensy: runs the firmware state machine (nctrl.emulator.Firmware,
+    5 ms on / 20 ms interval / finishDuration) on every command and writes the
+    resulting pin edges as (t [us], line, value) EDGE_DTYPE records.
+
+    clock() returns the current time in us; by default the wall clock since
+    construction, NCtrl passes the replayed spike time when replaying.
+    '''
+    def __init__(self, port='./stim.bin', duration=500, clock=None):
+        from nctrl.emulator import Firmware
+        self.firmware = Firmware()
+        if clock is None:
+            t0 = time.perf_counter_ns()
+            clock = lambda: (time.perf_counter_ns() - t0) // 1000
+        self.clock = clock
+        self.edges = _RecordFile(port, EDGE_DTYPE)
+        self.set_duration(duration)
+
+    def _advance(self, now):
+        # replay firmware timer transitions up to now at their exact times
+        firmware = self.firmware
+        t = firmware.next_event()
+        while t is not None and t <= now:
+            firmware.update(t)
+            t = firmware.next_event()
+        if firmware.edges:
+            for edge in firmware.edges:
+                self.edges.append(*edge)
+            firmware.edges.clear()
+
+    def write(self, command):
+        now = self.clock()
+        self._advance(now)
+        self.firmware.handle(command[0], command[1], now)
+        self._advance(now)
+
+    def close(self):
+        self._advance(self.clock())
+        self.edges.close()
+
+    def duty_cycle(self):
+        # fraction of time the laser was on, from the edges written so far
+        self.edges.flush()
+        edges = load_records(self.edges.filename, EDGE_DTYPE)
+        return duty_cycle(edges, t_end=self.clock())
+
+    def __repr__(self):
+        return f'SimStimulator(port={self.edges.filename}, duration={self.duration})'
+
+
+def load_records(filename, dtype=EDGE_DTYPE):
+    return np.fromfile(filename, dtype=dtype)
+
+
+def duty_cycle(edges, t_start=0, t_end=None, line=0):
+    # fraction of [t_start, t_end] during which `line` (0: laser) was high
+    edges = edges[edges['line'] == line]
+    if len(edges) == 0:
+        return 0.
+    t = edges['t'].astype(np.int64)
+    t_end = t[-1] if t_end is None else t_end
+    t_next = np.r_[t[1:], t_end]
+    on = edges['value'] > 0
+    return np.sum((t_next - t)[on]) / max(t_end - t_start, 1)
+
+
+# output backends for NCtrl.set_output(output_type, output_port, **kwargs)
+OUTPUTS = {
+    'laser': Laser,
+    'null': NullOutput,
+    'file': FileOutput,
+    'sim': SimStimulator,
+}
+
+
+def register_output(name, cls):
+    OUTPUTS[name] = cls
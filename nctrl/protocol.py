@@ -0,0 +1,129 @@
+'''
+Binary command frames between nctrl.output and teensy/teensy.ino.
+
+Every frame is FRAME_LEN (10) bytes, little endian:
+
+    magic    uint8   0xA5
+    version  uint8   VERSION
+    cmd      uint8   command; bit 7 (ACK_REQ) asks the device to acknowledge
+    seq      uint16  sequence number, incremented by the sender
+    arg      uint32  command argument (duration in ms, 16-bit pin mask, ...)
+    checksum uint8   sum of the preceding 9 bytes & 0xff
+
+The device answers ACK_REQ frames with cmd=ACK, the same seq and
+arg = (acked cmd << 24) | value, or with cmd=NAK and arg = error code.
+Keep the constants in sync with teensy/teensy.ino.
+'''
+import struct
+
+MAGIC = 0xA5
+VERSION = 1
+FRAME = struct.Struct('<BBBHIB')
+FRAME_LEN = FRAME.size
+
+# commands (legacy ASCII command in brackets)
+LASER_START = 0x01  # 'a'
+LASER_ABORT = 0x02  # 'A'
+ENABLE = 0x03       # 'e'
+DISABLE = 0x04      # 'E'
+CONST_ON = 0x05     # 'c'
+CONST_OFF = 0x06    # 'C'
+SET_DURATION = 0x07 # 'd<ms>', arg: duration in ms
+SPIKES = 0x08       # 's', arg: 16-bit pin mask
+PING = 0x09         # arg of the ack: firmware protocol version
+ACK = 0x7E
+NAK = 0x7F
+ACK_REQ = 0x80
+
+# NAK error codes
+ERR_VERSION = 1
+ERR_CHECKSUM = 2
+ERR_COMMAND = 3
+
+NAMES = {
+    LASER_START: 'laser_start', LASER_ABORT: 'laser_abort', ENABLE: 'enable', DISABLE: 'disable',
+    CONST_ON: 'const_on', CONST_OFF: 'const_off', SET_DURATION: 'set_duration', SPIKES: 'spikes',
+    PING: 'ping', ACK: 'ack', NAK: 'nak',
+}
+
+
+def encode(cmd, arg=0, seq=0):
+    buf = bytearray(FRAME_LEN)
+    FRAME.pack_into(buf, 0, MAGIC, VERSION, cmd, seq & 0xffff, arg & 0xffffffff, 0)
+    buf[-1] = sum(buf) & 0xff
+    return bytes(buf)
+
+
+class FrameError(ValueError):
+    # a malformed frame; code is the NAK error code the device answers it with (None for a bad magic)
+    def __init__(self, message, code=None, seq=0):
+        super().__init__(message)
+        self.code = code
+        self.seq = seq
+
+
+def decode(buf):
+    # returns (cmd, seq, arg); raises FrameError on a malformed frame
+    magic, version, cmd, seq, arg, checksum = FRAME.unpack(buf)
+    if magic != MAGIC:
+        raise FrameError(f'nctrl.protocol.decode: bad magic {magic:#x}', None, seq)
+    if sum(buf[:-1]) & 0xff != checksum:
+        raise FrameError('nctrl.protocol.decode: bad checksum', ERR_CHECKSUM, seq)
+    if version != VERSION:
+        raise FrameError(f'nctrl.protocol.decode: protocol version {version}, expected {VERSION}', ERR_VERSION, seq)
+    return cmd, seq, arg
+
+
+class Encoder():
+    '''
+    Packs (cmd, arg) commands into frames with an increasing sequence number,
+    reusing one buffer per frame.
+    '''
+    def __init__(self):
+        self.seq = 0
+        self._buf = bytearray(FRAME_LEN)
+
+    def __call__(self, command):
+        cmd, arg = command
+        buf = self._buf
+        FRAME.pack_into(buf, 0, MAGIC, VERSION, cmd, self.seq, arg, 0)
+        buf[-1] = sum(buf) & 0xff
+        self.seq = (self.seq + 1) & 0xffff
+        return bytes(buf)
+
+
+class Parser():
+    '''
+    Splits a byte stream into frames, skipping bytes until MAGIC so a
+    partially received or corrupted frame does not desynchronise the stream.
+
+    With errors=True it reads like the firmware instead: a malformed frame is
+    consumed whole and returned in place as its FrameError, so a device can
+    answer it with a NAK.
+    '''
+    def __init__(self, errors=False):
+        self._buf = bytearray()
+        self.errors = errors
+        self.n_errors = 0
+
+    def feed(self, data):
+        # returns a list of (cmd, seq, arg), and FrameErrors with errors=True
+        buf = self._buf
+        buf += data
+        frames = []
+        while len(buf) >= FRAME_LEN:
+            if buf[0] != MAGIC:
+                start = buf.find(MAGIC)
+                del buf[:start if start > 0 else len(buf)]
+                continue
+            try:
+                frames.append(decode(bytes(buf[:FRAME_LEN])))
+                del buf[:FRAME_LEN]
+            except FrameError as e:
+                self.n_errors += 1
+                if self.errors:
+                    frames.append(e)
+                    del buf[:FRAME_LEN]
+                else:
+                    del buf[:1]
+        return frames
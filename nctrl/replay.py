@@ -0,0 +1,134 @@
+import time
+import threading
+import numpy as np
+import pandas as pd
+
+from spiketag.realtime import Binner
+
+from nctrl.utils import tprint
+
+
+class _Spike():
+    # minimal stand-in for spiketag's bmi_output, reused for every spike
+    __slots__ = ('timestamp', 'grp_id', 'spk_id')
+
+    def __init__(self):
+        self.timestamp = 0
+        self.grp_id = 0
+        self.spk_id = 0
+
+
+class Replay():
+    '''
+    Offline stand-in for spiketag's BMI.
+
+    Pushes spikes recorded in fet.bin (or spktag/model.pd) through the same
+    Binner -> decoder -> output path that NCtrl uses during a live session.
+    '''
+    def __init__(self, fetfile='./fet.bin', n_units=None, n_items=8, fs=25000):
+        self.fetfile = fetfile
+        self.fs = fs
+        self.binner = None
+        self.dec = None
+        self._thread = None
+        self._keep_running = False
+        self._spike = _Spike()
+        self.load(fetfile, n_items=n_items)
+        if n_units is None:
+            n_units = int(self.spk_id.max()) if len(self.spk_id) else 0
+        self.n_units = n_units
+
+    def load(self, filename, n_items=8):
+        if filename.endswith('.pd'):
+            df = pd.read_pickle(filename)
+            self.spk_time = df['frame_id'].to_numpy().astype(np.int64)
+            self.grp_id = df['group_id'].to_numpy().astype(np.int64)
+            self.spk_id = df['spike_id'].to_numpy().astype(np.int64)
+        else:
+            # fet.bin: [frame_id, group_id, fet0, fet1, fet2, fet3, spike_id, energy]
+            fet = np.fromfile(filename, dtype=np.int32).reshape(-1, n_items)
+            self.spk_time = fet[:, 0].astype(np.int64)
+            self.grp_id = fet[:, 1].astype(np.int64)
+            self.spk_id = fet[:, 6].astype(np.int64)
+        tprint(f'nctrl.replay.Replay.load: {len(self.spk_time)} spikes from {filename}')
+
+    @property
+    def duration(self):
+        if len(self.spk_time) == 0:
+            return 0.
+        return (self.spk_time[-1] - self.spk_time[0]) / self.fs
+
+    def clock(self):
+        # session time (us) of the spike being replayed
+        return self._spike.timestamp * 1000000 // self.fs
+
+    def set_binner(self, bin_size, B_bins):
+        self.bin_size = bin_size
+        self.binner = Binner(bin_size, self.n_units + 1, B_bins)
+
+    def set_decoder(self, dec):
+        self.dec = dec
+        if self.binner is None:
+            self.set_binner(bin_size=dec.t_window, B_bins=1)
+
+    def run(self, speed=None):
+        '''
+        speed=None: as fast as possible
+        speed=1.0: wall-clock speed (2.0 is twice as fast, etc.)
+        '''
+        if self.binner is None:
+            raise ValueError('nctrl.replay.Replay.run: set_binner or set_decoder first')
+
+        spike = self._spike
+        binner_input = self.binner.input
+        spk_time, grp_id, spk_id = self.spk_time.tolist(), self.grp_id.tolist(), self.spk_id.tolist()
+        n_spikes = len(spk_time)
+        t0 = spk_time[0] if n_spikes else 0
+        frame_to_s = 1 / self.fs / speed if speed else 0
+
+        self._keep_running = True
+        tic = time.perf_counter()
+        i = 0
+        for i in range(n_spikes):
+            if not self._keep_running:
+                break
+            if speed:
+                delay = tic + (spk_time[i] - t0) * frame_to_s - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            spike.timestamp = spk_time[i]
+            spike.grp_id = grp_id[i]
+            spike.spk_id = spk_id[i]
+            binner_input(spike)
+        else:
+            i = n_spikes
+        elapsed = time.perf_counter() - tic
+        self._keep_running = False
+
+        # the binner emits once whenever a spike lands in a later bin than the previous one
+        bin_idx = self.spk_time[:i] // (self.bin_size * self.fs)
+        n_bins = int(np.count_nonzero(np.diff(np.r_[0, bin_idx]) > 0))
+
+        self.stats = {
+            'n_spikes': i,
+            'n_bins': n_bins,
+            'elapsed': elapsed,
+            'spikes_per_s': i / elapsed if elapsed > 0 else np.inf,
+            'bins_per_s': n_bins / elapsed if elapsed > 0 else np.inf,
+            'realtime_factor': (self.spk_time[i - 1] - t0) / self.fs / elapsed if i and elapsed > 0 else np.inf,
+        }
+        tprint(f'nctrl.replay.Replay.run: {i} spikes, {n_bins} bins in {elapsed:.3f} s '
+               f'({self.stats["spikes_per_s"]:.0f} spikes/s, {self.stats["bins_per_s"]:.0f} bins/s, '
+               f'{self.stats["realtime_factor"]:.1f}x realtime)')
+        return self.stats
+
+    def start(self, gui_queue=False, speed=1.0):
+        # same signature as BMI.start so the GUI can drive a replay
+        self._thread = threading.Thread(target=self.run, kwargs={'speed': speed}, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._keep_running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,114 @@
+import numpy as np
+
+from nctrl import protocol
+from nctrl.sync import nidq_edges, align_nidq, to_intervals
+from nctrl.utils import tprint
+
+
+def model_triggers(unit, unit_id, bin_size, B, nspike):
+    # laser onsets (s, FPGA clock) FrThreshold makes with these parameters, from Unit.sweep
+    df = unit.sweep(bin_sizes=[bin_size], Bs=[B], nspikes=[nspike], unit_ids=[unit_id])
+    return np.asarray(df['onset_time'].iloc[0], dtype=np.float64)
+
+
+def log_triggers(filename, fs=25000):
+    # bins (s, FPGA clock) where the decode loop actually sent LASER_START, from a SessionLog
+    from nctrl.log import load_log
+    meta, records = load_log(filename)
+    start = (records['cmd'] | protocol.ACK_REQ) == (protocol.LASER_START | protocol.ACK_REQ)
+    return records['frame'][start] / meta.get('fs', fs)
+
+
+def laser_trains(intervals, train_gap=0.05):
+    '''
+    Group laser pulses (an (n, 2) [start, end) array) into trains: a pulse
+    starting within train_gap of the previous pulse's end belongs to its train
+    (the firmware repeats 5 ms on / 20 ms off until the duration is over).
+    Returns the (n_train, 2) [first start, last end] of every train.
+    '''
+    if len(intervals) == 0:
+        return intervals.reshape(0, 2)
+    new = np.r_[True, intervals[1:, 0] - intervals[:-1, 1] > train_gap]
+    first = np.flatnonzero(new)
+    last = np.r_[first[1:], len(intervals)] - 1
+    return np.column_stack((intervals[first, 0], intervals[last, 1]))
+
+
+def match_triggers(triggers, trains, max_latency=0.05):
+    '''
+    Match intended triggers to laser train onsets, both in seconds of one clock.
+
+    A trigger inside a running train is absorbed (the firmware only extends
+    it). Otherwise it is matched to the first train starting within max_latency
+    after it; when several triggers reach the same train, the first one is
+    the match and the rest are absorbed. Unmatched triggers are missed and
+    trains without a trigger are spurious.
+    '''
+    triggers = np.sort(np.asarray(triggers, dtype=np.float64))
+    onset, end = trains[:, 0], trains[:, 1]
+
+    # the train running at the trigger, if any
+    k = np.searchsorted(onset, triggers, 'right') - 1
+    absorbed = (k >= 0) & (triggers < end[np.maximum(k, 0)])
+
+    # the next train onset
+    j = np.searchsorted(onset, triggers, 'left')
+    has_next = j < len(onset)
+    latency = np.full(len(triggers), np.inf)
+    latency[has_next] = onset[j[has_next]] - triggers[has_next]
+    candidate = ~absorbed & (latency <= max_latency)
+
+    matched = np.zeros(len(triggers), dtype=bool)
+    idx = np.flatnonzero(candidate)
+    _, first = np.unique(j[idx], return_index=True)
+    matched[idx[first]] = True
+    absorbed |= candidate & ~matched
+
+    caused = np.zeros(len(onset), dtype=bool)
+    caused[j[matched]] = True
+    return {
+        'trigger': triggers,
+        'matched': matched,
+        'absorbed': absorbed,
+        'missed': ~matched & ~absorbed,
+        'latency': latency[matched],
+        'train': j[matched],
+        'spurious': np.flatnonzero(~caused),
+    }
+
+
+def summary(result):
+    latency_ms = result['latency'] * 1e3
+    stats = {
+        'n_trigger': len(result['trigger']),
+        'n_matched': int(result['matched'].sum()),
+        'n_absorbed': int(result['absorbed'].sum()),
+        'n_missed': int(result['missed'].sum()),
+        'n_spurious': len(result['spurious']),
+    }
+    if len(latency_ms):
+        p50, p90, p99 = np.percentile(latency_ms, [50, 90, 99])
+        stats.update(latency_mean_ms=latency_ms.mean(), latency_p50_ms=p50, latency_p90_ms=p90,
+                     latency_p99_ms=p99, latency_max_ms=latency_ms.max())
+    return stats
+
+
+def hardware_latency(nidq_file, fpga_sync, triggers, fs=25000, max_latency=0.05, train_gap=0.05,
+                     min_width=None, tol=0.005):
+    '''
+    Trigger -> laser onset report of a session.
+
+    nidq_file: the .nidq.bin with the LASER and SYNC lines; fpga_sync: frame_ids
+    of the SYNC pulses the FPGA sent; triggers: intended trigger times (s, FPGA
+    clock), e.g. model_triggers(unit, ...) or log_triggers(session_log).
+    Returns (summary dict, match_triggers result) with laser trains in FPGA seconds.
+    '''
+    edges = nidq_edges(nidq_file, min_width=min_width)
+    clock = align_nidq(nidq_file, fpga_sync, fs=fs, tol=tol, edges=edges)
+    trains = laser_trains(to_intervals(edges['LASER'], clock) / fs, train_gap)
+    result = match_triggers(triggers, trains, max_latency)
+    result['trains'] = trains
+    stats = summary(result)
+    tprint('nctrl.report.hardware_latency: ' + ', '.join(
+        f'{key}={value:.2f}' if isinstance(value, float) else f'{key}={value}' for key, value in stats.items()))
+    return stats, result
@@ -0,0 +1,80 @@
+class Router():
+    '''
+    Fans every bin of one binner out to several decoders and output devices.
+
+    Decoders and outputs are registered by name; a route sends the y of one
+    decoder to one or more outputs (e.g. a rate threshold to the laser on one
+    port and a population decoder to a second Teensy). Every change rebuilds
+    a flat plan of (decoder, outputs) tuples, so the bin path is one loop over
+    it: predict() runs every decoder on the shared X, send() hands each y to
+    its outputs. The plan and its y slots are published as one tuple, so a
+    route changed from another thread never pairs a new plan with old slots.
+    All decoders see the same binned window, so they share the binner's
+    bin_size and B.
+    '''
+    def __init__(self):
+        self.decoders = {}
+        self.outputs = {}
+        self.routes = {}
+        self._plan = ((), [])
+
+    def _compile(self):
+        plan = tuple((self.decoders[name], tuple(self.outputs[out] for out in outs if out in self.outputs))
+                     for name, outs in self.routes.items())
+        self._plan = (plan, [None] * len(plan))
+
+    @property
+    def y(self):
+        # the y of every route from the last predict(), in route order
+        return self._plan[1]
+
+    def attach(self, name, dec, outputs=('main',)):
+        # (re)place decoder `name` and route it to the named outputs
+        if isinstance(outputs, str):
+            outputs = (outputs,)
+        self.decoders[name] = dec
+        self.routes[name] = tuple(outputs)
+        self._compile()
+
+    def detach(self, name):
+        dec = self.decoders.pop(name, None)
+        self.routes.pop(name, None)
+        self._compile()
+        return dec
+
+    def add_output(self, name, output):
+        # (re)place output `name`; the one it replaces is closed
+        old = self.outputs.get(name)
+        if old is not None and old is not output:
+            old.close()
+        self.outputs[name] = output
+        self._compile()
+
+    def remove_output(self, name):
+        output = self.outputs.pop(name, None)
+        if output is not None:
+            output.close()
+        self._compile()
+
+    def predict(self, X):
+        plan, y = self._plan
+        for i, (dec, _) in enumerate(plan):
+            y[i] = dec.predict(X)
+        return plan, y
+
+    def send(self, routed=None):
+        # routed: what predict() returned, so both passes use the same plan
+        plan, y = self._plan if routed is None else routed
+        for i, (_, outputs) in enumerate(plan):
+            for output in outputs:
+                output(y[i])
+
+    def close(self):
+        for output in self.outputs.values():
+            output.close()
+        self.outputs.clear()
+        self._compile()
+
+    def __repr__(self):
+        routes = ', '.join(f'{name} -> {list(outs)}' for name, outs in self.routes.items())
+        return f'Router({routes})'
@@ -0,0 +1,122 @@
+import os
+import gc
+import threading
+
+from nctrl.utils import tprint
+
+
+class RealtimeMode():
+    '''
+    Isolates the decode path from the rest of the interpreter while streaming.
+
+    enter() collects and freezes everything allocated so far and disables the
+    garbage collector, so no collection pause lands on a bin (the decoders
+    preallocate their per-bin buffers, so little garbage accrues). When cpu is
+    given the decode thread is pinned to that core on its first bin (pin() must
+    run on the thread itself) and the other threads are kept off it; priority
+    asks for SCHED_FIFO at that priority, falling back to a lower nice value,
+    both best effort without the needed privileges. exit() restores everything.
+    n_gc counts collections that still ran while active (gc.collect() calls).
+    '''
+    def __init__(self, cpu=None, priority=None):
+        self.cpu = cpu
+        self.priority = priority
+        self.active = False
+        self.pending = False
+        self.n_gc = 0
+        self.decode_thread = None
+        self._gc_enabled = True
+        self._affinity = None
+        self._scheduler = None
+        self._nice = None
+
+    def _on_gc(self, phase, info):
+        if phase == 'start':
+            self.n_gc += 1
+
+    def enter(self):
+        if self.active:
+            return
+        gc.collect()
+        gc.freeze()
+        self._gc_enabled = gc.isenabled()
+        gc.disable()
+        gc.callbacks.append(self._on_gc)
+        self.n_gc = 0
+
+        if self.cpu is not None and hasattr(os, 'sched_setaffinity'):
+            # keep the calling (GUI) thread and the threads it starts off the decode core
+            self._affinity = os.sched_getaffinity(0)
+            others = self._affinity - {self.cpu}
+            if others:
+                os.sched_setaffinity(0, others)
+        self.pending = self.cpu is not None or self.priority is not None
+        self.active = True
+        tprint(f'nctrl.rt.RealtimeMode.enter: gc frozen ({gc.get_freeze_count()} objects) and disabled'
+               + (f', decode thread -> cpu {self.cpu}' if self.cpu is not None else ''))
+
+    def pin(self):
+        # called on the decode thread
+        self.pending = False
+        self.decode_thread = threading.get_native_id()
+        if self.cpu is not None and hasattr(os, 'sched_setaffinity'):
+            try:
+                os.sched_setaffinity(0, {self.cpu})
+            except OSError as e:
+                tprint(f'nctrl.rt.RealtimeMode.pin: could not pin to cpu {self.cpu} ({e})')
+        if self.priority is not None:
+            self._elevate()
+
+    def _elevate(self):
+        try:
+            self._scheduler = (os.sched_getscheduler(0), os.sched_getparam(0))
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+            tprint(f'nctrl.rt.RealtimeMode.pin: decode thread on SCHED_FIFO {self.priority}')
+        except (OSError, AttributeError):
+            self._scheduler = None
+            try:
+                self._nice = os.getpriority(os.PRIO_PROCESS, 0)
+                os.nice(-10)
+                tprint('nctrl.rt.RealtimeMode.pin: SCHED_FIFO not permitted, decode thread niced to -10')
+            except OSError:
+                self._nice = None
+                tprint('nctrl.rt.RealtimeMode.pin: no permission to raise the decode thread priority')
+
+    def exit(self):
+        if not self.active:
+            return
+        self.active = False
+        self.pending = False
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+        gc.unfreeze()
+        if self._gc_enabled:
+            gc.enable()
+        # a linux thread id works as a pid for the sched_* calls
+        tids = [0] + ([self.decode_thread] if self.decode_thread is not None else [])
+        try:
+            if self._affinity is not None:
+                for tid in tids:
+                    os.sched_setaffinity(tid, self._affinity)
+            if self._scheduler is not None:
+                os.sched_setscheduler(self.decode_thread, *self._scheduler)
+            if self._nice is not None:
+                # nice is per thread on linux, so restore it on the decode thread's id
+                os.setpriority(os.PRIO_PROCESS, self.decode_thread, self._nice)
+        except OSError:
+            pass # the decode thread is gone
+        self._affinity = None
+        self._scheduler = None
+        self._nice = None
+        self.decode_thread = None
+        tprint(f'nctrl.rt.RealtimeMode.exit: gc restored, {self.n_gc} collections while active')
+
+    def __enter__(self):
+        self.enter()
+        return self
+
+    def __exit__(self, *exc):
+        self.exit()
+
+    def __repr__(self):
+        return f'RealtimeMode(active={self.active}, cpu={self.cpu}, priority={self.priority}, n_gc={self.n_gc})'
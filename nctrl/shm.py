@@ -0,0 +1,86 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class SpikeRing():
+    '''
+    Fixed-size shared-memory ring of (frame_id, spike_id) int32 records.
+
+    The first 8 bytes hold the write cursor (total records ever written); the
+    single writer fills a slot before advancing it, so readers in any process
+    only ever see complete records. Attach from another process with
+    SpikeRing(name=ring.name, create=False).
+    '''
+    HEADER = 64
+
+    def __init__(self, size=1 << 16, name=None, create=True):
+        nbytes = self.HEADER + size * 2 * np.dtype(np.int32).itemsize
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=nbytes if create else 0)
+        self.name = self.shm.name
+        self.size = size if create else (self.shm.size - self.HEADER) // 8
+        self._cursor = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self.data = np.ndarray((self.size, 2), dtype=np.int32, buffer=self.shm.buf, offset=self.HEADER)
+        # flat memoryviews are the cheapest per-item writes on the push path
+        self._cursor_mv = self.shm.buf[:8].cast('q')
+        self._data_mv = self.shm.buf[self.HEADER:self.HEADER + self.size * 8].cast('i')
+        self._owner = create
+        if create:
+            self._cursor[0] = 0
+
+    @property
+    def cursor(self):
+        return int(self._cursor[0])
+
+    def push(self, frame_id, spike_id):
+        i = self._cursor_mv[0]
+        j = (i % self.size) * 2
+        data = self._data_mv
+        data[j] = frame_id
+        data[j + 1] = spike_id
+        self._cursor_mv[0] = i + 1
+
+    def push_many(self, records):
+        # records: (n, 2) array of (frame_id, spike_id)
+        records = records[-self.size:]
+        i = int(self._cursor[0])
+        idx = (i + np.arange(len(records))) % self.size
+        self.data[idx] = records
+        self._cursor[0] = i + len(records)
+
+    def reader(self, from_start=False):
+        return SpikeRingReader(self, 0 if from_start else self.cursor)
+
+    def close(self):
+        del self._cursor, self.data
+        self._cursor_mv.release()
+        self._data_mv.release()
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+class SpikeRingReader():
+    '''
+    Keeps its own read cursor; read() returns only the records written since
+    the last call. If the writer lapped the reader, the oldest records are lost
+    and counted in n_lost.
+    '''
+    def __init__(self, ring, cursor=0):
+        self.ring = ring
+        self.cursor = cursor
+        self.n_lost = 0
+
+    def read(self):
+        ring = self.ring
+        end = ring.cursor
+        start = self.cursor
+        if end - start > ring.size:
+            self.n_lost += end - start - ring.size
+            start = end - ring.size
+        self.cursor = end
+        if start == end:
+            return ring.data[:0]
+        i0, i1 = start % ring.size, end % ring.size
+        if i0 < i1:
+            return ring.data[i0:i1].copy()
+        return np.concatenate((ring.data[i0:], ring.data[:i1]))
@@ -0,0 +1,323 @@
+import os
+import numpy as np
+import pandas as pd
+
+from nctrl.utils import tprint
+
+
+class SpikeStore():
+    '''
+    Spikes of every unit of a spiketag model.pd in CSR layout.
+
+    spike_time[offsets[i]:offsets[i+1]] are the sorted frame_ids of unit i (spike_id i+1), spike_group[i] is the group of its first spike and
+    spike_fr[i] its mean firing rate. Built in one sort pass and cached next to
+    the source as <name>_store.npz; the cache is rebuilt when model.pd changes.
+    '''
+    FIELDS = ('offsets', 'spike_time', 'spike_group', 'spike_fr', 'start_frame', 'end_frame')
+
+    def __init__(self, spike_file='./spktag/model.pd', fs=25000, cache=True):
+        self.spike_file = spike_file
+        self.fs = fs
+        self.cache_file = os.path.splitext(spike_file)[0] + '_store.npz'
+
+        stat = os.stat(spike_file)
+        self._source = np.array([stat.st_mtime_ns, stat.st_size])
+        if not (cache and self._load_cache()):
+            self.build()
+            if cache:
+                self.save()
+
+    def _load_cache(self):
+        if not os.path.isfile(self.cache_file):
+            return False
+        with np.load(self.cache_file) as f:
+            if not np.array_equal(f['source'], self._source):
+                return False
+            for field in self.FIELDS:
+                setattr(self, field, f[field])
+        tprint(f'nctrl.store.SpikeStore: loaded {self.cache_file}')
+        return True
+
+    def build(self):
+        df = pd.read_pickle(self.spike_file)
+        frame_id = df['frame_id'].to_numpy().astype(np.int64)
+        spike_id = df['spike_id'].to_numpy().astype(np.int64)
+        group_id = df['group_id'].to_numpy().astype(np.int64)
+
+        self.start_frame = frame_id[0]
+        self.end_frame = frame_id[-1]
+
+        in_unit = spike_id > 0
+        unit = spike_id[in_unit] - 1
+        order = np.lexsort((frame_id[in_unit], unit)) # by unit, then time
+        count = np.bincount(unit, minlength=int(spike_id.max()))
+
+        self.offsets = np.r_[0, np.cumsum(count)]
+        self.spike_time = frame_id[in_unit][order]
+        self.spike_group = np.zeros(len(count), dtype=int)
+        self.spike_group[count > 0] = group_id[in_unit][order][self.offsets[:-1][count > 0]]
+        self.spike_fr = count / self.duration
+        tprint(f'nctrl.store.SpikeStore: indexed {len(self.spike_time)} spikes of {self.n_unit} units')
+
+    def save(self):
+        try:
+            np.savez(self.cache_file, source=self._source, **{field: getattr(self, field) for field in self.FIELDS})
+        except OSError as e:
+            tprint(f'nctrl.store.SpikeStore: could not write cache {self.cache_file} ({e})')
+
+    @property
+    def n_unit(self):
+        return len(self.offsets) - 1
+
+    @property
+    def duration(self):
+        return (self.end_frame - self.start_frame) / self.fs
+
+    @property
+    def count(self):
+        return np.diff(self.offsets)
+
+    def unit(self, i_unit):
+        # frame_ids of unit i_unit (0-based), a view into spike_time
+        return self.spike_time[self.offsets[i_unit]:self.offsets[i_unit + 1]]
+
+    def unit_ids(self):
+        # 0-based unit of every entry of spike_time
+        return np.repeat(np.arange(self.n_unit), self.count)
+
+    def time_sorted(self):
+        # (frame_id, unit) of all unit spikes in time order
+        unit = self.unit_ids()
+        order = np.argsort(self.spike_time, kind='stable')
+        return self.spike_time[order], unit[order]
+
+    def __repr__(self):
+        return f'SpikeStore({self.spike_file}, n_unit={self.n_unit}, n_spike={len(self.spike_time)})'
+
+
+class WaveformStore():
+    '''
+    Memory-mapped spike waveforms of spk_wav.bin.
+
+    The file is a sequence of int32 records of shape (n_samples, n_ch); row 0
+    holds the header (column 1: peak channel, 2: frame_id, 3: electrode group)
+    and rows 1: the waveform. The record count comes from the file size, only
+    the header columns are read (in chunks) to build the per-group index, and
+    waveforms are read from disk when indexed.
+    '''
+    def __init__(self, spkwav_file='./spk_wav.bin', n_samples=20, n_ch=4, chunk=1 << 16):
+        self.spkwav_file = spkwav_file
+        self.chunk = chunk
+        record_size = n_samples * n_ch * np.dtype(np.int32).itemsize
+        n_records = os.path.getsize(spkwav_file) // record_size
+        if n_records:
+            self._spk = np.memmap(spkwav_file, dtype=np.int32, mode='r', shape=(n_records, n_samples, n_ch))
+        else:
+            self._spk = np.zeros((0, n_samples, n_ch), dtype=np.int32) # an empty file cannot be mapped
+
+        header = np.empty((n_records, 3), dtype=np.int32)
+        for start in range(0, n_records, chunk):
+            header[start:start + chunk] = self._spk[start:start + chunk, 0, 1:]
+        self.peak_ch, self.spk_time, self.electrode_group = header.T
+
+        # records of electrode group g: group_order[group_offsets[g]:group_offsets[g+1]]
+        self.group_order = np.argsort(self.electrode_group, kind='stable')
+        self.group_offsets = np.r_[0, np.cumsum(np.bincount(self.electrode_group))]
+        self._time_sorted = bool(np.all(np.diff(self.spk_time) >= 0))
+        self.unit_record = None
+        tprint(f'nctrl.store.WaveformStore: indexed {n_records} waveforms of {len(self.group_offsets) - 1} groups')
+
+    def __len__(self):
+        return len(self._spk)
+
+    @property
+    def wav(self):
+        # (n_records, n_samples - 1, n_ch) view, nothing is read until indexed
+        return self._spk[:, 1:, :]
+
+    def group(self, electrode_group):
+        return self.group_order[self.group_offsets[electrode_group]:self.group_offsets[electrode_group + 1]]
+
+    def index_units(self, store):
+        '''
+        Match the spikes of a SpikeStore to records by (frame_id, electrode group);
+        unit_record[store.offsets[i]:store.offsets[i+1]] are the records of unit i (-1: not found)
+        '''
+        self._unit_offsets = store.offsets
+        if len(self) == 0 or len(store.spike_time) == 0:
+            self.unit_record = np.full(len(store.spike_time), -1)
+            return self.unit_record
+        n_group = max(int(self.electrode_group.max()), int(store.spike_group.max())) + 1
+        wav_key = self.spk_time.astype(np.int64) * n_group + self.electrode_group
+        wav_order = np.argsort(wav_key, kind='stable')
+        wav_key = wav_key[wav_order]
+
+        key = store.spike_time * n_group + np.repeat(store.spike_group, store.count)
+        pos = np.minimum(np.searchsorted(wav_key, key), len(wav_key) - 1)
+        self.unit_record = np.where(wav_key[pos] == key, wav_order[pos], -1)
+        return self.unit_record
+
+    def unit(self, i_unit):
+        # record indices of unit i_unit (0-based); needs index_units first
+        records = self.unit_record[self._unit_offsets[i_unit]:self._unit_offsets[i_unit + 1]]
+        return records[records >= 0]
+
+    def time_range(self, t0, t1):
+        # record indices with t0 <= frame_id < t1
+        if self._time_sorted:
+            return np.arange(*np.searchsorted(self.spk_time, [t0, t1]))
+        return np.flatnonzero((self.spk_time >= t0) & (self.spk_time < t1))
+
+    def waveforms(self, records):
+        # copies only the requested records
+        if isinstance(records, slice):
+            return self.wav[records]
+        return self.wav[np.sort(records)]
+
+    def template(self, records=None):
+        '''
+        Mean and std waveform of `records` (default: all), accumulated in float64
+        chunks so memory stays bounded by the chunk size
+        '''
+        if records is None:
+            records = np.arange(len(self))
+        records = np.sort(records)
+        total = np.zeros(self.wav.shape[1:])
+        total_sq = np.zeros(self.wav.shape[1:])
+        for start in range(0, len(records), self.chunk):
+            wav = self.wav[records[start:start + self.chunk]].astype(np.float64)
+            total += wav.sum(axis=0)
+            total_sq += np.square(wav).sum(axis=0)
+        n = max(len(records), 1)
+        mean = total / n
+        return mean, np.sqrt(np.maximum(total_sq / n - mean ** 2, 0))
+
+
+class CountPyramid():
+    '''
+    Spike counts of every unit of a SpikeStore binned at any multiple of a frame.
+
+    The frame-level base is the store itself (sparse, sorted frame_ids). levels
+    are the bin sizes (s) served from dense (n_unit, n_bin) uint16 count arrays;
+    the default covers the decoder bins of the GUI and Unit.sweep (10, 25, 250,
+    2500 and 25000 frames). A level is built on first use, as the block sum of a
+    finer level already built or else from the base, and memmapped from
+    <name>_pyramid_<frames>.npy next to the source; it takes n_unit * span / frames
+    * 2 bytes. Bins start at store.start_frame. counts() sums blocks of the
+    coarsest level dividing the bin; any other bin (e.g. one frame) comes from
+    one searchsorted over the base. window() adds the sliding sum of B bins via
+    a cumsum.
+    '''
+    LEVELS = (0.0004, 0.001, 0.01, 0.1, 1.0)
+
+    def __init__(self, store, levels=LEVELS, cache=True):
+        self.store = store
+        self.span = int(store.end_frame - store.start_frame)
+        self.cache = cache
+        self.blocks = sorted({max(int(round(bin_size * store.fs)), 1) for bin_size in levels})
+        self.levels = {}
+        self._key = None
+        self._base = os.path.splitext(store.spike_file)[0]
+
+    def level(self, block):
+        # dense counts of `block`-frame bins, built or loaded on first use
+        counts = self.levels.get(block)
+        if counts is None:
+            shape = (self.store.n_unit, self.span // block + 1)
+            filename = f'{self._base}_pyramid_{block}.npy'
+            counts = self._load(filename, shape) if self.cache else None
+            if counts is None:
+                counts = self._build(block, shape)
+                if self.cache:
+                    counts = self._save(filename, counts)
+            self.levels[block] = counts
+        return counts
+
+    def _load(self, filename, shape):
+        if not os.path.isfile(filename) or os.stat(filename).st_mtime_ns < self.store._source[0]:
+            return None
+        counts = np.load(filename, mmap_mode='r')
+        return counts if counts.shape == shape else None
+
+    def _save(self, filename, counts):
+        try:
+            np.save(filename, counts)
+            return np.load(filename, mmap_mode='r')
+        except OSError as e:
+            tprint(f'nctrl.store.CountPyramid: could not write cache {filename} ({e})')
+            return counts
+
+    def _build(self, block, shape):
+        finer = [b for b in self.levels if block % b == 0]
+        counts = np.zeros(shape, dtype=np.uint16)
+        if finer:
+            # block sum of the next finer level
+            lower = self.levels[max(finer)]
+            f = block // max(finer)
+            n = min(lower.shape[1], shape[1] * f)
+            padded = np.zeros((shape[0], shape[1] * f), dtype=np.uint32)
+            padded[:, :n] = lower[:, :n]
+            counts[:] = padded.reshape(shape[0], shape[1], f).sum(axis=2)
+        else:
+            for i_unit in range(shape[0]):
+                rel = self.store.unit(i_unit) - self.store.start_frame
+                counts[i_unit] = np.bincount(rel // block, minlength=shape[1])[:shape[1]]
+        return counts
+
+    def n_bin(self, bin_frames):
+        return self.span // bin_frames + 1
+
+    def counts(self, bin_size, units=None, start=0, stop=None):
+        '''
+        (n_units, stop - start) counts in bins [start, stop) of bin_size seconds;
+        units are 0-based (default: all)
+        '''
+        bin_frames = max(int(round(bin_size * self.store.fs)), 1)
+        stop = self.n_bin(bin_frames) if stop is None else stop
+        units = np.arange(self.store.n_unit) if units is None else np.atleast_1d(units)
+
+        dividing = [b for b in self.blocks if bin_frames % b == 0]
+        if dividing:
+            block = max(dividing)
+            f = bin_frames // block
+            level = self.level(block)
+            lo, hi = start * f, min(stop * f, level.shape[1])
+            out = np.zeros((len(units), (stop - start) * f), dtype=np.int32)
+            out[:, :max(hi - lo, 0)] = level[units, lo:hi]
+            return out.reshape(len(units), stop - start, f).sum(axis=2)
+
+        # sparse base: one searchsorted of every bin edge over (unit, frame) keys
+        stride = self.span + 1
+        if self._key is None:
+            rel = np.clip(self.store.spike_time - self.store.start_frame, 0, self.span)
+            self._key = self.store.unit_ids().astype(np.int64) * stride + rel
+        edges = np.minimum(np.arange(start, stop + 1, dtype=np.int64) * bin_frames, stride)
+        cum = np.searchsorted(self._key, units[:, None].astype(np.int64) * stride + edges)
+        return np.diff(cum, axis=1).astype(np.int32)
+
+    def window(self, bin_size, B, units=None, start=0, stop=None, mode='causal'):
+        '''
+        Sum of B bins around every bin: 'causal' the last B bins (what the
+        decoder sees), 'same' centred like np.convolve(counts, np.ones(B), 'same')
+        '''
+        counts = self.counts(bin_size, units, start, stop)
+        n = counts.shape[1]
+        cum = np.zeros((counts.shape[0], n + 1), dtype=np.int64)
+        np.cumsum(counts, axis=1, out=cum[:, 1:])
+        idx = np.arange(n)
+        if mode == 'causal':
+            hi, lo = idx + 1, np.maximum(idx + 1 - B, 0)
+        elif mode == 'same':
+            hi, lo = np.minimum(idx + (B - 1) // 2 + 1, n), np.maximum(idx - B // 2, 0)
+        else:
+            raise ValueError(f'nctrl.store.CountPyramid.window: unknown mode {mode}')
+        return cum[:, hi] - cum[:, lo]
+
+    def time(self, bin_size, start=0, stop=None):
+        # centre (s) of bins [start, stop)
+        bin_frames = max(int(round(bin_size * self.store.fs)), 1)
+        stop = self.n_bin(bin_frames) if stop is None else stop
+        return (self.store.start_frame + (np.arange(start, stop) + 0.5) * bin_frames) / self.store.fs
+
+    def __repr__(self):
+        return f'CountPyramid(n_unit={self.store.n_unit}, levels={self.blocks}, built={sorted(self.levels)})'
@@ -0,0 +1,218 @@
+import os
+import numpy as np
+from collections import namedtuple
+
+from nctrl.tail import TailReader
+
+
+# bit of each named line in the NIDQ digital word (the notebook's format(x, '07b')
+# columns ['LASER', '_', 'SYNC', '_', '_', '_', 'Sync'], most significant bit first)
+NIDQ_LINES = {'LASER': 6, 'SYNC': 4}
+NIDQ_FS = 62500.163636
+
+Edges = namedtuple('Edges', ['rising', 'falling'])
+
+
+def read_meta(filename):
+    # SpikeGLX <name>.nidq.meta next to <name>.nidq.bin, as a dict of strings
+    meta_file = os.path.splitext(filename)[0] + '.meta'
+    meta = {}
+    if os.path.isfile(meta_file):
+        with open(meta_file) as f:
+            for line in f:
+                key, _, value = line.strip().partition('=')
+                meta[key.lstrip('~')] = value
+    return meta
+
+
+class EdgeDecoder():
+    '''
+    Streaming edge detector for bit lines of a digital word.
+
+    feed() takes consecutive chunks of digital words and returns the sample
+    indices of rising and falling edges of every line; the last level of each
+    line is carried over, so edges across chunk boundaries are not lost.
+    '''
+    def __init__(self, lines=NIDQ_LINES):
+        self.lines = dict(lines)
+        self.n_samples = 0
+        self._level = {name: None for name in self.lines}
+
+    def feed(self, words):
+        words = np.asarray(words)
+        edges = {}
+        for name, bit in self.lines.items():
+            level = ((words >> bit) & 1).astype(np.int8)
+            if self._level[name] is None:
+                first = level[:1] # no edge at the very first sample
+            else:
+                first = np.array([self._level[name]], dtype=np.int8)
+            d = np.diff(level, prepend=first)
+            edges[name] = Edges(np.flatnonzero(d > 0) + self.n_samples, np.flatnonzero(d < 0) + self.n_samples)
+            if len(level):
+                self._level[name] = level[-1]
+        self.n_samples += len(words)
+        return edges
+
+
+def filter_pulses(edges, min_width):
+    '''
+    Drop pulses shorter than min_width samples (both of their edges), e.g. the
+    sub-1 ms LASER glitches. A falling edge before the first rising edge and a
+    trailing rising edge without its falling edge are kept as they are.
+    '''
+    rising, falling = edges
+    lead = falling[:1] if len(falling) and (not len(rising) or falling[0] < rising[0]) else falling[:0]
+    falling = falling[len(lead):]
+    n = min(len(rising), len(falling))
+    keep = (falling[:n] - rising[:n]) >= min_width
+    return Edges(np.r_[rising[:n][keep], rising[n:]].astype(np.int64),
+                 np.r_[lead, falling[:n][keep]].astype(np.int64))
+
+
+def nidq_edges(filename, lines=NIDQ_LINES, n_ch=None, digital_ch=None, chunk=1 << 22, min_width=None):
+    '''
+    Rising/falling sample indices of the named digital lines of a .nidq.bin.
+
+    The file is memory-mapped and decoded in chunks of `chunk` samples, so
+    memory stays constant regardless of recording length. n_ch defaults to
+    nSavedChans of the .meta file (else 9) and digital_ch to the last channel.
+    min_width (in samples, or {line: samples}) drops shorter pulses.
+    '''
+    meta = read_meta(filename)
+    if n_ch is None:
+        n_ch = int(meta.get('nSavedChans', 9))
+    if digital_ch is None:
+        digital_ch = n_ch - 1
+
+    reader = TailReader(filename, dtype=np.int16, shape=(n_ch,))
+    decoder = EdgeDecoder(lines)
+    found = {name: ([], []) for name in lines}
+    while True:
+        samples = reader.read(max_records=chunk)
+        if len(samples) == 0:
+            break
+        # reinterpret as unsigned so bit 15 does not sign-extend
+        for name, (rising, falling) in decoder.feed(samples[:, digital_ch].view(np.uint16)).items():
+            found[name][0].append(rising)
+            found[name][1].append(falling)
+
+    edges = {name: Edges(np.concatenate(r) if r else np.zeros(0, dtype=np.int64),
+                         np.concatenate(f) if f else np.zeros(0, dtype=np.int64))
+             for name, (r, f) in found.items()}
+    if min_width is not None:
+        for name in edges:
+            width = min_width.get(name) if isinstance(min_width, dict) else min_width
+            if width:
+                edges[name] = filter_pulses(edges[name], width)
+    return edges
+
+
+def sample_rate(filename):
+    return float(read_meta(filename).get('niSampRate', NIDQ_FS))
+
+
+def match_sync(src, dst, tol=0.005):
+    '''
+    Pair the SYNC edges of two clocks (both in seconds) by their inter-pulse
+    intervals, so missing or extra pulses at either end do not need manual
+    slicing. Returns the matched (src, dst) times.
+    '''
+    src, dst = np.asarray(src, dtype=float), np.asarray(dst, dtype=float)
+    d_src, d_dst = np.diff(src), np.diff(dst)
+    if len(d_src) == 0 or len(d_dst) == 0:
+        raise ValueError('nctrl.sync.match_sync: need at least two edges on each clock')
+
+    # score every lag of the interval sequences by the number of matching intervals
+    best_lag, best_score = 0, -1
+    for lag in range(-len(d_dst) + 1, len(d_src)):
+        i0, j0 = max(lag, 0), max(-lag, 0)
+        n = min(len(d_src) - i0, len(d_dst) - j0)
+        score = np.count_nonzero(np.abs(d_src[i0:i0 + n] - d_dst[j0:j0 + n]) < tol)
+        if score > best_score:
+            best_lag, best_score = lag, score
+
+    i0, j0 = max(best_lag, 0), max(-best_lag, 0)
+    n = min(len(d_src) - i0, len(d_dst) - j0)
+    ok = np.abs(d_src[i0:i0 + n] - d_dst[j0:j0 + n]) < tol
+    # an edge is kept when an interval on either side of it matched
+    edge_ok = np.r_[ok, False] | np.r_[False, ok]
+    if edge_ok.sum() < 2:
+        raise ValueError('nctrl.sync.match_sync: no consistent SYNC pattern found between the clocks')
+    return src[i0:i0 + n + 1][edge_ok], dst[j0:j0 + n + 1][edge_ok]
+
+
+class ClockMap():
+    '''
+    Piecewise-linear drift model from one clock to another, with a breakpoint
+    at every matched SYNC edge; outside the SYNC span it extrapolates with the
+    mean rate, which is far less noisy than the slope of one end segment.
+    Calling it converts any array of times with one searchsorted.
+    '''
+    def __init__(self, src, dst):
+        order = np.argsort(src)
+        self.src = np.asarray(src, dtype=float)[order]
+        self.dst = np.asarray(dst, dtype=float)[order]
+        self.slope = np.diff(self.dst) / np.diff(self.src)
+        # slope of segment k at k + 1, the mean rate before and after the span
+        self._slope = np.r_[self.rate, self.slope, self.rate]
+
+    @classmethod
+    def from_sync(cls, src, dst, tol=0.005):
+        return cls(*match_sync(src, dst, tol=tol))
+
+    def __call__(self, t):
+        t = np.asarray(t, dtype=float)
+        seg = np.searchsorted(self.src, t, 'right') - 1
+        anchor = np.clip(seg, 0, len(self.src) - 1)
+        return self.dst[anchor] + (t - self.src[anchor]) * self._slope[seg + 1]
+
+    def inverse(self):
+        return ClockMap(self.dst, self.src)
+
+    @property
+    def rate(self):
+        # mean dst units per src unit over the matched span
+        return (self.dst[-1] - self.dst[0]) / (self.src[-1] - self.src[0])
+
+    @property
+    def drift(self):
+        # relative rate deviation of each segment from the mean rate
+        return self.slope / self.rate - 1
+
+    def __repr__(self):
+        return (f'ClockMap(n_sync={len(self.src)}, rate={self.rate:.9f}, '
+                f'max_drift={np.abs(self.drift).max() * 1e6:.1f} ppm)')
+
+
+def to_intervals(edges, clock=None):
+    '''
+    Pulses of an Edges pair as an (n, 2) array of [start, end), optionally mapped
+    through `clock` (e.g. NIDQ seconds -> FPGA seconds); a sparse annotation
+    instead of a dense per-sample column
+    '''
+    rising, falling = edges
+    falling = falling[np.searchsorted(falling, rising[0], 'right'):] if len(rising) else falling[:0]
+    n = min(len(rising), len(falling))
+    intervals = np.column_stack((rising[:n], falling[:n])).astype(float)
+    return clock(intervals) if clock is not None else intervals
+
+
+def in_intervals(intervals, t):
+    # True where t falls inside one of the sorted, non-overlapping [start, end) intervals
+    t = np.asarray(t)
+    i = np.searchsorted(intervals[:, 0], t, 'right') - 1
+    return (i >= 0) & (t < intervals[np.maximum(i, 0), 1])
+
+
+def align_nidq(filename, fpga_sync, fs=25000, tol=0.005, edges=None):
+    '''
+    ClockMap from NIDQ samples of `filename` to FPGA frames, given the frame_ids
+    of the SYNC pulses sent by the FPGA. Laser pulses in mua frames are then
+    to_intervals(edges['LASER'], clock).
+    '''
+    if edges is None:
+        edges = nidq_edges(filename, lines={'SYNC': NIDQ_LINES['SYNC']})
+    fs_nidq = sample_rate(filename)
+    src, dst = match_sync(edges['SYNC'].rising / fs_nidq, np.asarray(fpga_sync) / fs, tol=tol)
+    return ClockMap(src * fs_nidq, dst * fs)
@@ -0,0 +1,70 @@
+import os
+import time
+import numpy as np
+
+from nctrl.utils import tprint
+
+
+# record layouts of the files written during a session
+FORMATS = {
+    'fet.bin': (np.int32, (8,)),        # frame_id, group_id, fet0-3, spike_id, energy
+    'spk.bin': (np.int32, (2,)),
+    'mua.bin': (np.int32, (160,)),
+    'spk_wav.bin': (np.int32, (20, 4)),
+}
+
+
+class TailReader():
+    '''
+    Incremental reader of a growing file of fixed-size records.
+
+    read() maps only the bytes appended since the previous call and returns the
+    complete new records as a read-only memmap (no copy); a partially written
+    trailing record is left for the next call. If the file shrinks (a new
+    session overwrote it) reading restarts from the beginning.
+    '''
+    def __init__(self, filename, dtype=None, shape=None, from_start=True):
+        if dtype is None or shape is None:
+            dtype, shape = FORMATS[os.path.basename(filename)]
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.record_size = self.dtype.itemsize * int(np.prod(self.shape))
+        self.offset = 0
+        self.n_records = 0
+        if not from_start and os.path.isfile(filename):
+            self.offset = os.path.getsize(filename) // self.record_size * self.record_size
+            self.n_records = self.offset // self.record_size
+
+    def read(self, max_records=None):
+        try:
+            size = os.path.getsize(self.filename)
+        except FileNotFoundError:
+            return np.zeros((0,) + self.shape, dtype=self.dtype)
+        if size < self.offset:
+            tprint(f'nctrl.tail.TailReader: {self.filename} was truncated, reading from the start')
+            self.offset = 0
+            self.n_records = 0
+
+        n = (size - self.offset) // self.record_size
+        if max_records is not None:
+            n = min(n, max_records)
+        if n == 0:
+            return np.zeros((0,) + self.shape, dtype=self.dtype)
+
+        records = np.memmap(self.filename, dtype=self.dtype, mode='r', offset=self.offset, shape=(n,) + self.shape)
+        self.offset += n * self.record_size
+        self.n_records += n
+        return records
+
+    def follow(self, poll_interval=0.05, max_records=None):
+        # yields each batch of new records as the file grows; stop by closing the generator
+        while True:
+            records = self.read(max_records)
+            if len(records):
+                yield records
+            else:
+                time.sleep(poll_interval)
+
+    def __repr__(self):
+        return f'TailReader({self.filename}, records={self.n_records}, offset={self.offset})'
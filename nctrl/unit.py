@@ -1,10 +1,8 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
-from ipywidgets import interact, SelectionSlider, IntSlider, FloatSlider
 
-from spiketag.core import CCG
+from nctrl.ccg import Correlograms
+from nctrl.store import SpikeStore, WaveformStore, CountPyramid
 
 class Unit():
     def __init__(self):
@@ -13,37 +11,145 @@ class Unit():
 
     def load(self, spike_file='./spktag/model.pd'):
         self.spike_file = spike_file
-        df = pd.read_pickle(self.spike_file)
+        self.store = SpikeStore(self.spike_file)
 
-        self.start_time = df['frame_id'].iloc[0] / 25000
-        self.end_time = df['frame_id'].iloc[-1] / 25000
+        self.start_time = self.store.start_frame / 25000
+        self.end_time = self.store.end_frame / 25000
         self.duration = self.end_time - self.start_time
 
-        n_unit = int(df['spike_id'].max())
+        n_unit = self.store.n_unit
         self.n_unit = n_unit
 
-        in_unit = df['spike_id'] > 0
-        self.spk_time = df['frame_id'][in_unit].to_numpy().astype(int)
-        self.spk_id = df['spike_id'][in_unit].to_numpy().astype(int) - 1
-        self.ccg = CCG(self.spk_time, self.spk_id)
+        self.spk_time, self.spk_id = self.store.time_sorted()
+        self.ccg = Correlograms(self.store) # computed on first access
 
         self.spike_time = np.zeros(n_unit, dtype=object)
-        self.spike_fr = np.zeros(n_unit)
-        self.spike_group = np.zeros(n_unit, dtype=int)
-
         for i_unit in range(n_unit):
-            in_unit = df['spike_id'] == (i_unit + 1)
-            if np.any(in_unit):
-                self.spike_group[i_unit] = df['group_id'][np.argwhere(in_unit.to_numpy())[0, 0]]
-                self.spike_time[i_unit] = df['frame_id'][in_unit].to_numpy() / 25000
-                self.spike_fr[i_unit] = np.sum(in_unit) / self.duration
+            self.spike_time[i_unit] = self.store.unit(i_unit) / 25000
+        self.spike_fr = self.store.spike_fr
+        self.spike_group = self.store.spike_group
+        self.counts = CountPyramid(self.store)
     
+    def sweep(self, bin_sizes=(0.00004, 0.0004, 0.001, 0.01, 0.1), Bs=range(1, 101), nspikes=range(1, 101), unit_ids=None,
+              onset_time=True):
+        '''
+        Predicted laser onsets of FrThreshold for every unit over a grid of bin_size x B x nspike.
+
+        The window count is the causal sum of the last B bins (what the online decoder sees) and an
+        onset is a bin where it rises from below nspike to >= nspike. Each resolution is binned once
+        into a lag histogram of the bins holding a spike (spikes 0..max(Bs) bins back), whose cumulative
+        sum is the window count before and at that bin for every B at once; a rise from prev to cur
+        is an onset for every nspike in (prev, cur], counted for all nspikes with one bincount.
+
+        Returns a tidy DataFrame with one row per (unit_id, bin_size, B, nspike) and columns
+        laser_fr (Hz), n_onset and onset_time (s, end of the onset bin; onset_time=False leaves it
+        out, which is much faster for large grids). unit_id and nspike are the keyword arguments of
+        NCtrl.set_decoder(decoder='fr', ...); bin_size and B go to set_binner.
+        '''
+        unit_ids = np.arange(1, self.n_unit + 1) if unit_ids is None else np.atleast_1d(unit_ids)
+        Bs = np.atleast_1d(np.asarray(Bs, dtype=int))
+        nspikes = np.atleast_1d(np.asarray(nspikes, dtype=int))
+        n_B, n_nspike = len(Bs), len(nspikes)
+        B_max, n_max = Bs.max(), nspikes.max()
+
+        # map a window count to its position in nspikes (-1: not on the grid)
+        nspike_idx = np.full(n_max + 1, -1)
+        nspike_idx[nspikes] = np.arange(n_nspike)
+
+        # each unit is a contiguous, time-sorted slice of the store
+        spk_time, offsets = self.store.spike_time, self.store.offsets
+
+        columns = {'unit_id': [], 'bin_size': [], 'B': [], 'nspike': [], 'n_onset': []}
+        onset_times = []
+        for unit_id in unit_ids:
+            frames = spk_time[offsets[unit_id - 1]:offsets[unit_id]]
+            for bin_size in bin_sizes:
+                bin_frames = int(round(bin_size * 25000))
+                u_bin, c = np.unique(frames // bin_frames, return_counts=True)
+                columns['unit_id'].append(np.full(n_B * n_nspike, unit_id))
+                columns['bin_size'].append(np.full(n_B * n_nspike, bin_size))
+                columns['B'].append(np.repeat(Bs, n_nspike))
+                columns['nspike'].append(np.tile(nspikes, n_B))
+                if len(u_bin) == 0:
+                    # a unit without spikes never fires, whatever B and nspike
+                    columns['n_onset'].append(np.zeros(n_B * n_nspike, dtype=int))
+                    if onset_time:
+                        onset_times += [np.zeros(0)] * (n_B * n_nspike)
+                    continue
+
+                # spike bins with no other spike within B_max bins before them count c for every B
+                busy = np.r_[False, np.diff(u_bin) <= B_max]
+                row = np.cumsum(busy) - 1
+
+                # H[r, d]: spikes in bin u_bin[i] - d of busy bin i = row r; the m-th previous spike
+                # bin is at most B_max back
+                H = np.zeros((busy.sum(), B_max + 1), dtype=np.int32)
+                H[:, 0] = c[busy]
+                for m in range(1, min(B_max, len(u_bin) - 1) + 1):
+                    d = u_bin[m:] - u_bin[:-m]
+                    near = np.flatnonzero(d <= B_max)
+                    if not len(near):
+                        break
+                    H[row[near + m], d[near]] = c[near]
+                np.cumsum(H, axis=1, out=H)
+
+                # spikes in (k-B, k] and in (k-1-B, k-1] at every busy spike bin k, for every B; a bin
+                # that does not rise gets prev = cur and so adds no onset
+                hi = np.minimum(H[:, Bs - 1], n_max + 1)
+                lo = np.minimum(H[:, Bs] - c[busy, None], hi)
+
+                # onsets(n) = #(lo < n) - #(hi < n), for every nspike of every B at once
+                n_cell = n_max + 2
+                cell = np.arange(n_B) * n_cell
+                diff = (np.bincount((lo + cell).ravel(), minlength=n_B * n_cell)
+                        - np.bincount((hi + cell).ravel(), minlength=n_B * n_cell)).reshape(n_B, n_cell)
+                c_free = np.minimum(c[~busy], n_max + 1)
+                diff[:, 0] += len(c_free)
+                diff -= np.bincount(c_free, minlength=n_cell)
+                n_onset = np.cumsum(diff, axis=1)[:, nspikes - 1].ravel()
+
+                columns['n_onset'].append(n_onset)
+
+                if onset_time:
+                    # every crossed count l+1..h of every rise, one B at a time
+                    idx_dtype = np.uint16 if n_nspike < 2**16 else int
+                    l, h = np.zeros(len(u_bin), dtype=np.int32), np.minimum(c, n_max).astype(np.int32)
+                    for lo_B, hi_B, n in zip(lo.T, np.minimum(hi, n_max).T, n_onset.reshape(n_B, n_nspike)):
+                        l[busy], h[busy] = lo_B, hi_B
+                        rise = np.flatnonzero(l < h)
+                        l_rise, n_step = l[rise], h[rise] - l[rise]
+                        start = np.cumsum(n_step) - n_step
+                        idx = nspike_idx[np.arange(n_step.sum()) - np.repeat(start - l_rise - 1, n_step)]
+                        on_grid = idx >= 0
+                        order = np.argsort(idx[on_grid].astype(idx_dtype), kind='stable') # radix sort, keeps time order
+                        t = (u_bin[np.repeat(rise, n_step)[on_grid][order]] + 1) * bin_size
+                        bounds = np.r_[0, np.cumsum(n)]
+                        onset_times += [t[bounds[i]:bounds[i + 1]] for i in range(n_nspike)]
+
+        df = pd.DataFrame({k: np.concatenate(v) for k, v in columns.items()})
+        df.insert(4, 'laser_fr', df['n_onset'] / self.duration)
+        if onset_time:
+            df['onset_time'] = onset_times
+        return df
+
     def load_spkwav(self, spkwav_file='./spk_wav.bin'):
         self.spkwav_file = spkwav_file
-        self._spk = np.fromfile(self.spkwav_file, dtype=np.int32).reshape(-1, 20, 4)
-        self.spk_peak_ch, self.spk_time, self.electrode_group = self._spk[..., 0, 1], self._spk[..., 0, 2], self._spk[..., 0, 3]
+        self.spkwav = WaveformStore(self.spkwav_file)
+        self.spk_peak_ch, self.spkwav_time, self.electrode_group = self.spkwav.peak_ch, self.spkwav.spk_time, self.spkwav.electrode_group
+        if hasattr(self, 'store'):
+            self.spkwav.index_units(self.store)
+
+    def waveforms(self, unit_id=1):
+        # waveforms (n_spike, n_samples, n_ch) of a unit, read from spk_wav.bin on demand
+        return self.spkwav.waveforms(self.spkwav.unit(unit_id - 1))
+
+    def template(self, unit_id=1):
+        return self.spkwav.template(self.spkwav.unit(unit_id - 1))
 
     def plot(self, bin_size=0.1, B=10):
+        import matplotlib.pyplot as plt
+        import matplotlib.gridspec as gridspec
+
         self.bin_size = bin_size
         self.B = B
 
@@ -51,7 +157,10 @@ class Unit():
         gs = gridspec.GridSpec(self.n_unit, 1, wspace = 0.3, hspace=0.3)
         # col1: fr, col2: autocorrelogram, col3: temporal pattern
 
-        self.time_bin = np.arange(self.start_time, self.end_time, self.bin_size)
+        # binned counts and their centred B-bin sums of every unit in one go
+        time_bin_midpoints = self.counts.time(self.bin_size)
+        spike_convs = self.counts.window(self.bin_size, self.B, mode='same')
+        autocorr = self.ccg.compute() # every autocorrelogram in one parallel pass
 
         for i_unit in range(self.n_unit):
             gs_unit = gridspec.GridSpecFromSubplotSpec(2, 2, subplot_spec=gs[i_unit], wspace=0.1, hspace=0.1, height_ratios=[1, 1])
@@ -60,8 +169,7 @@ class Unit():
             ax3 = f.add_subplot(gs_unit[1, :])
 
             # firing rate plot
-            spike_hist = np.histogram(self.spike_time[i_unit], self.time_bin)[0]
-            spike_conv = np.convolve(spike_hist, np.ones(self.B), 'same')
+            spike_conv = spike_convs[i_unit]
             ax1.hist(spike_conv, bins=np.arange(max(spike_conv)+1), color='black')
             ax1.set_xlim(0, max(spike_conv))
 
@@ -75,15 +183,14 @@ class Unit():
             ax1.set_title(f'Unit {i_unit + 1} ({self.spike_fr[i_unit]:.2f} Hz)')
 
             # autocorrelogram
-            ax2.bar(np.arange(-25, 25), self.ccg[i_unit, i_unit], color='black', width=1)
+            ax2.bar(self.ccg.lags(), autocorr[i_unit], color='black', width=1)
             ax2.set_xlim(-25, 25)
             if i_unit == 0:
                 ax2.set_title('autocorrelogram')
 
             # temporal pattern
-            time_bin_midpoints = (self.time_bin[:-1] + self.time_bin[1:]) / 2
             ax3.plot(time_bin_midpoints, spike_conv, color='black')
-            ax3.set_xlim(self.time_bin[0], self.time_bin[-1])
+            ax3.set_xlim(time_bin_midpoints[0], time_bin_midpoints[-1])
 
             print(f'Unit {i_unit + 1}: Mean={mean_spike_conv:.2f}Hz, Median={median_spike_conv:.2f}Hz, 80th={percentile_80:.2f}Hz, 90th={percentile_90:.2f}Hz')
 
@@ -91,14 +198,14 @@ class Unit():
         plt.show()
 
     def simulate(self, unit_id=1):
+        import matplotlib.pyplot as plt
+        from ipywidgets import interact, SelectionSlider, IntSlider
+
         i_unit = unit_id - 1
 
         def update(bin_size, B, spike_count):
-            time_bin = np.arange(self.start_time, self.end_time, bin_size)
-            spike_hist = np.histogram(self.spike_time[i_unit], time_bin)[0]
-            spike_conv = np.convolve(spike_hist, np.ones(B), 'same')
-
-            t = (time_bin[1:] + time_bin[:-1]) / 2
+            spike_conv = self.counts.window(bin_size, B, [i_unit], mode='same')[0]
+            t = self.counts.time(bin_size)
 
             # find points starting threshold
             th_up_idx = np.where(np.diff((spike_conv >= spike_count).astype(int)) > 0)[0] + 1
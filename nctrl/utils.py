@@ -1,5 +1,44 @@
+import os
+import time
+import atexit
 import datetime
+import threading
+from queue import SimpleQueue
+
+
+# tprint only enqueues; a background thread formats and prints, so calls from
+# the decode callback never block on stdout
+_print_queue = SimpleQueue()
+
+
+def _print(t, text):
+    timestamp = datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    print(f'[{timestamp}] {text}', flush=True)
+
+
+def _print_worker():
+    while True:
+        t, text = _print_queue.get()
+        if text is None:
+            break
+        _print(t, text)
+
+
+_print_thread = threading.Thread(target=_print_worker, name='nctrl-tprint', daemon=True)
+_print_thread.start()
+_print_pid = os.getpid()
+
+
+@atexit.register
+def _flush_print_queue():
+    _print_queue.put((0, None))
+    _print_thread.join(timeout=1)
+
 
 def tprint(text):
-    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-    print(f'[{timestamp}] {text}')
\ No newline at end of file
+    # a forked child (spiketag's BMI process, process pools) inherits the queue
+    # but not the thread, and exits without atexit; it prints directly
+    if os.getpid() == _print_pid:
+        _print_queue.put((time.time(), text))
+    else:
+        _print(time.time(), text)
@@ -25,6 +25,32 @@
 #define safe_clear7_8bit(n)  (n & 0xfffcf3f0)// 1111 1111 1111 1100 1111 0011 1111 0000 in binary/home/nclab/Dropbox/src/project-bmi/nctrl-bmi/teensy/teensy.ino
 #define safe_clear9_4bit(n)  (n & 0xfffffe8f)// 1111 1111 1111 1111 1111 1110 1000 1111 in binary 
 
+// binary command frames, keep in sync with nctrl/protocol.py
+// [magic 0xA5][version][cmd][seq uint16][arg uint32][checksum], little endian
+#define FRAME_MAGIC     0xA5
+#define FRAME_VERSION   1
+#define FRAME_LEN       10
+
+#define CMD_LASER_START  0x01
+#define CMD_LASER_ABORT  0x02
+#define CMD_ENABLE       0x03
+#define CMD_DISABLE      0x04
+#define CMD_CONST_ON     0x05
+#define CMD_CONST_OFF    0x06
+#define CMD_SET_DURATION 0x07
+#define CMD_SPIKES       0x08
+#define CMD_PING         0x09
+#define CMD_ACK          0x7E
+#define CMD_NAK          0x7F
+#define CMD_ACK_REQ      0x80
+
+#define ERR_VERSION      1
+#define ERR_CHECKSUM     2
+#define ERR_COMMAND      3
+
+uint8_t frame[FRAME_LEN];
+uint8_t frameLen = 0;
+
 // laser timer
 const unsigned long LASER_DURATION = 5000; // 5 ms
 const unsigned long INTERVAL_DURATION = 20000; // 20 ms
@@ -70,43 +96,76 @@ void loop() {
 }
 
 void checkSerial() {
-    if (Serial.available() > 0) {
-        char cmd = Serial.read();
-        handleCommand(cmd);
+    while (Serial.available() > 0) {
+        uint8_t b = Serial.read();
+        if (frameLen == 0 && b != FRAME_MAGIC) continue; // resync on magic
+        frame[frameLen++] = b;
+        if (frameLen == FRAME_LEN) {
+            frameLen = 0;
+            handleFrame();
+        }
     }
 }
 
-void handleCommand(char cmd) {
+void handleFrame() {
+    uint8_t checksum = 0;
+    for (int i = 0; i < FRAME_LEN - 1; i++) checksum += frame[i];
+    uint16_t seq = frame[3] | (frame[4] << 8);
+    if (checksum != frame[FRAME_LEN - 1]) {
+        sendFrame(CMD_NAK, seq, ERR_CHECKSUM);
+        return;
+    }
+    if (frame[1] != FRAME_VERSION) {
+        sendFrame(CMD_NAK, seq, ERR_VERSION);
+        return;
+    }
+    uint8_t cmd = frame[2] & ~CMD_ACK_REQ;
+    uint32_t arg = frame[5] | (frame[6] << 8) | ((uint32_t)frame[7] << 16) | ((uint32_t)frame[8] << 24);
+    uint32_t value = 0;
+
     switch (cmd) {
-        case 'a': // start laser
+        case CMD_LASER_START:
             startLaser();
             break;
-        case 'A': // abort laser
+        case CMD_LASER_ABORT:
             abortLaser();
             break;
-        case 'e': // enable laser
+        case CMD_ENABLE:
             enableOn();
-            Serial.println("Laser enabled");
             break;
-        case 'E': // disable laser
+        case CMD_DISABLE:
             enableOff();
-            Serial.println("Laser disabled");
             break;
-        case 'c': // constantly on
+        case CMD_CONST_ON: // constantly on
             laserOn();
-            Serial.println("Laser is on");
             break;
-        case 'C': // constantly off
+        case CMD_CONST_OFF: // constantly off
             laserOff();
-            Serial.println("Laser is off");
             break;
-        case 'd':
-            setLaserDuration();
+        case CMD_SET_DURATION:
+            finishDuration = arg * 1000; // ms -> us
+            value = arg;
+            break;
+        case CMD_SPIKES:
+            writeSpike(arg & 0xffff);
             break;
-        case 's':
-            readSpike();
+        case CMD_PING:
+            value = FRAME_VERSION;
             break;
+        default:
+            sendFrame(CMD_NAK, seq, ERR_COMMAND);
+            return;
     }
+    if (frame[2] & CMD_ACK_REQ) {
+        sendFrame(CMD_ACK, seq, ((uint32_t)cmd << 24) | (value & 0xffffff));
+    }
+}
+
+void sendFrame(uint8_t cmd, uint16_t seq, uint32_t arg) {
+    uint8_t out[FRAME_LEN] = {FRAME_MAGIC, FRAME_VERSION, cmd, (uint8_t)seq, (uint8_t)(seq >> 8),
+                              (uint8_t)arg, (uint8_t)(arg >> 8), (uint8_t)(arg >> 16), (uint8_t)(arg >> 24), 0};
+    for (int i = 0; i < FRAME_LEN - 1; i++) out[FRAME_LEN - 1] += out[i];
+    Serial.write(out, FRAME_LEN);
 }
 
 void startLaser() {
@@ -127,12 +186,6 @@ void abortLaser() {
     laserOff();
 }
 
-void setLaserDuration() {
-    int duration = Serial.parseInt(); // read in ms ## this can be very slow (~1s)!!!
-    finishDuration = duration * 1000; // write in us
-    Serial.println("Laser duration is set to " + String(duration));
-}
-
 void checkLaser() {
     switch (state) {
         case LASERON:
@@ -157,8 +210,7 @@ void checkLaser() {
     }
 }
 
-void readSpike() {
-    uint16_t data = Serial.read() | (Serial.read() << 8);
+void writeSpike(uint16_t data) {
     safe_write_16bit(data);
     spikeTimers = now;
     spikeStates = 1;
@@ -0,0 +1,23 @@
+import numpy as np
+
+from nctrl.ccg import correlogram
+
+
+def _brute(a, b, bin_frames, n_half, auto):
+    lag = (b[None, :] - a[:, None]).ravel()
+    lag = lag[(lag >= -n_half * bin_frames) & (lag < n_half * bin_frames)]
+    counts = np.bincount(lag // bin_frames + n_half, minlength=2 * n_half)
+    if auto:
+        counts[n_half] -= len(a)
+    return counts
+
+
+def test_correlogram_matches_brute_force():
+    rng = np.random.default_rng(0)
+    a = np.sort(rng.integers(0, 200000, 800))
+    b = np.sort(rng.integers(0, 200000, 600))
+    for bin_frames, n_half in [(25, 25), (10, 7), (1, 50)]:
+        np.testing.assert_array_equal(correlogram(a, b, bin_frames, n_half, chunk=100),
+                                      _brute(a, b, bin_frames, n_half, False))
+        np.testing.assert_array_equal(correlogram(a, a, bin_frames, n_half, auto=True, chunk=100),
+                                      _brute(a, a, bin_frames, n_half, True))
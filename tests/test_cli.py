@@ -0,0 +1,17 @@
+import pytest
+
+pytest.importorskip('spiketag')
+
+from nctrl.bench import generate
+from nctrl.cli import main
+from nctrl.output import load_records, EDGE_DTYPE
+
+
+@pytest.mark.parametrize('enable', [False, True])
+def test_replay_enable(tmp_path, enable):
+    generate(str(tmp_path), n_unit=4, duration=10, rate=10.0)
+    stim = str(tmp_path / 'stim.bin')
+    main(['run', '--replay', '--fet', str(tmp_path / 'fet.bin'), '--output', 'sim', '--port', stim,
+          '--bin-size', '0.01', '--B', '10', '--unit-id', '1', '--nspike', '2'] + ['--enable'] * enable)
+    # the laser pulses only when --enable turned the output on for the replay
+    assert (len(load_records(stim, EDGE_DTYPE)) > 0) == enable
@@ -0,0 +1,69 @@
+import pytest
+
+pytest.importorskip('spiketag')
+
+from nctrl.bench import generate
+from nctrl.core import NCtrl
+from nctrl import protocol
+from nctrl.output import load_records, COMMAND_DTYPE
+from nctrl.log import load_log
+from nctrl.report import log_triggers
+
+
+@pytest.fixture
+def nctrl(tmp_path):
+    generate(str(tmp_path), n_unit=4, duration=10, rate=10.0)
+    nctrl = NCtrl(fetfile=str(tmp_path / 'fet.bin'), output_type='null', replay=True)
+    yield nctrl
+    nctrl.close()
+
+
+def test_one_handler_per_binner(nctrl):
+    nctrl.bmi.set_binner(bin_size=0.01, B_bins=10)
+    for _ in range(3):
+        nctrl.set_decoder('fr', unit_id=1, nspike=2)
+        nctrl.set_decoder('rules', name='rules', rules=[dict(unit_ids=[1, 2], nspike=1)])
+    assert list(nctrl.router.routes) == ['main', 'rules']
+    stats = nctrl.replay()
+    # one on_decode (one latency row) per bin, however often set_decoder ran
+    assert stats['n_bins'] > 0
+    assert nctrl.latency.n == stats['n_bins']
+
+
+def test_set_trigger_needs_binner_and_output(nctrl):
+    nctrl.bmi.binner = None
+    with pytest.raises(ValueError):
+        nctrl.set_trigger(unit_ids=[1])
+    nctrl.bmi.set_binner(bin_size=0.01, B_bins=10)
+    with pytest.raises(ValueError):
+        nctrl.set_trigger(unit_ids=[1], output='aux')
+
+
+def test_trigger_follows_output_changes(nctrl, tmp_path):
+    nctrl.bmi.set_binner(bin_size=0.01, B_bins=10)
+    nctrl.set_decoder('fr', unit_id=1, nspike=100)
+    nctrl.set_output('file', str(tmp_path / 'aux.bin'), name='aux')
+    nctrl.set_trigger(unit_ids=[1, 2], output='aux')
+    nctrl.set_output('file', str(tmp_path / 'aux2.bin'), name='aux')
+    nctrl.replay()
+    nctrl.router.outputs['aux'].records.flush()
+    records = load_records(str(tmp_path / 'aux2.bin'), COMMAND_DTYPE)
+    assert (records['cmd'] == protocol.SPIKES).sum() > 0
+
+    nctrl.remove_output('aux')
+    assert nctrl.trigger is None
+    nctrl.replay() # no spike reaches the removed output
+
+
+def test_null_output_replay_logs_commands(nctrl, tmp_path):
+    filename = str(tmp_path / 'session.nclog')
+    nctrl.bmi.set_binner(bin_size=0.01, B_bins=10)
+    nctrl.set_decoder('fr', unit_id=1, nspike=2)
+    nctrl.set_log(filename)
+    stats = nctrl.replay()
+    nctrl.log.close()
+    # a dry run with the null output still logs what the decoder sent
+    meta, records = load_log(filename)
+    assert len(records) == stats['n_bins']
+    assert set(records['cmd']) == {protocol.LASER_START, protocol.LASER_ABORT}
+    assert len(log_triggers(filename)) > 0
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('spiketag')
+
+from nctrl.decoder import FrThreshold, AdaptiveThreshold, FrRules, Population
+
+
+def _bins(n_bins, n_col, seed=0, dtype=np.int64):
+    return np.random.default_rng(seed).poisson(0.5, (n_bins, n_col)).astype(dtype)
+
+
+def _stream(dec, counts, B):
+    # feed counts bin by bin through a binner-like (B, N) window
+    X = np.zeros((B, counts.shape[1]), dtype=counts.dtype)
+    y = []
+    for row in counts:
+        X[:-1] = X[1:]
+        X[-1] = row
+        y.append(dec.predict(X))
+    return np.array(y)
+
+
+def test_fr_rules_matches_fr_threshold():
+    counts, B = _bins(500, 6), 8
+    threshold = FrThreshold()
+    threshold.fit(unit_id=3, nspike=6)
+    rules = FrRules(B=B)
+    rules.fit(unit_ids=[3], nspike=6)
+    np.testing.assert_array_equal(_stream(rules, counts, B), _stream(threshold, counts, B))
+
+
+def test_fr_rules_all():
+    counts, B = _bins(500, 6, seed=1), 4
+    rules = FrRules(B=B)
+    rules.fit(unit_ids=[1, 2], nspike=3, k='all')
+    X = np.zeros((B, 6), dtype=np.int64)
+    active = False
+    for row in counts:
+        X[:-1] = X[1:]
+        X[-1] = row
+        fire = bool((X[:, [1, 2]].sum(axis=0) >= 3).all())
+        assert rules.predict(X) == int(fire and not active)
+        active = fire
+
+
+def test_fr_rules_rejects_unknown_unit():
+    rules = FrRules(B=4)
+    rules.fit(unit_ids=[2, 99], nspike=1)
+    with pytest.raises(ValueError):
+        rules.predict(np.ones((4, 6), dtype=np.int64))
+
+
+@pytest.mark.parametrize('dtype', [np.int64, np.float64, np.int32])
+def test_fr_rules_follows_x_dtype(dtype):
+    counts, B = _bins(100, 4, dtype=dtype), 5
+    rules = FrRules(B=B)
+    rules.fit(unit_ids=[1], nspike=3)
+    _stream(rules, counts, B)
+    assert rules.counts.dtype == dtype
+    assert rules.counts[0] == counts[-B:, 1].sum()
+
+
+def test_population_rules():
+    counts, B = _bins(500, 6, seed=2), 6
+    rules = [dict(unit_ids=[1, 2], nspike=5), dict(unit_ids=[4], nspike=3)]
+    population = Population(B=B)
+    population.fit(rules=rules)
+    y = _stream(population, counts, B)
+
+    # a row fires when the summed window count of its units reaches nspike
+    window = np.cumsum(counts, axis=0)
+    window[B:] -= window[:-B]
+    fire = np.column_stack([window[:, [1, 2]].sum(axis=1) >= 5, window[:, 4] >= 3])
+    onset = (fire & ~np.r_[np.zeros((1, 2), dtype=bool), fire[:-1]]).any(axis=1)
+    np.testing.assert_array_equal(y, onset.astype(int))
+
+
+def test_population_needs_weights():
+    with pytest.raises(ValueError):
+        Population(B=4).fit()
+    population = Population(B=4)
+    population.fit(W=[[0, 1, 0, 0, 0, 0, 0, 1]])
+    with pytest.raises(ValueError):
+        population.predict(np.ones((4, 6)))
+
+
+def test_adaptive_threshold_uses_frame_clock():
+    # bins 10 frames apart on the clock, only every 5th one emitted
+    frame = [0]
+    dec = AdaptiveThreshold(unit_id=1, nspike=1, target_rate=1.0, bin_size=0.0004,
+                            update_interval=1.0, warmup=2.0, clock=lambda: frame[0], fs=25000)
+    X = np.zeros((1, 3), dtype=np.int64)
+    for i in range(2000):
+        frame[0] = 50 * (i + 1)
+        X[-1, 1] = i % 2
+        dec.predict(X)
+    assert dec.n_bin == 2000
+    np.testing.assert_allclose(dec.t, 4.0, atol=0.002)
+    assert len(dec.trace) == 2 # warmup at 2 s, then every second
+    # an onset every other bin is 250 Hz of stream time, not 1250 Hz of emitted bins
+    np.testing.assert_allclose(dec.sketch.onset_rate()[1], 250.0, rtol=0.01)
@@ -0,0 +1,26 @@
+import pytest
+
+from nctrl import protocol
+from nctrl.events import SpikeTrigger
+
+
+def test_spike_trigger_coalesces_per_window():
+    frames = []
+    trigger = SpikeTrigger(frames.append, unit_ids=[3, 5], window=0.001)
+    for frame, spk_id in [(0, 3), (5, 3), (10, 5), (12, 4), (20, 99), (30, 5), (60, 3)]:
+        trigger(frame, spk_id)
+    # unit 3 -> pin 0, unit 5 -> pin 1; a window is 25 frames from its first spike
+    assert frames == [(protocol.SPIKES, 0b01), (protocol.SPIKES, 0b11), (protocol.SPIKES, 0b10), (protocol.SPIKES, 0b01)]
+    assert (trigger.n_spikes, trigger.n_frames, trigger.n_coalesced) == (5, 4, 1)
+
+
+def test_spike_trigger_pins():
+    frames = []
+    trigger = SpikeTrigger(frames.append, pins={2: [0, 15]})
+    trigger(0, 2)
+    assert frames == [(protocol.SPIKES, 0x8001)]
+    with pytest.raises(ValueError):
+        SpikeTrigger(frames.append, unit_ids=range(17))
+    for pins in ({2: 16}, {2: [3, -1]}, {-1: 0}):
+        with pytest.raises(ValueError):
+            SpikeTrigger(frames.append, pins=pins)
@@ -0,0 +1,54 @@
+import time
+import numpy as np
+import pytest
+
+from nctrl import protocol
+from nctrl.latency import Latency
+
+
+class _Serial():
+    def __init__(self):
+        self.frames = []
+
+    def write(self, frame):
+        time.sleep(0.0002)
+        self.frames.append(frame)
+
+
+def test_intervals():
+    latency = Latency(size=8)
+    for i in range(10):
+        latency.open()
+        latency.written(latency.row, 1000 * i + 900)
+        latency.record(25 * i, 1000 * i, 1000 * i + 100, 1000 * i + 300)
+    assert len(latency.data) == 8
+    dt = latency.intervals()
+    np.testing.assert_allclose(dt['emit->predict'], 0.1)
+    np.testing.assert_allclose(dt['predict->output'], 0.2)
+    np.testing.assert_allclose(dt['output->write'], 0.6)
+    np.testing.assert_allclose(dt['emit->write'], 0.9)
+
+
+def test_serial_writer_stamps_bins():
+    pytest.importorskip('serial')
+    from nctrl.output import SerialWriter
+
+    latency = Latency()
+    writer = SerialWriter(_Serial(), coalesce=())
+    writer.latency = latency
+    writer.start()
+    for i in range(20):
+        t_emit = time.perf_counter_ns()
+        latency.open()
+        if i % 2 == 0:
+            writer.write((protocol.LASER_START, 0))
+        latency.record(i, t_emit, t_emit, time.perf_counter_ns())
+        writer.write((protocol.SPIKES, 1)) # between bins, e.g. a SpikeTrigger
+        time.sleep(0.001)
+    writer.stop()
+
+    t = latency.data
+    assert len(writer.ser.frames) == 30
+    assert (t[0::2, 4] > t[0::2, 1]).all()
+    assert (t[1::2, 4] == 0).all()
+    assert len(latency.intervals()['emit->write']) == 10
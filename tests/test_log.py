@@ -0,0 +1,54 @@
+import numpy as np
+
+from nctrl import protocol
+from nctrl.log import SessionLog, load_log
+
+
+class _Dec():
+    def __init__(self, is_active, nspike):
+        self.is_active = is_active
+        self.nspike = nspike
+
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / 'session.nclog')
+    log = SessionLog(filename, size=16, flush_interval=0.01)
+    X = np.zeros((4, 3), dtype=np.int64)
+    for i in range(10):
+        X[-1] = [i, 2 * i, 3 * i]
+        dec = _Dec(np.array([i % 2, 1, 0], dtype=bool), [3, 4]) if i % 3 else _Dec(True, 5)
+        log.record(25 * i, i, i + 1, X, dec, (protocol.LASER_START, i) if i == 4 else None)
+    log.close()
+
+    meta, records = load_log(filename)
+    assert meta['fs'] == 25000 and len(records) == 10 and log.n_lost == 0
+    np.testing.assert_array_equal(records['frame'], 25 * np.arange(10))
+    np.testing.assert_array_equal(records['counts'][:, 2], 3 * np.arange(10))
+    np.testing.assert_array_equal(records['state'], [1, 3, 2, 1, 2, 3, 1, 3, 2, 1])
+    assert np.isnan(records['threshold'][1]) and records['threshold'][3] == 5
+    assert records['cmd'][4] == protocol.LASER_START and records['arg'][4] == 4
+    assert records['cmd'].sum() == protocol.LASER_START
+
+
+def test_lost_records(tmp_path):
+    filename = str(tmp_path / 'session.nclog')
+    log = SessionLog(filename, size=8, flush_interval=60)
+    X = np.zeros((1, 2), dtype=np.int64)
+    log.record(0, 0, 0, X, _Dec(False, 1), None)
+    log._flush()
+    for i in range(1, 21):
+        log.record(i, 0, 0, X, _Dec(False, 1), None)
+    log.close()
+
+    meta, records = load_log(filename)
+    assert log.n_lost == 12
+    np.testing.assert_array_equal(records['frame'], np.r_[0, 13:21])
+
+
+def test_empty_log(tmp_path):
+    filename = str(tmp_path / 'session.nclog')
+    log = SessionLog(filename)
+    log._allocate(2) # header only, no bin recorded
+    log.close()
+    meta, records = load_log(filename)
+    assert len(records) == 0 and records.dtype['counts'].shape == (2,)
@@ -0,0 +1,19 @@
+import numpy as np
+
+from nctrl.mua import convert_mua, MuaFile
+
+
+def test_convert_mua_round_trip(tmp_path):
+    n_ch = 6
+    data = np.random.default_rng(0).integers(-40000, 40000, (1000, n_ch)).astype(np.int32)
+    src = str(tmp_path / 'mua.bin')
+    data.tofile(src)
+    mua = convert_mua(src, n_ch=n_ch, chunk=128, n_workers=1)
+
+    clipped = np.clip(data, -32768, 32767)
+    assert mua.shape == data.shape and mua.dtype == np.int16
+    np.testing.assert_array_equal(mua.n_clipped, (clipped != data).sum(axis=0))
+    np.testing.assert_array_equal(mua.read(), clipped)
+    np.testing.assert_array_equal(mua.read(100, 700, channels=[4, 1]), clipped[100:700, [4, 1]])
+    np.testing.assert_array_equal(MuaFile(mua.filename).read_time(0.002, 0.004, channels=2), clipped[50:100, [2]])
+    assert mua.read(900, 2000).shape == (100, n_ch) and mua.read(500, 400).shape == (0, n_ch)
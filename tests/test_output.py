@@ -0,0 +1,19 @@
+import pytest
+
+pytest.importorskip('serial')
+
+from nctrl import protocol
+from nctrl.output import SerialWriter
+
+
+def test_dropped_command_is_not_coalesced():
+    START, ABORT = (protocol.LASER_START, 0), (protocol.LASER_ABORT, 0)
+    writer = SerialWriter(None, maxlen=1, policy='drop_newest')
+    writer.write(START)
+    writer.write(ABORT) # queue full: dropped
+    assert writer.n_dropped == 1
+    writer._queue.popleft() # the writer thread sent START
+    writer.write(ABORT)
+    writer.write(ABORT)
+    assert [cmd for cmd, row in writer._queue] == [ABORT]
+    assert writer.n_coalesced == 1
@@ -0,0 +1,76 @@
+import time
+import pytest
+
+from nctrl import protocol
+
+
+def _bad_checksum(cmd, arg=0, seq=0):
+    frame = bytearray(protocol.encode(cmd, arg, seq))
+    frame[-1] ^= 0xff
+    return bytes(frame)
+
+
+def _bad_version(cmd, arg=0, seq=0):
+    frame = bytearray(protocol.encode(cmd, arg, seq))
+    frame[1] = protocol.VERSION + 1
+    frame[-1] = sum(frame[:-1]) & 0xff
+    return bytes(frame)
+
+
+def test_round_trip():
+    encode = protocol.Encoder()
+    frames = encode((protocol.SET_DURATION, 500)) + encode((protocol.SPIKES, 0x8001))
+    assert protocol.Parser().feed(frames) == [(protocol.SET_DURATION, 0, 500), (protocol.SPIKES, 1, 0x8001)]
+
+
+def test_parser_resyncs_byte_by_byte():
+    parser = protocol.Parser()
+    data = b'\x00\x13' + _bad_checksum(protocol.ENABLE) + protocol.encode(protocol.DISABLE, seq=7)
+    assert parser.feed(data[:5]) == []
+    assert parser.feed(data[5:]) == [(protocol.DISABLE, 7, 0)]
+    assert parser.n_errors == 1
+
+
+def test_parser_reports_errors():
+    parser = protocol.Parser(errors=True)
+    frames = parser.feed(_bad_checksum(protocol.ENABLE, seq=3) + _bad_version(protocol.ENABLE, seq=4)
+                         + protocol.encode(protocol.DISABLE, seq=5))
+    assert [(f.code, f.seq) for f in frames[:2]] == [(protocol.ERR_CHECKSUM, 3), (protocol.ERR_VERSION, 4)]
+    assert frames[2] == (protocol.DISABLE, 5, 0)
+
+
+@pytest.fixture
+def laser():
+    pytest.importorskip('serial')
+    from nctrl.emulator import TeensyEmulator
+    from nctrl.output import Laser
+    emulator = TeensyEmulator()
+    emulator.start()
+    laser = Laser(emulator.port, threaded=False)
+    yield laser
+    laser.close()
+    emulator.stop()
+
+
+def _replies(laser, n, timeout=1.0):
+    parser, replies = protocol.Parser(), []
+    deadline = time.perf_counter() + timeout
+    while len(replies) < n and time.perf_counter() < deadline:
+        replies += parser.feed(laser.ser.read(laser.ser.in_waiting or 1))
+        time.sleep(0.001)
+    return replies
+
+
+def test_emulator_acks(laser):
+    assert laser.ping() == protocol.VERSION
+
+
+def test_emulator_naks_like_the_firmware(laser):
+    laser.ser.write(_bad_checksum(protocol.PING | protocol.ACK_REQ, seq=11))
+    laser.ser.write(_bad_version(protocol.PING | protocol.ACK_REQ, seq=12))
+    laser.ser.write(protocol.encode(0x55 | protocol.ACK_REQ, seq=13))
+    assert _replies(laser, 3) == [(protocol.NAK, 11, protocol.ERR_CHECKSUM), (protocol.NAK, 12, protocol.ERR_VERSION),
+                                  (protocol.NAK, 13, protocol.ERR_COMMAND)]
+
+    laser.ser.write(_bad_checksum(protocol.PING | protocol.ACK_REQ, seq=14))
+    assert laser.print_serial() is None
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('spiketag')
+
+from nctrl.bench import generate
+from nctrl.replay import Replay
+
+
+def _replay(fetfile, bin_size=0.01, B=10):
+    replay = Replay(fetfile)
+    replay.set_binner(bin_size=bin_size, B_bins=B)
+    bins = []
+    replay.binner.connect(lambda X: bins.append(X.shape))
+    return replay, bins
+
+
+def test_stats(tmp_path):
+    generate(str(tmp_path), n_unit=4, duration=5, rate=10.0)
+    replay, bins = _replay(str(tmp_path / 'fet.bin'))
+    fet = np.fromfile(str(tmp_path / 'fet.bin'), dtype=np.int32).reshape(-1, 8)
+    assert replay.n_units == fet[:, 6].max()
+
+    stats = replay.run()
+    assert stats['n_spikes'] == len(fet)
+    assert stats['n_bins'] == len(bins) > 0
+    assert bins[0] == (10, replay.n_units + 1)
+    np.testing.assert_allclose(replay.duration, (fet[-1, 0] - fet[0, 0]) / 25000)
+
+
+def test_speed(tmp_path):
+    generate(str(tmp_path), n_unit=2, duration=0.5, rate=20.0)
+    replay, bins = _replay(str(tmp_path / 'fet.bin'))
+    stats = replay.run(speed=5.0)
+    # never faster than asked, a spike is not sent before its scaled time
+    assert stats['elapsed'] >= replay.duration / 5.0
+    assert 2.5 < stats['realtime_factor'] <= 5.0
+
+
+def test_empty_file(tmp_path):
+    empty = tmp_path / 'fet.bin'
+    empty.write_bytes(b'')
+    replay, bins = _replay(str(empty))
+    assert replay.n_units == 0 and replay.duration == 0
+    stats = replay.run()
+    assert (stats['n_spikes'], stats['n_bins'], len(bins)) == (0, 0, 0)
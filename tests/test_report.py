@@ -0,0 +1,43 @@
+import numpy as np
+
+from nctrl import protocol
+from nctrl.log import SessionLog, load_log
+from nctrl.report import log_triggers, laser_trains, match_triggers, summary
+
+
+class _Dec():
+    is_active = False
+    nspike = 3
+
+
+def test_log_triggers_round_trip(tmp_path):
+    filename = str(tmp_path / 'session.nclog')
+    log = SessionLog(filename, fs=25000)
+    X = np.zeros((10, 4), dtype=np.int64)
+    commands = [None, (protocol.LASER_START, 0), (protocol.LASER_ABORT, 0),
+                (protocol.LASER_START | protocol.ACK_REQ, 0), (protocol.SPIKES, 3)]
+    for i, command in enumerate(commands):
+        log.record(2500 * (i + 1), 0, 0, X, _Dec(), command)
+    log.close()
+
+    meta, records = load_log(filename)
+    assert len(records) == len(commands)
+    np.testing.assert_allclose(log_triggers(filename), [0.2, 0.4])
+
+
+def test_match_triggers():
+    intervals = np.array([[1.000, 1.005], [1.025, 1.030], [2.000, 2.005], [3.000, 3.005]])
+    trains = laser_trains(intervals, train_gap=0.05)
+    np.testing.assert_allclose(trains, [[1.000, 1.030], [2.000, 2.005], [3.000, 3.005]])
+
+    # matched, absorbed (inside train 0), matched, second trigger to train 1, missed
+    triggers = np.array([0.998, 1.010, 1.997, 1.999, 5.0])
+    result = match_triggers(triggers, trains, max_latency=0.05)
+    np.testing.assert_array_equal(result['matched'], [True, False, True, False, False])
+    np.testing.assert_array_equal(result['absorbed'], [False, True, False, True, False])
+    np.testing.assert_array_equal(result['missed'], [False, False, False, False, True])
+    np.testing.assert_array_equal(result['spurious'], [2])
+    np.testing.assert_allclose(result['latency'], [0.002, 0.003])
+
+    stats = summary(result)
+    assert (stats['n_matched'], stats['n_absorbed'], stats['n_missed'], stats['n_spurious']) == (2, 2, 1, 1)
@@ -0,0 +1,96 @@
+import threading
+import numpy as np
+
+from nctrl.router import Router
+
+
+class _Dec():
+    def __init__(self, y):
+        self.y = y
+        self.n = 0
+
+    def predict(self, X):
+        self.n += 1
+        return self.y
+
+
+class _Output():
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def __call__(self, y):
+        self.sent.append(y)
+
+    def close(self):
+        self.closed = True
+
+
+def test_fan_out():
+    router = Router()
+    main, aux = _Output(), _Output()
+    router.add_output('main', main)
+    router.add_output('aux', aux)
+    router.attach('main', _Dec(1))
+    router.attach('pop', _Dec(0), outputs=('aux', 'main'))
+
+    X = np.zeros((4, 3))
+    router.send(router.predict(X))
+    assert main.sent == [1, 0]
+    assert aux.sent == [0]
+
+    router.detach('pop')
+    router.send(router.predict(X))
+    assert main.sent == [1, 0, 1]
+    assert aux.sent == [0]
+
+
+def test_replaced_and_removed_outputs_are_closed():
+    router = Router()
+    first, second = _Output(), _Output()
+    router.add_output('main', first)
+    router.attach('main', _Dec(1))
+    router.add_output('main', second)
+    assert first.closed and not second.closed
+    router.send(router.predict(np.zeros((1, 1))))
+    assert first.sent == [] and second.sent == [1]
+
+    router.remove_output('main')
+    assert second.closed
+    router.send(router.predict(np.zeros((1, 1)))) # the route is kept, with no outputs
+
+
+def test_attach_between_predict_and_send():
+    router = Router()
+    out = _Output()
+    router.add_output('main', out)
+    router.attach('a', _Dec(1))
+    routed = router.predict(np.zeros((1, 1)))
+    router.attach('b', _Dec(0))
+    router.send(routed)
+    assert out.sent == [1]
+
+
+def test_attach_while_streaming():
+    router = Router()
+    router.add_output('main', _Output())
+    router.attach('main', _Dec(1))
+    errors = []
+    done = threading.Event()
+
+    def stream():
+        X = np.zeros((1, 1))
+        try:
+            while not done.is_set():
+                router.send(router.predict(X))
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=stream)
+    thread.start()
+    for i in range(2000):
+        router.attach(f'dec{i % 7}', _Dec(i))
+        router.detach(f'dec{(i + 3) % 7}')
+    done.set()
+    thread.join()
+    assert errors == []
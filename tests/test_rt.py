@@ -0,0 +1,46 @@
+import gc
+import os
+import threading
+import pytest
+
+from nctrl.rt import RealtimeMode
+
+
+def test_gc_is_restored():
+    enabled = gc.isenabled()
+    with RealtimeMode() as rt:
+        assert rt.active and not gc.isenabled()
+        gc.collect()
+    assert gc.isenabled() == enabled
+    assert rt.n_gc == 1
+    assert rt._on_gc not in gc.callbacks
+
+
+@pytest.mark.skipif(not hasattr(os, 'sched_setscheduler'), reason='needs the linux scheduler calls')
+def test_nice_fallback_is_restored(monkeypatch):
+    def refuse(*args):
+        raise PermissionError('SCHED_FIFO not permitted')
+    monkeypatch.setattr(os, 'sched_setscheduler', refuse)
+
+    rt = RealtimeMode(priority=10)
+    pinned, done = threading.Event(), threading.Event()
+    nice = {}
+
+    def decode():
+        nice['before'] = os.getpriority(os.PRIO_PROCESS, 0)
+        rt.pin()
+        nice['pinned'] = os.getpriority(os.PRIO_PROCESS, 0)
+        pinned.set()
+        done.wait()
+        nice['after'] = os.getpriority(os.PRIO_PROCESS, 0)
+
+    thread = threading.Thread(target=decode)
+    rt.enter()
+    thread.start()
+    pinned.wait()
+    rt.exit()
+    done.set()
+    thread.join()
+    assert nice['after'] == nice['before']
+    if nice['pinned'] == nice['before']:
+        pytest.skip('no permission to lower the nice value here')
@@ -0,0 +1,36 @@
+import numpy as np
+
+from nctrl.shm import SpikeRing
+
+
+def test_reader_sees_new_records_only():
+    ring = SpikeRing(size=8)
+    try:
+        ring.push(1, 10)
+        reader = ring.reader()
+        assert len(reader.read()) == 0
+        for i in range(2, 7):
+            ring.push(i, 10 * i)
+        np.testing.assert_array_equal(reader.read(), np.c_[2:7, 20:70:10])
+        ring.push_many(np.c_[7:12, 70:120:10].astype(np.int32)) # wraps around
+        np.testing.assert_array_equal(reader.read(), np.c_[7:12, 70:120:10])
+        assert reader.n_lost == 0
+    finally:
+        ring.close()
+
+
+def test_lapped_reader_counts_lost():
+    ring = SpikeRing(size=8)
+    try:
+        reader = ring.reader(from_start=True)
+        for i in range(20):
+            ring.push(i, i)
+        np.testing.assert_array_equal(reader.read()[:, 0], np.arange(12, 20))
+        assert reader.n_lost == 12
+
+        other = SpikeRing(name=ring.name, create=False)
+        assert other.size == 8 and other.cursor == 20
+        np.testing.assert_array_equal(other.reader(from_start=True).read()[:, 0], np.arange(12, 20))
+        other.close()
+    finally:
+        ring.close()
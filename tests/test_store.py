@@ -0,0 +1,65 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from nctrl.bench import generate
+from nctrl.store import SpikeStore, WaveformStore, CountPyramid
+
+
+@pytest.fixture(scope='module')
+def store(tmp_path_factory):
+    path = tmp_path_factory.mktemp('session')
+    return SpikeStore(generate(str(path), n_unit=6, duration=20, rate=8.0))
+
+
+def _brute_counts(store, bin_frames):
+    n_bin = (store.end_frame - store.start_frame) // bin_frames + 1
+    return np.array([np.bincount((store.unit(i) - store.start_frame) // bin_frames, minlength=n_bin)
+                     for i in range(store.n_unit)])
+
+
+@pytest.mark.parametrize('bin_size', [0.00004, 0.0004, 0.001, 0.01, 0.05, 0.1, 1.0])
+def test_counts_match_histogram(store, bin_size):
+    pyramid = CountPyramid(store)
+    bin_frames = int(round(bin_size * store.fs))
+    np.testing.assert_array_equal(pyramid.counts(bin_size), _brute_counts(store, bin_frames))
+
+
+def test_levels_serve_decoder_bins(store):
+    pyramid = CountPyramid(store, cache=False)
+    for bin_size in (0.0004, 0.001, 0.01, 0.1):
+        pyramid.counts(bin_size, units=[0], start=0, stop=10)
+    assert sorted(pyramid.levels) == [10, 25, 250, 2500]
+    assert pyramid._key is None # the sparse fallback was never needed
+
+
+def test_window(store):
+    pyramid = CountPyramid(store, levels=())
+    counts = pyramid.counts(0.01)
+    B = 5
+    causal = pyramid.window(0.01, B)
+    same = pyramid.window(0.01, B, mode='same')
+    for i in range(store.n_unit):
+        np.testing.assert_array_equal(causal[i], np.convolve(counts[i], np.ones(B, dtype=int))[:counts.shape[1]])
+        np.testing.assert_array_equal(same[i], np.convolve(counts[i], np.ones(B, dtype=int), 'same'))
+
+
+def test_waveform_index(store):
+    spkwav = WaveformStore(os.path.join(os.path.dirname(os.path.dirname(store.spike_file)), 'spk_wav.bin'))
+    assert len(spkwav) == len(pd.read_pickle(store.spike_file))
+    spkwav.index_units(store)
+    for i in range(store.n_unit):
+        records = spkwav.unit(i)
+        np.testing.assert_array_equal(np.sort(spkwav.spk_time[records]), store.unit(i))
+
+
+def test_empty_waveform_file(store, tmp_path):
+    empty = tmp_path / 'spk_wav.bin'
+    empty.write_bytes(b'')
+    spkwav = WaveformStore(str(empty))
+    assert len(spkwav) == 0
+    unit_record = spkwav.index_units(store)
+    assert len(unit_record) == len(store.spike_time) and (unit_record == -1).all()
+    assert len(spkwav.unit(0)) == 0
+    assert len(spkwav.time_range(0, 100)) == 0
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from nctrl.sync import Edges, EdgeDecoder, filter_pulses, match_sync, ClockMap, to_intervals, in_intervals, nidq_edges
+
+
+def _sync(n=40, seed=0):
+    # irregular SYNC intervals so every lag has a distinct pattern
+    return np.cumsum(np.random.default_rng(seed).uniform(0.5, 1.5, n))
+
+
+def test_match_sync_skips_extra_edges():
+    src = _sync()
+    dst = 3.0 + src * (1 + 20e-6)
+    # dst missed the first 3 pulses and has 2 extra at the end
+    s, d = match_sync(src, np.r_[dst[3:], dst[-1] + [0.7, 1.9]])
+    np.testing.assert_array_equal(s, src[3:])
+    np.testing.assert_allclose(d, dst[3:])
+
+
+def test_match_sync_needs_a_pattern():
+    with pytest.raises(ValueError):
+        match_sync([1.0], [1.0, 2.0])
+    with pytest.raises(ValueError):
+        match_sync(np.arange(10) * 1.0, np.arange(10) * 3.0)
+
+
+def test_clock_map():
+    src = _sync()
+    dst = 3.0 + src * 1.00002 + 1e-4 * np.sin(src)
+    clock = ClockMap(src, dst)
+    np.testing.assert_allclose(clock(src), dst)
+    # piecewise linear between edges, the mean rate outside the span
+    mid = (src[4] + src[5]) / 2
+    np.testing.assert_allclose(clock(mid), (dst[4] + dst[5]) / 2)
+    np.testing.assert_allclose(clock([src[0] - 2, src[-1] + 2]), [dst[0] - 2 * clock.rate, dst[-1] + 2 * clock.rate])
+    t = np.linspace(src[0] - 5, src[-1] + 5, 101)
+    np.testing.assert_allclose(clock.inverse()(clock(t)), t)
+
+
+def test_edge_decoder_across_chunks():
+    level = np.zeros(100, dtype=np.uint16)
+    level[10:20] = level[49:51] = level[70:] = 1 << 4
+    decoder = EdgeDecoder({'SYNC': 4})
+    found = [decoder.feed(chunk)['SYNC'] for chunk in np.split(level, [15, 50, 70])]
+    rising = np.concatenate([e.rising for e in found])
+    falling = np.concatenate([e.falling for e in found])
+    np.testing.assert_array_equal(rising, [10, 49, 70])
+    np.testing.assert_array_equal(falling, [20, 51])
+
+    rising, falling = filter_pulses(Edges(rising, falling), min_width=5)
+    np.testing.assert_array_equal(rising, [10, 70])
+    np.testing.assert_array_equal(falling, [20])
+
+
+def test_nidq_edges(tmp_path):
+    samples = np.zeros((1000, 3), dtype=np.int16)
+    samples[100:300, 2] |= 1 << 6
+    samples[500:510, 2] |= 1 << 4
+    filename = str(tmp_path / 'run.nidq.bin')
+    samples.tofile(filename)
+    edges = nidq_edges(filename, n_ch=3, chunk=128)
+    np.testing.assert_array_equal(edges['LASER'].rising, [100])
+    np.testing.assert_array_equal(edges['LASER'].falling, [300])
+    np.testing.assert_array_equal(edges['SYNC'].rising, [500])
+
+
+def test_intervals():
+    # a leading falling edge and a trailing rising edge are not pulses
+    intervals = to_intervals(Edges(np.array([10, 30, 50]), np.array([5, 20, 40])))
+    np.testing.assert_array_equal(intervals, [[10, 20], [30, 40]])
+    np.testing.assert_array_equal(in_intervals(intervals, [9, 10, 19, 20, 35, 45]),
+                                  [False, True, True, False, True, False])
+    np.testing.assert_array_equal(to_intervals(Edges(np.array([10]), np.array([20])), lambda t: 2 * t), [[20, 40]])
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from nctrl.bench import generate
+from nctrl.report import model_triggers
+from nctrl.unit import Unit
+
+
+@pytest.fixture(scope='module')
+def unit(tmp_path_factory):
+    path = tmp_path_factory.mktemp('session')
+    unit = Unit()
+    unit.load(generate(str(path), n_unit=3, duration=30, rate=20.0, burst_fraction=0.6, burst_isi=0.002))
+    return unit
+
+
+def _onsets(frames, bin_size, B, nspike):
+    # FrThreshold over the causal B-bin window, bin by bin
+    bin_frames = int(round(bin_size * 25000))
+    counts = np.bincount(frames // bin_frames)
+    window = np.convolve(counts, np.ones(B, dtype=int))[:len(counts)]
+    above = window >= nspike
+    onset = np.flatnonzero(above & ~np.r_[False, above[:-1]])
+    return (onset + 1) * bin_size
+
+
+def test_sweep_matches_threshold(unit):
+    bin_sizes, Bs, nspikes = (0.0004, 0.001, 0.01), (1, 2, 5, 20), (1, 2, 3, 7, 15)
+    df = unit.sweep(bin_sizes=bin_sizes, Bs=Bs, nspikes=nspikes)
+    assert len(df) == unit.n_unit * len(bin_sizes) * len(Bs) * len(nspikes)
+    for row in df.itertuples():
+        expected = _onsets(unit.store.unit(row.unit_id - 1), row.bin_size, row.B, row.nspike)
+        assert row.n_onset == len(expected)
+        np.testing.assert_allclose(row.onset_time, expected)
+
+    counts_only = unit.sweep(bin_sizes=bin_sizes, Bs=Bs, nspikes=nspikes, onset_time=False)
+    assert 'onset_time' not in counts_only
+    np.testing.assert_array_equal(counts_only['n_onset'], df['n_onset'])
+
+
+def test_sweep_silent_unit(tmp_path):
+    model_file = generate(str(tmp_path), n_unit=3, duration=10, rate=20.0)
+    df = pd.read_pickle(model_file)
+    df[df['spike_id'] != 2].to_pickle(model_file) # unit 2 never fires
+    unit = Unit()
+    unit.load(model_file)
+    assert unit.n_unit == 3
+
+    df = unit.sweep(bin_sizes=(0.001, 0.01), Bs=(1, 5), nspikes=(1, 3))
+    silent = df[df['unit_id'] == 2]
+    assert len(silent) == 8 and (silent['n_onset'] == 0).all()
+    assert all(len(t) == 0 for t in silent['onset_time'])
+    for row in df[df['unit_id'] != 2].itertuples():
+        np.testing.assert_allclose(row.onset_time, _onsets(unit.store.unit(row.unit_id - 1), row.bin_size, row.B, row.nspike))
+    assert len(model_triggers(unit, 2, 0.01, 5, 3)) == 0
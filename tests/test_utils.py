@@ -0,0 +1,13 @@
+import multiprocessing
+import pytest
+
+from nctrl.utils import tprint
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+def test_tprint_in_forked_child(capfd):
+    child = multiprocessing.get_context('fork').Process(target=tprint, args=('nctrl child',))
+    child.start()
+    child.join()
+    assert child.exitcode == 0
+    assert 'nctrl child' in capfd.readouterr().out